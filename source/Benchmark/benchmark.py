@@ -0,0 +1,496 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import statistics
+import tracemalloc
+import contextlib
+from pathlib import Path
+
+# Make the pipeline scripts importable
+source_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(source_dir / 'Model'))
+sys.path.append(str(source_dir / 'Preprocess'))
+
+import fitz  # PyMuPDF for synthetic PDF generation
+import my_retrieve
+import pdfplumber
+from ExtractPDF import extract_pdf_content, extract_pdf_text, pdfplumber_page_text, pymupdf_page_text
+from MultiTypeTag import has_tables
+from makeDict import combine_json_files
+from textandExtract import combine_text_and_json
+
+# Absolute slack so that sub-millisecond cases and tiny allocations do not flap
+MIN_TIME_SLACK = 0.002
+MIN_MEMORY_SLACK_KIB = 64
+
+# Characters used to generate synthetic Traditional Chinese filings
+CJK_CHARS = "本公司集團民國年月日合併財務報告保險契約被保險人身故保險金給付條款營業收入淨利資產負債現金股東權益第季"
+
+def synthetic_text(rng: random.Random, num_chars: int) -> str:
+    """
+    Generate deterministic pseudo text mixing CJK characters and figures
+
+    Args:
+        rng: Seeded random generator
+        num_chars: Approximate number of characters to generate
+
+    Returns:
+        str: Generated text
+    """
+    parts = []
+    length = 0
+    while length < num_chars:
+        if rng.random() < 0.15:
+            part = f" {rng.randint(1, 9999999):,} 千元 "
+        else:
+            part = ''.join(rng.choice(CJK_CHARS) for _ in range(rng.randint(4, 20)))
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+def make_synthetic_document(rng: random.Random, num_pages: int, page_chars: int) -> dict:
+    """
+    Build a document shaped like the files in updated_*_output
+
+    Args:
+        rng: Seeded random generator
+        num_pages: Number of vision page responses
+        page_chars: Characters per page
+
+    Returns:
+        dict: Document with 'combined_responses' and 'raw_text'
+    """
+    pages = [synthetic_text(rng, page_chars) for _ in range(num_pages)]
+    return {
+        'combined_responses': [
+            json.dumps({f"page{n}_text": text}, ensure_ascii=False)
+            for n, text in enumerate(pages, 1)
+        ],
+        'raw_text': '\n\n'.join(pages)
+    }
+
+def make_synthetic_faq(rng: random.Random, num_pids: int) -> dict:
+    """
+    Build a FAQ map shaped like pid_map_content.json
+
+    Args:
+        rng: Seeded random generator
+        num_pids: Number of FAQ entries
+
+    Returns:
+        dict: Mapping from integer pid to a list of question/answers entries
+    """
+    return {
+        pid: [
+            {
+                'question': synthetic_text(rng, 20) + '?',
+                'answers': [synthetic_text(rng, 60) for _ in range(rng.randint(1, 3))]
+            }
+            for _ in range(rng.randint(1, 4))
+        ]
+        for pid in range(num_pids)
+    }
+
+def make_synthetic_pdf(pdf_path: str, num_pages: int, rng: random.Random) -> None:
+    """
+    Write a PDF whose pages contain a heading, a ruled table, body text and an image
+
+    Args:
+        pdf_path: Path of the PDF to create
+        num_pages: Number of pages
+        rng: Seeded random generator
+    """
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((50, 60), f"Synthetic Financial Report - page {page_num + 1}", fontsize=14)
+
+        # Ruled table: 6 rows x 4 columns
+        x0, y0, col_w, row_h = 50, 90, 120, 22
+        for row in range(7):
+            page.draw_line((x0, y0 + row * row_h), (x0 + 4 * col_w, y0 + row * row_h))
+        for col in range(5):
+            page.draw_line((x0 + col * col_w, y0), (x0 + col * col_w, y0 + 6 * row_h))
+        for row in range(6):
+            for col in range(4):
+                cell = "Item" if col == 0 else f"{rng.randint(1, 9999999):,}"
+                page.insert_text((x0 + col * col_w + 4, y0 + row * row_h + 15), f"{cell} {row}", fontsize=9)
+
+        # Body text lines
+        y = y0 + 6 * row_h + 30
+        for line in range(25):
+            words = ' '.join(f"word{rng.randint(0, 999)}" for _ in range(10))
+            page.insert_text((50, y), words, fontsize=9)
+            y += 13
+
+        # Embedded raster image
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+        pix.set_rect(pix.irect, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        page.insert_image(fitz.Rect(400, 700, 528, 828), pixmap=pix)
+    doc.save(pdf_path)
+    doc.close()
+
+def make_synthetic_text_pdf(pdf_path: str, num_pages: int, rng: random.Random) -> None:
+    """
+    Write a text-heavy PDF like the insurance terms: CJK clauses with some Latin lines and two-column rows
+
+    Args:
+        pdf_path: Path of the PDF to create
+        num_pages: Number of pages
+        rng: Seeded random generator
+    """
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((50, 50), f"第{page_num + 1}條 {synthetic_text(rng, 8)}", fontname="china-t", fontsize=14)
+        y = 76
+        while y < 800:
+            fontsize = rng.choice([9, 10, 11])
+            if rng.random() < 0.2:
+                page.insert_text((50, y), f"Policy No. {rng.randint(1, 99999):,} and clause {rng.randint(1, 40)}.", fontsize=fontsize)
+                page.insert_text((320, y), synthetic_text(rng, 10), fontname="china-t", fontsize=fontsize)
+            else:
+                page.insert_text((50, y), synthetic_text(rng, rng.randint(20, 40)), fontname="china-t", fontsize=fontsize)
+            y += fontsize + rng.choice([3, 4, 6])
+    doc.save(pdf_path)
+    doc.close()
+
+def setup_load_data_json(workdir: str, scale: int):
+    """Corpus directory of synthetic documents loaded by my_retrieve.load_data_json"""
+    rng = random.Random(26)
+    corpus_dir = os.path.join(workdir, 'corpus')
+    os.makedirs(corpus_dir)
+    for doc_id in range(100 * scale):
+        with open(os.path.join(corpus_dir, f'{doc_id}.json'), 'w', encoding='utf-8') as f:
+            json.dump(make_synthetic_document(rng, 5, 800), f, ensure_ascii=False, indent=4)
+    return lambda: my_retrieve.load_data_json(corpus_dir)
+
+def setup_build_context(workdir: str, scale: int):
+    """Context building in LLM_API over a finance-sized candidate set"""
+    rng = random.Random(27)
+    corpus_dict = {doc_id: make_synthetic_document(rng, 20, 1500) for doc_id in range(10 * scale)}
+    source_ids = list(corpus_dict.keys())
+    return lambda: my_retrieve.build_context(source_ids, corpus_dict)
+
+def setup_faq_filter(workdir: str, scale: int):
+    """FAQ candidate filtering performed by process_question"""
+    rng = random.Random(28)
+    my_retrieve.key_to_source_dict = make_synthetic_faq(rng, 600 * scale)
+    source_ids = rng.sample(list(my_retrieve.key_to_source_dict.keys()), 10)
+
+    def run():
+        for _ in range(20):
+            my_retrieve.get_corpus_dict('faq', source_ids)
+    return run
+
+def setup_extract_pdf_content(workdir: str, scale: int):
+    """ExtractPDF.extract_pdf_content on a synthetic PDF with tables and images"""
+    pdf_path = os.path.join(workdir, 'synthetic.pdf')
+    make_synthetic_pdf(pdf_path, 3 * scale, random.Random(29))
+    output_dir = os.path.join(workdir, 'extracted')
+    return lambda: extract_pdf_content(pdf_path, output_dir)
+
+def setup_extract_text(workdir: str, scale: int, backend: str):
+    """ExtractPDF.extract_pdf_text on a generated text-heavy PDF with the given backend"""
+    pdf_path = os.path.join(workdir, 'text_heavy.pdf')
+    make_synthetic_text_pdf(pdf_path, 10 * scale, random.Random(33))
+    return lambda: extract_pdf_text(pdf_path, backend)
+
+def setup_has_tables(workdir: str, scale: int):
+    """MultiTypeTag.has_tables on a text-only PDF, the worst case that scans every page"""
+    pdf_path = os.path.join(workdir, 'text_only.pdf')
+    doc = fitz.open()
+    for _ in range(20 * scale):
+        page = doc.new_page()
+        for line in range(40):
+            page.insert_text((50, 60 + line * 18), f"line{line}", fontsize=9)
+    doc.save(pdf_path)
+    doc.close()
+    return lambda: has_tables(pdf_path)
+
+def setup_merge(workdir: str, scale: int):
+    """makeDict.combine_json_files followed by textandExtract.combine_text_and_json"""
+    rng = random.Random(30)
+    output_dir = os.path.join(workdir, 'vision_output')
+    text_dir = os.path.join(workdir, 'extracted')
+    combined_dir = os.path.join(workdir, 'combined_output')
+    updated_dir = os.path.join(workdir, 'updated_output')
+    os.makedirs(output_dir)
+    for doc_id in range(50 * scale):
+        doc = make_synthetic_document(rng, 5, 800)
+        for idx, response in enumerate(doc['combined_responses'], 1):
+            with open(os.path.join(output_dir, f'{doc_id}_image{idx}_result.json'), 'w', encoding='utf-8') as f:
+                json.dump({'success': True, 'response': response}, f, indent=2, ensure_ascii=False)
+        os.makedirs(os.path.join(text_dir, str(doc_id)))
+        with open(os.path.join(text_dir, str(doc_id), f'{doc_id}_text.txt'), 'w', encoding='utf-8') as f:
+            f.write(doc['raw_text'])
+
+    def run():
+        combine_json_files(output_dir, combined_dir)
+        combine_text_and_json(text_dir, combined_dir, updated_dir)
+    return run
+
+# Benchmark name -> setup function returning a zero-argument callable to time
+BENCHMARKS = {
+    'load_data_json': setup_load_data_json,
+    'build_context': setup_build_context,
+    'faq_filter': setup_faq_filter,
+    'extract_pdf_content': setup_extract_pdf_content,
+    'extract_text_pdfplumber': lambda workdir, scale: setup_extract_text(workdir, scale, 'pdfplumber'),
+    'extract_text_pymupdf': lambda workdir, scale: setup_extract_text(workdir, scale, 'pymupdf'),
+    'has_tables': setup_has_tables,
+    'merge': setup_merge,
+}
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the progress output of the benchmarked functions"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+def measure(run, repeat: int) -> dict:
+    """
+    Time a callable and record its peak Python heap usage
+
+    Args:
+        run: Zero-argument callable to benchmark
+        repeat: Number of timed runs
+
+    Returns:
+        dict: Median and minimum wall time in seconds and peak traced memory in KiB
+    """
+    # Warm-up run so that caches and lazy imports do not count
+    with quiet():
+        run()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with quiet():
+            run()
+        times.append(time.perf_counter() - start)
+
+    # Memory is measured in a separate run because tracemalloc slows execution
+    tracemalloc.start()
+    with quiet():
+        run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_s': statistics.median(times),
+        'min_s': min(times),
+        'peak_kib': peak / 1024,
+        'repeat': repeat
+    }
+
+def run_benchmarks(names: list, repeat: int, scale: int) -> dict:
+    """
+    Run the selected benchmarks, each in its own temporary directory
+
+    Args:
+        names: Benchmark names to run
+        repeat: Number of timed runs per benchmark
+        scale: Multiplier applied to the synthetic input sizes
+
+    Returns:
+        dict: Benchmark name -> measurement
+    """
+    results = {}
+    for name in names:
+        workdir = tempfile.mkdtemp(prefix=f'esunrag_bench_{name}_')
+        try:
+            with quiet():
+                run = BENCHMARKS[name](workdir, scale)
+            results[name] = measure(run, repeat)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        r = results[name]
+        print(f"{name:<22} median {r['median_s'] * 1000:10.2f} ms   min {r['min_s'] * 1000:10.2f} ms   peak {r['peak_kib']:10.1f} KiB")
+    return results
+
+def compare_text_backends(pdf_dir: str) -> list:
+    """
+    Time both text backends page by page on real PDFs and check that their output is identical
+
+    A page that the PyMuPDF backend hands to pdfplumber is charged the check
+    plus the pdfplumber time.
+
+    Args:
+        pdf_dir: Directory of PDF files, e.g. the reference PDFs
+
+    Returns:
+        list: One dict per PDF with 'pdf', 'pages', 'fast_pages', 'pdfplumber_ms',
+              'pymupdf_ms' (per page) and 'mismatched_pages'
+    """
+    rows = []
+    for pdf_file in sorted(f for f in os.listdir(pdf_dir) if f.endswith('.pdf')):
+        pdf_path = os.path.join(pdf_dir, pdf_file)
+        row = {'pdf': pdf_file, 'pages': 0, 'fast_pages': 0, 'pdfplumber_ms': 0.0, 'pymupdf_ms': 0.0, 'mismatched_pages': []}
+        with pdfplumber.open(pdf_path) as pdf, quiet():
+            doc = fitz.open(pdf_path)
+            for page_num, page in enumerate(pdf.pages):
+                start = time.perf_counter()
+                expected = pdfplumber_page_text(page, page_num)
+                pdfplumber_seconds = time.perf_counter() - start
+                page.close()
+
+                start = time.perf_counter()
+                actual = pymupdf_page_text(doc[page_num])
+                pymupdf_seconds = time.perf_counter() - start
+                if actual is None:
+                    actual = expected
+                    pymupdf_seconds += pdfplumber_seconds
+                else:
+                    row['fast_pages'] += 1
+
+                row['pages'] += 1
+                row['pdfplumber_ms'] += pdfplumber_seconds * 1000
+                row['pymupdf_ms'] += pymupdf_seconds * 1000
+                if actual != expected:
+                    row['mismatched_pages'].append(page_num + 1)
+            doc.close()
+        rows.append(row)
+    return rows
+
+def find_regressions(results: dict, baseline: dict, time_tolerance: float, memory_tolerance: float) -> list:
+    """
+    Compare results against a stored baseline
+
+    Args:
+        results: Current measurements
+        baseline: Previously saved benchmark file
+        time_tolerance: Allowed relative increase of the median time
+        memory_tolerance: Allowed relative increase of the peak memory
+
+    Returns:
+        list: Human-readable descriptions of every regression found
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        time_limit = base['median_s'] * (1 + time_tolerance) + MIN_TIME_SLACK
+        if result['median_s'] > time_limit:
+            regressions.append(f"{name}: time {result['median_s'] * 1000:.2f} ms > baseline {base['median_s'] * 1000:.2f} ms")
+        memory_limit = base['peak_kib'] * (1 + memory_tolerance) + MIN_MEMORY_SLACK_KIB
+        if result['peak_kib'] > memory_limit:
+            regressions.append(f"{name}: peak memory {result['peak_kib']:.1f} KiB > baseline {base['peak_kib']:.1f} KiB")
+    return regressions
+
+if __name__ == "__main__":
+    """
+    Main entry point for the offline micro-benchmark suite.
+
+    Runs the retrieval and preprocessing hot paths on synthetic inputs, compares
+    the results with a stored baseline and exits with status 1 on a regression.
+
+    Usage:
+        python benchmark.py [--only build_context,merge] [--repeat 5] [--save_baseline]
+        python benchmark.py --compare_pdf_dir ./reference/insurance
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the retrieval and preprocessing hot paths.')
+    parser.add_argument('--only',
+                       type=str,
+                       default=None,
+                       help=f'Comma-separated benchmarks to run (choices: {", ".join(BENCHMARKS)})')
+    parser.add_argument('--repeat',
+                       type=int,
+                       default=5,
+                       help='Number of timed runs per benchmark (default: %(default)s)')
+    parser.add_argument('--scale',
+                       type=int,
+                       default=1,
+                       help='Multiplier for the synthetic input sizes (default: %(default)s)')
+    parser.add_argument('--baseline',
+                       type=str,
+                       default="./source/Benchmark/baseline.json",
+                       help='Baseline file to compare against (default: %(default)s)')
+    parser.add_argument('--save_baseline',
+                       action='store_true',
+                       help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--time_tolerance',
+                       type=float,
+                       default=0.25,
+                       help='Allowed relative slowdown before flagging (default: %(default)s)')
+    parser.add_argument('--memory_tolerance',
+                       type=float,
+                       default=0.10,
+                       help='Allowed relative peak memory growth before flagging (default: %(default)s)')
+    parser.add_argument('--compare_pdf_dir',
+                       type=str,
+                       default=None,
+                       help='Compare the pdfplumber and PyMuPDF text backends page by page on these PDFs instead')
+
+    args = parser.parse_args()
+
+    if args.compare_pdf_dir:
+        rows = compare_text_backends(args.compare_pdf_dir)
+        print(f"{'PDF':<24} {'pages':>6} {'fast':>6} {'pdfplumber ms/page':>19} {'pymupdf ms/page':>16} {'speedup':>8}  identical")
+        for row in rows:
+            pages = max(row['pages'], 1)
+            speedup = row['pdfplumber_ms'] / max(row['pymupdf_ms'], 1e-9)
+            identical = 'yes' if not row['mismatched_pages'] else f"no, pages {row['mismatched_pages']}"
+            print(f"{row['pdf']:<24} {row['pages']:>6} {row['fast_pages']:>6} {row['pdfplumber_ms'] / pages:>19.1f} "
+                  f"{row['pymupdf_ms'] / pages:>16.1f} {speedup:>7.1f}x  {identical}")
+        total_pages = sum(row['pages'] for row in rows)
+        mismatched = sum(len(row['mismatched_pages']) for row in rows)
+        pdfplumber_ms = sum(row['pdfplumber_ms'] for row in rows)
+        pymupdf_ms = sum(row['pymupdf_ms'] for row in rows)
+        print(f"\nTotal: {len(rows)} PDFs, {total_pages} pages, {sum(row['fast_pages'] for row in rows)} on the fast path")
+        print(f"Per page: pdfplumber {pdfplumber_ms / max(total_pages, 1):.1f} ms, pymupdf {pymupdf_ms / max(total_pages, 1):.1f} ms "
+              f"({pdfplumber_ms / max(pymupdf_ms, 1e-9):.1f}x)")
+        print(f"Identical pages: {total_pages - mismatched}/{total_pages}")
+        sys.exit(1 if mismatched else 0)
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    print(f"Running {len(names)} benchmarks (repeat={args.repeat}, scale={args.scale})\n")
+    results = run_benchmarks(names, args.repeat, args.scale)
+
+    if args.save_baseline:
+        # Merge into an existing baseline so that partial runs only update their entries
+        baseline = {'results': {}}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        if baseline.get('scale', args.scale) != args.scale:
+            baseline['results'] = {}
+        baseline['scale'] = args.scale
+        baseline['python'] = platform.python_version()
+        baseline['machine'] = platform.machine()
+        baseline['results'].update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline saved to: {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.isfile(args.baseline):
+        print(f"\nNo baseline found at {args.baseline}; run with --save_baseline to create one")
+        sys.exit(0)
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('scale') != args.scale:
+        print(f"\nBaseline was recorded with scale={baseline.get('scale')}; skipping comparison")
+        sys.exit(0)
+
+    regressions = find_regressions(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if regressions:
+        print("\nRegressions found:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions against baseline")
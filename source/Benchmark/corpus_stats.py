@@ -0,0 +1,340 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+
+# Make the retrieval scripts and shared helpers importable
+source_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(source_dir / 'Model'))
+sys.path.append(str(source_dir / 'Common'))
+
+from adaptive_limit import estimate_tokens
+from doc_cards import CATEGORIES, PAGE_KEY_PATTERN, content_hash, load_corpus
+from faq_matcher import normalize
+from finance_facts import document_pages
+from my_retrieve import build_context, build_prompt
+
+# Overlap of the vision responses with the raw text is measured on windows of this many characters
+SHINGLE_CHARS = 16
+
+# Context window of the retrieval model (gpt-4o), in tokens
+CONTEXT_LIMIT = 128000
+
+# Number of largest prompts listed in the report
+TOP_PROMPTS = 10
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def get_token_counter(name: str):
+    """
+    Create a token counting function.
+
+    Args:
+        name (str): 'estimate' for the local estimate used by the adaptive limiter
+                    (one token per CJK character, one per four other characters),
+                    or 'tiktoken' for the exact gpt-4o tokenizer (requires the tiktoken package)
+
+    Returns:
+        Function mapping a text to its number of tokens
+    """
+    if name == 'estimate':
+        return estimate_tokens
+    import tiktoken
+    encoding = tiktoken.encoding_for_model('gpt-4o')
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+def distribution(values) -> dict:
+    """
+    Summarize a list of sizes.
+
+    Returns:
+        dict: count, sum, mean, p50, p90, p99 and max (zeros for an empty list)
+    """
+    values = np.asarray(list(values), dtype=np.float64)
+    if values.size == 0:
+        return {'count': 0, 'sum': 0, 'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        'count': int(values.size),
+        'sum': int(values.sum()),
+        'mean': round(float(values.mean()), 1),
+        'p50': round(float(p50), 1),
+        'p90': round(float(p90), 1),
+        'p99': round(float(p99), 1),
+        'max': int(values.max()),
+    }
+
+def compact(text: str) -> str:
+    return WHITESPACE_PATTERN.sub('', text)
+
+def response_overlap(responses: str, raw_text: str) -> float:
+    """
+    Share of the vision response text that repeats the raw text.
+
+    Both texts are compared without whitespace. The responses are cut into
+    non-overlapping windows of SHINGLE_CHARS characters, and a window counts as
+    repeated if it occurs anywhere in the raw text.
+
+    Returns:
+        float: Fraction of windows found in the raw text (0 if the responses are shorter than one window)
+    """
+    responses = compact(responses)
+    raw_text = compact(raw_text)
+    windows = [responses[start:start + SHINGLE_CHARS]
+               for start in range(0, len(responses) - SHINGLE_CHARS + 1, SHINGLE_CHARS)]
+    if not windows:
+        return 0.0
+    raw_shingles = {raw_text[start:start + SHINGLE_CHARS] for start in range(len(raw_text) - SHINGLE_CHARS + 1)}
+    return sum(window in raw_shingles for window in windows) / len(windows)
+
+def profile_corpus(source_path: str, count_tokens) -> tuple:
+    """
+    Measure every document of the reference data.
+
+    Args:
+        source_path (str): Reference directory containing updated_*_output and faq/
+        count_tokens: Token counting function
+
+    Returns:
+        tuple: (category -> summary dict, list of per-document dicts,
+                category -> (document ID -> context section size in (chars, tokens)), category -> corpus dict)
+    """
+    summaries = {}
+    documents = []
+    sections = {}
+    corpora = {}
+    for category in CATEGORIES:
+        corpus_dict = load_corpus(source_path, category)
+        corpora[category] = corpus_dict
+        sections[category] = {}
+        category_documents = []
+        seen_hashes = set()
+        seen_pages = set()
+        duplicate_documents = 0
+        page_chars = duplicate_page_chars = 0
+
+        for doc_id in sorted(corpus_dict):
+            doc = corpus_dict[doc_id]
+            # The section of this document in the retrieval prompt, exactly as my_retrieve.py builds it
+            context = build_context([doc_id], corpus_dict)
+            context_size = (len(context), count_tokens(context))
+            sections[category][doc_id] = context_size
+            entry = {'category': category, 'id': doc_id,
+                     'context_chars': context_size[0], 'context_tokens': context_size[1]}
+
+            doc_hash = content_hash(doc)
+            entry['duplicate'] = doc_hash in seen_hashes
+            duplicate_documents += entry['duplicate']
+            seen_hashes.add(doc_hash)
+
+            if category == 'faq':
+                texts = ['\n'.join([item['question']] + list(item['answers'])) for item in doc]
+                entry['pages'] = len(doc)
+                entry['text_chars'] = sum(len(text) for text in texts)
+                entry['text_tokens'] = sum(count_tokens(text) for text in texts)
+            else:
+                raw_text = doc.get('raw_text') or ''
+                responses = '\n'.join(response for response in doc.get('combined_responses', []) if response)
+                entry['pages'] = len(set(PAGE_KEY_PATTERN.findall(responses)))
+                entry['raw_text_chars'] = len(raw_text)
+                entry['raw_text_tokens'] = count_tokens(raw_text)
+                entry['responses_chars'] = len(responses)
+                entry['responses_tokens'] = count_tokens(responses)
+                entry['response_raw_overlap'] = round(response_overlap(responses, raw_text), 4)
+                texts = [text for page, text in document_pages(doc) if page is not None]
+
+            # Page texts (FAQ entries) identical to one seen earlier in the category
+            for text in texts:
+                key = normalize(text) if category == 'faq' else compact(text)
+                if not key:
+                    continue
+                page_chars += len(key)
+                if key in seen_pages:
+                    duplicate_page_chars += len(key)
+                seen_pages.add(key)
+            category_documents.append(entry)
+
+        summary = {
+            'documents': len(category_documents),
+            'pages': distribution(entry['pages'] for entry in category_documents),
+            'context_chars': distribution(entry['context_chars'] for entry in category_documents),
+            'context_tokens': distribution(entry['context_tokens'] for entry in category_documents),
+            'duplicate_documents': duplicate_documents,
+            'duplicate_page_ratio': round(duplicate_page_chars / page_chars, 4) if page_chars else 0.0,
+        }
+        if category == 'faq':
+            summary['text_chars'] = distribution(entry['text_chars'] for entry in category_documents)
+            summary['text_tokens'] = distribution(entry['text_tokens'] for entry in category_documents)
+        else:
+            summary['documents_without_pages'] = sum(1 for entry in category_documents if not entry['pages'])
+            for field in ('raw_text', 'responses'):
+                summary[f'{field}_chars'] = distribution(entry[f'{field}_chars'] for entry in category_documents)
+                summary[f'{field}_tokens'] = distribution(entry[f'{field}_tokens'] for entry in category_documents)
+            # Weighted by response size: the share of all response text that repeats the raw text
+            response_chars = sum(entry['responses_chars'] for entry in category_documents)
+            summary['response_raw_overlap'] = round(sum(
+                entry['response_raw_overlap'] * entry['responses_chars'] for entry in category_documents
+            ) / response_chars, 4) if response_chars else 0.0
+        summaries[category] = summary
+        documents.extend(category_documents)
+    return summaries, documents, sections, corpora
+
+def profile_questions(questions: list, sections: dict, count_tokens, context_limit: int = CONTEXT_LIMIT) -> dict:
+    """
+    Estimate the size of the single-stage retrieval prompt of every question.
+
+    A prompt's size is the size of the prompt template with the query plus the
+    context sections of its candidates, each counted once per document and reused.
+
+    Args:
+        questions (list): Question dictionaries with 'qid', 'category', 'query' and 'source'
+        sections (dict): Category -> (document ID -> (chars, tokens)) from profile_corpus
+        count_tokens: Token counting function
+        context_limit (int): Context window in tokens; larger prompts are counted
+
+    Returns:
+        dict: Per category and in total, the distributions of candidates, prompt characters
+              and prompt tokens, the number of prompts over context_limit, candidate reuse
+              and missing documents, plus the largest prompts
+    """
+    prompts = {category: [] for category in CATEGORIES}
+    candidates = {category: [] for category in CATEGORIES}
+    missing = {category: 0 for category in CATEGORIES}
+    for q in questions:
+        category = q['category']
+        template = build_prompt(q['query'], '')
+        chars, tokens = len(template), count_tokens(template)
+        for doc_id in q['source']:
+            size = sections[category].get(int(doc_id))
+            if size is None:
+                missing[category] += 1
+                continue
+            chars += size[0]
+            tokens += size[1]
+        candidates[category].append([int(doc_id) for doc_id in q['source']])
+        prompts[category].append({'qid': q['qid'], 'category': category, 'candidates': len(q['source']),
+                                  'prompt_chars': chars, 'prompt_tokens': tokens})
+
+    def summarize(selected_prompts, selected_candidates, missing_documents):
+        slots = sum(len(source) for source in selected_candidates)
+        unique = len({doc_id for source in selected_candidates for doc_id in source})
+        return {
+            'questions': len(selected_prompts),
+            'candidates': distribution(prompt['candidates'] for prompt in selected_prompts),
+            'prompt_chars': distribution(prompt['prompt_chars'] for prompt in selected_prompts),
+            'prompt_tokens': distribution(prompt['prompt_tokens'] for prompt in selected_prompts),
+            'over_context_limit': sum(1 for prompt in selected_prompts if prompt['prompt_tokens'] > context_limit),
+            # Candidate slots per distinct candidate document: how often the same document is sent again
+            'candidate_reuse': round(slots / unique, 2) if unique else 0.0,
+            'missing_documents': missing_documents,
+        }
+
+    all_prompts = [prompt for category in CATEGORIES for prompt in prompts[category]]
+    report = {category: summarize(prompts[category], candidates[category], missing[category])
+              for category in CATEGORIES if prompts[category]}
+    # Reuse across categories is meaningless since document IDs overlap, so the total reports it per category only
+    total = summarize(all_prompts, [], sum(missing.values()))
+    del total['candidate_reuse']
+    report['total'] = total
+    report['context_limit'] = context_limit
+    report['largest'] = sorted(all_prompts, key=lambda prompt: prompt['prompt_tokens'], reverse=True)[:TOP_PROMPTS]
+    return report
+
+def print_summary(report: dict):
+    """Print the main figures of a report as a table"""
+    print(f"\n{'category':<10} {'docs':>6} {'dup':>4} {'pages p50/max':>14} {'raw tok p50/p99':>18} "
+          f"{'resp tok p50/p99':>18} {'ctx tok sum':>12} {'dup pages':>9} {'resp=raw':>8}")
+    for category, summary in report['categories'].items():
+        raw = summary.get('raw_text_tokens', summary.get('text_tokens'))
+        responses = summary.get('responses_tokens')
+        print(f"{category:<10} {summary['documents']:>6} {summary['duplicate_documents']:>4} "
+              f"{summary['pages']['p50']:>7.0f}/{summary['pages']['max']:<6} "
+              f"{raw['p50']:>9.0f}/{raw['p99']:<8.0f} "
+              + (f"{responses['p50']:>9.0f}/{responses['p99']:<8.0f} " if responses else f"{'-':>18} ")
+              + f"{summary['context_tokens']['sum']:>12,} {summary['duplicate_page_ratio']:>9.1%} "
+              + (f"{summary['response_raw_overlap']:>8.1%}" if 'response_raw_overlap' in summary else f"{'-':>8}"))
+
+    if 'questions' in report:
+        questions = report['questions']
+        print(f"\n{'category':<10} {'questions':>9} {'cand p50/max':>13} {'prompt tok p50':>14} {'p90':>8} "
+              f"{'p99':>8} {'max':>8} {'sum':>11} {'>limit':>6} {'reuse':>6}")
+        for category in list(CATEGORIES) + ['total']:
+            if category not in questions:
+                continue
+            summary = questions[category]
+            tokens = summary['prompt_tokens']
+            print(f"{category:<10} {summary['questions']:>9} "
+                  f"{summary['candidates']['p50']:>6.0f}/{summary['candidates']['max']:<6} "
+                  f"{tokens['p50']:>14,.0f} {tokens['p90']:>8,.0f} {tokens['p99']:>8,.0f} {tokens['max']:>8,} "
+                  f"{tokens['sum']:>11,} {summary['over_context_limit']:>6} "
+                  + (f"{summary['candidate_reuse']:>6.2f}" if 'candidate_reuse' in summary else f"{'-':>6}"))
+
+if __name__ == "__main__":
+    """
+    Main entry point for profiling the size of the reference corpus.
+
+    Measures every finance and insurance document (characters and tokens of the
+    raw text, the vision responses and the retrieval prompt section, vision pages,
+    overlap of responses with the raw text) and every FAQ pid, and summarizes them
+    per category together with duplicate documents and pages. With a question file,
+    it also reports the distribution of the single-stage retrieval prompt sizes.
+
+    Usage:
+        python corpus_stats.py --source_path ./reference --output_path ./corpus_stats.json
+                               [--question_path questions.json] [--tokenizer estimate|tiktoken]
+                               [--context_limit 128000]
+    """
+    parser = argparse.ArgumentParser(description='Profile document and prompt sizes of the reference corpus.')
+    parser.add_argument('--source_path',
+                       type=str,
+                       default="./reference",
+                       help='Reference directory (default: %(default)s)')
+    parser.add_argument('--question_path',
+                       type=str,
+                       default=None,
+                       help='Optional question file whose prompt sizes are estimated')
+    parser.add_argument('--output_path',
+                       type=str,
+                       default=None,
+                       help='Path where the JSON report is saved (default: print the summary only)')
+    parser.add_argument('--tokenizer',
+                       type=str,
+                       choices=['estimate', 'tiktoken'],
+                       default='estimate',
+                       help='Token counting: local estimate or the exact gpt-4o tokenizer (default: %(default)s)')
+    parser.add_argument('--context_limit',
+                       type=int,
+                       default=CONTEXT_LIMIT,
+                       help='Context window in tokens; larger prompts are counted (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count_tokens = get_token_counter(args.tokenizer)
+    summaries, documents, sections, corpora = profile_corpus(args.source_path, count_tokens)
+    report = {
+        'source_path': args.source_path,
+        'tokenizer': args.tokenizer,
+        'categories': summaries,
+    }
+
+    if args.question_path:
+        with open(args.question_path, 'r', encoding='utf-8') as f:
+            questions = json.load(f)['questions']
+        report['question_path'] = args.question_path
+        report['questions'] = profile_questions(questions, sections, count_tokens, args.context_limit)
+
+    report['documents'] = documents
+    print_summary(report)
+    print(f"\nProfiled {len(documents)} documents in {time.perf_counter() - start:.1f}s ({args.tokenizer} token counts)")
+
+    if args.output_path:
+        directory = os.path.dirname(os.path.abspath(args.output_path))
+        os.makedirs(directory, exist_ok=True)
+        with open(args.output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"Saved report to: {args.output_path}")
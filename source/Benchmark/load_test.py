@@ -0,0 +1,174 @@
+import json
+import time
+import random
+import argparse
+import urllib.error
+import urllib.request
+import concurrent.futures
+import numpy as np
+
+def post_json(url: str, payload: dict, timeout: float) -> tuple:
+    """
+    POST a JSON payload.
+
+    Returns:
+        tuple: (HTTP status, decoded JSON response); status 0 if the connection failed
+    """
+    request = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+    except OSError as e:
+        return 0, {'error': {'message': str(e)}}
+
+def get_json(url: str, timeout: float = 10) -> dict:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def latency_summary(latencies: list) -> dict:
+    """
+    Returns:
+        dict: p50/p90/p99/max latency in milliseconds
+    """
+    if not latencies:
+        return {}
+    p50, p90, p99 = (float(value) for value in np.percentile(latencies, [50, 90, 99]) * 1000)
+    return {'p50_ms': round(p50, 1), 'p90_ms': round(p90, 1), 'p99_ms': round(p99, 1),
+            'max_ms': round(max(latencies) * 1000, 1)}
+
+def run_load_test(url: str, questions: list, concurrency: int, repeat: int = 1,
+                  seed: int = 0, timeout: float = 300) -> dict:
+    """
+    Send questions to a retrieval service, one request per question, from concurrent clients.
+
+    Every question is sent `repeat` times in a shuffled order, so repeated
+    questions arrive while their first copy may still be in flight, as when
+    several clients ask the same thing.
+
+    Args:
+        url (str): Base URL of retrieve_server.py
+        questions (list): Question dicts as in the question files
+        concurrency (int): Number of concurrent clients
+        repeat (int): Times each question is sent
+        seed (int): Seed of the shuffle
+        timeout (float): Seconds to wait for one answer
+
+    Returns:
+        dict: Requests, failures, wall time, throughput, latency percentiles and the
+              answers by qid (from the last copy of each question)
+    """
+    requests = [q_dict for q_dict in questions for _ in range(repeat)]
+    random.Random(seed).shuffle(requests)
+
+    def send(q_dict):
+        start = time.perf_counter()
+        status, response = post_json(f"{url}/retrieve", q_dict, timeout)
+        return q_dict, status, response, time.perf_counter() - start
+
+    latencies = []
+    failed = 0
+    answers = {}
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for q_dict, status, response, latency in executor.map(send, requests):
+            latencies.append(latency)
+            if status == 200:
+                answers[q_dict['qid']] = response['retrieve']
+            else:
+                failed += 1
+    wall_time = time.perf_counter() - start
+
+    return {
+        'requests': len(requests), 'failed': failed, 'concurrency': concurrency,
+        'wall_time_s': round(wall_time, 3), 'requests_per_s': round(len(requests) / wall_time, 1),
+        'latency': latency_summary(latencies), 'answers': answers,
+    }
+
+if __name__ == "__main__":
+    """
+    Main entry point for load testing the retrieval service.
+
+    Sends the questions of a question file to a running retrieve_server.py from
+    concurrent clients and reports client-side throughput and p50/p90/p99 latency,
+    the accuracy if ground truths are given, and the server's own counters
+    (deduplicated questions, cache hits, micro-batch sizes and latency).
+
+    The test runs offline when the server replays a cassette recorded with
+    my_retrieve.py --record (or answers from batch_server.py's stand-in endpoint):
+
+        python ./source/Model/retrieve_server.py --source_path ./reference --replay cassette.jsonl
+        python ./source/Benchmark/load_test.py --question_path ./dataset/preliminary/questions_example.json
+
+    Usage:
+        python load_test.py --question_path questions.json [--url http://127.0.0.1:8780]
+                            [--concurrency 32] [--repeat 2] [--truth_path ground_truths.json]
+                            [--output_path report.json]
+    """
+    parser = argparse.ArgumentParser(description='Load test the retrieval service.')
+    parser.add_argument('--url',
+                       type=str,
+                       default='http://127.0.0.1:8780',
+                       help='Base URL of retrieve_server.py (default: %(default)s)')
+    parser.add_argument('--question_path',
+                       type=str,
+                       default="./dataset/preliminary/questions_example.json",
+                       help='Questions to send (default: %(default)s)')
+    parser.add_argument('--truth_path',
+                       type=str,
+                       default=None,
+                       help='Ground truths for the accuracy of the answers (default: not checked)')
+    parser.add_argument('--concurrency',
+                       type=int,
+                       default=32,
+                       help='Number of concurrent clients (default: %(default)s)')
+    parser.add_argument('--repeat',
+                       type=int,
+                       default=2,
+                       help='Times each question is sent, in shuffled order (default: %(default)s)')
+    parser.add_argument('--seed',
+                       type=int,
+                       default=0,
+                       help='Seed of the request order (default: %(default)s)')
+    parser.add_argument('--timeout',
+                       type=float,
+                       default=300,
+                       help='Seconds to wait for one answer (default: %(default)s)')
+    parser.add_argument('--output_path',
+                       type=str,
+                       default=None,
+                       help='Save the report as JSON (default: print only)')
+
+    args = parser.parse_args()
+
+    with open(args.question_path, 'r', encoding='utf-8') as f:
+        questions = json.load(f)['questions']
+    print(f"Sending {len(questions)} questions x {args.repeat} to {args.url} "
+          f"with {args.concurrency} concurrent clients")
+
+    report = run_load_test(args.url, questions, args.concurrency, args.repeat, args.seed, args.timeout)
+    answers = report.pop('answers')
+    if args.truth_path:
+        with open(args.truth_path, 'r', encoding='utf-8') as f:
+            truths = {item['qid']: item['retrieve'] for item in json.load(f)['ground_truths']}
+        correct = sum(1 for qid, retrieve in answers.items() if truths.get(qid) == retrieve)
+        report['accuracy'] = round(correct / len(questions), 4)
+    report['server'] = get_json(f"{args.url}/stats")
+
+    print(f"Requests: {report['requests']} ({report['failed']} failed) in {report['wall_time_s']}s, "
+          f"{report['requests_per_s']} requests/s")
+    print(f"Client latency: {report['latency']}")
+    if 'accuracy' in report:
+        print(f"Accuracy: {report['accuracy']:.2%}")
+    server = report['server']
+    print(f"Server: {server['processed']} processed, {server['deduplicated']} deduplicated, "
+          f"{server['cache_hits']} cache hits, {server['batches']} batches "
+          f"(mean {server['mean_batch']}, max {server['max_batch']})")
+    print(f"Server latency: {server['latency']}")
+
+    if args.output_path:
+        with open(args.output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Saved the report to {args.output_path}")
@@ -0,0 +1,312 @@
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import argparse
+import itertools
+import subprocess
+import concurrent.futures
+from pathlib import Path
+
+# Make the pipeline scripts importable
+source_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(source_dir / 'Common'))
+
+from batch_server import start_server
+
+MY_RETRIEVE = source_dir / 'Model' / 'my_retrieve.py'
+BACKENDS = ('mock', 'replay', 'record')
+
+# Flag axes are switched with these values, e.g. faq_match=on,off
+FLAG_ON = 'on'
+FLAG_OFF = 'off'
+
+def parse_axis(spec: str) -> tuple:
+    """
+    Parse one grid axis.
+
+    Args:
+        spec (str): my_retrieve.py option and its values, e.g. "finalists=2,3,5" or "faq_match=on,off"
+
+    Returns:
+        tuple: (option name, list of values)
+
+    Raises:
+        ValueError: If the spec has no '=' or no values
+    """
+    name, separator, values = spec.partition('=')
+    values = [value.strip() for value in values.split(',') if value.strip()]
+    if not separator or not name.strip() or not values:
+        raise ValueError(f"Invalid grid axis '{spec}', expected option=value1,value2,...")
+    return name.strip().lstrip('-'), values
+
+def expand_grid(axes: list) -> list:
+    """
+    All combinations of the axis values, in order.
+
+    Args:
+        axes (list): (option name, values) pairs from parse_axis
+
+    Returns:
+        list: One {option: value} dict per configuration
+    """
+    names = [name for name, _ in axes]
+    return [dict(zip(names, values)) for values in itertools.product(*(values for _, values in axes))]
+
+def config_arguments(config: dict) -> list:
+    """
+    Command-line arguments of a configuration: "on" passes a flag, "off" leaves the option out.
+    """
+    arguments = []
+    for name, value in config.items():
+        if value == FLAG_ON:
+            arguments.append(f'--{name}')
+        elif value != FLAG_OFF:
+            arguments.extend([f'--{name}', value])
+    return arguments
+
+def config_name(config: dict) -> str:
+    """
+    Directory name of a configuration, e.g. "finalists-3_faq_match-on"
+    """
+    parts = [f"{name}-{re.sub(r'[^A-Za-z0-9.]+', '-', value).strip('-')}" for name, value in config.items()]
+    return '_'.join(parts) or 'default'
+
+def score_answers(output_path: str, truths: dict) -> dict:
+    """
+    Score an output file against the ground truths by qid.
+
+    Questions without an answer count as wrong.
+
+    Returns:
+        dict: 'accuracy' over all ground truths and 'by_category' accuracies
+    """
+    with open(output_path, 'r', encoding='utf-8') as f:
+        answers = {answer['qid']: answer['retrieve'] for answer in json.load(f)['answers']}
+    correct = {}
+    total = {}
+    for qid, (retrieve, category) in truths.items():
+        total[category] = total.get(category, 0) + 1
+        correct[category] = correct.get(category, 0) + (answers.get(qid) == retrieve)
+    return {
+        'accuracy': sum(correct.values()) / max(sum(total.values()), 1),
+        'by_category': {category: round(correct[category] / total[category], 4) for category in sorted(total)},
+    }
+
+def pareto_front(results: list) -> set:
+    """
+    Positions of the Pareto-optimal runs: no other run is at least as accurate,
+    uses at most as many tokens and takes at most as long, while being strictly
+    better in one of them. Failed runs are never optimal.
+    """
+    points = [(result['accuracy'], -result['total_tokens'], -result['wall_time'])
+              for result in results if result['status'] == 'ok']
+    positions = [position for position, result in enumerate(results) if result['status'] == 'ok']
+    front = set()
+    for position, point in zip(positions, points):
+        dominated = any(all(a >= b for a, b in zip(other, point)) and other != point for other in points)
+        if not dominated:
+            front.add(position)
+    return front
+
+def format_table(results: list, front: set) -> str:
+    """
+    Markdown table of the runs, most accurate first; Pareto-optimal runs are marked with *.
+    """
+    lines = ['| | configuration | accuracy | total tokens | requests | wall time (s) | errors |',
+             '| --- | --- | ---: | ---: | ---: | ---: | ---: |']
+    order = sorted(range(len(results)), key=lambda position: (
+        results[position]['status'] != 'ok', -results[position].get('accuracy', 0),
+        results[position].get('total_tokens', 0), results[position].get('wall_time', 0)))
+    for position in order:
+        result = results[position]
+        label = ' '.join(f"{name}={value}" for name, value in result['config'].items()) or '(defaults)'
+        if result['status'] != 'ok':
+            lines.append(f"| | {label} | {result['status']} | | | | |")
+            continue
+        marker = '*' if position in front else ''
+        lines.append(f"| {marker} | {label} | {result['accuracy']:.2%} | {result['total_tokens']} | "
+                     f"{result['requests']} | {result['wall_time']:.1f} | {result['errors']} |")
+    return '\n'.join(lines)
+
+def run_config(config: dict, args: argparse.Namespace, fixed_arguments: list, env: dict, truths: dict) -> dict:
+    """
+    Run my_retrieve.py with one configuration and score it.
+
+    The run's output, statistics, log and (with the record backend) cassette are
+    kept in its own directory under the sweep directory.
+
+    Returns:
+        dict: 'config', 'name', 'status' ('ok' or why the run failed) and, for
+              successful runs, accuracy, token usage, requests, errors and wall time
+    """
+    name = config_name(config)
+    run_dir = os.path.join(args.output_dir, name)
+    os.makedirs(run_dir, exist_ok=True)
+    output_path = os.path.join(run_dir, 'output.json')
+    stats_path = os.path.join(run_dir, 'stats.json')
+    command = [sys.executable, str(MY_RETRIEVE),
+               '--question_path', args.question_path,
+               '--source_path', args.source_path,
+               '--output_path', output_path,
+               '--stats_path', stats_path]
+    if args.backend == 'replay':
+        cassette_path = args.cassette
+        if os.path.isdir(cassette_path):
+            # Cassettes recorded by a sweep with the record backend, one per configuration
+            cassette_path = os.path.join(cassette_path, name, 'cassette.jsonl')
+        command += ['--replay', cassette_path, '--time_scale', str(args.time_scale)]
+    elif args.backend == 'record':
+        command += ['--record', os.path.join(run_dir, 'cassette.jsonl')]
+    command += fixed_arguments + config_arguments(config)
+
+    result = {'config': config, 'name': name}
+    start = time.perf_counter()
+    with open(os.path.join(run_dir, 'log.txt'), 'w', encoding='utf-8') as log:
+        completed = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+    result['total_time'] = round(time.perf_counter() - start, 3)
+    if completed.returncode != 0 or not os.path.isfile(stats_path):
+        result['status'] = f"failed (exit code {completed.returncode}, see {name}/log.txt)"
+        return result
+
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        stats = json.load(f)
+    result.update(score_answers(output_path, truths))
+    result.update({
+        'status': 'ok',
+        'total_tokens': stats['total_tokens'],
+        'prompt_tokens': stats['prompt_tokens'],
+        'completion_tokens': stats['completion_tokens'],
+        'requests': stats['requests'],
+        'errors': stats['errors'],
+        'wall_time': stats['processing_time'],
+    })
+    return result
+
+if __name__ == "__main__":
+    """
+    Main entry point for configuration sweeps of my_retrieve.py.
+
+    Runs my_retrieve.py once per combination of the grid values, several runs at
+    a time, scores every run against the ground truths and prints a table of
+    accuracy, total tokens, LLM requests and wall time (the time spent processing
+    questions, without loading). Pareto-optimal configurations, for which no other
+    run is as accurate, as cheap and as fast while better in one of them, are
+    marked with *.
+
+    Backends:
+        mock    Local stand-in endpoint (batch_server.py) answering every prompt with
+                its first document: free, and its accuracy measures what happens before
+                the LLM (local answers, candidate order); --latency simulates the API
+        replay  Answer from a cassette (or a directory of per-configuration cassettes
+                written by the record backend); requests that were not recorded fail
+        record  Call the API and record one cassette per configuration, so that the
+                sweep can be replayed later without cost
+
+    Usage:
+        python sweep.py --grid finalists=2,3,5 dense_top_k=0,4 faq_match=on,off
+                        [--fixed "--cards_path ./reference/cards --dense_path ./reference/dense"]
+                        [--backend mock|replay|record] [--cassette ./sweeps/recorded]
+                        [--parallel 4] [--latency 0.5] [--output_dir ./sweeps/run1]
+    """
+    parser = argparse.ArgumentParser(description='Sweep my_retrieve.py over a grid of configurations.')
+    parser.add_argument('--grid',
+                       type=str,
+                       nargs='+',
+                       required=True,
+                       help='Axes as option=value1,value2; on/off switch flags, e.g. finalists=2,3 faq_match=on,off')
+    parser.add_argument('--fixed',
+                       type=str,
+                       default='',
+                       help='Options passed to every run, as one quoted string (default: none)')
+    parser.add_argument('--question_path',
+                       type=str,
+                       default="./dataset/preliminary/questions_example.json",
+                       help='Questions of every run (default: %(default)s)')
+    parser.add_argument('--truth_path',
+                       type=str,
+                       default="./dataset/preliminary/ground_truths_example.json",
+                       help='Ground truths used for scoring (default: %(default)s)')
+    parser.add_argument('--source_path',
+                       type=str,
+                       default="./reference",
+                       help='Reference directory (default: %(default)s)')
+    parser.add_argument('--output_dir',
+                       type=str,
+                       default="./sweeps/latest",
+                       help='Directory of the runs and the results (default: %(default)s)')
+    parser.add_argument('--backend',
+                       type=str,
+                       choices=BACKENDS,
+                       default='mock',
+                       help='LLM backend of the runs (default: %(default)s)')
+    parser.add_argument('--cassette',
+                       type=str,
+                       default=None,
+                       help='Cassette file, or directory of a record sweep, for --backend replay')
+    parser.add_argument('--time_scale',
+                       type=float,
+                       default=1.0,
+                       help='Factor applied to the recorded latencies with --backend replay (default: %(default)s)')
+    parser.add_argument('--latency',
+                       type=float,
+                       default=0.5,
+                       help='Seconds before the stand-in endpoint answers with --backend mock (default: %(default)s)')
+    parser.add_argument('--parallel',
+                       type=int,
+                       default=4,
+                       help='Runs executed at the same time (default: %(default)s)')
+
+    args = parser.parse_args()
+    if args.backend == 'replay' and not args.cassette:
+        parser.error("--backend replay requires --cassette")
+    try:
+        axes = [parse_axis(spec) for spec in args.grid]
+    except ValueError as e:
+        parser.error(str(e))
+    configs = expand_grid(axes)
+    fixed_arguments = shlex.split(args.fixed)
+
+    with open(args.truth_path, 'r', encoding='utf-8') as f:
+        truths = {item['qid']: (item['retrieve'], item['category']) for item in json.load(f)['ground_truths']}
+
+    env = dict(os.environ)
+    server = None
+    if args.backend == 'mock':
+        server, base_url = start_server(latency=args.latency)
+        env.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY='stub')
+        print(f"Stand-in endpoint listening on {base_url} (latency {args.latency}s)")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Running {len(configs)} configurations, {args.parallel} at a time, backend {args.backend}")
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        futures = {executor.submit(run_config, config, args, fixed_arguments, env, truths): config for config in configs}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"[{len(results)}/{len(configs)}] {result['name']}: accuracy {result['accuracy']:.2%}, "
+                      f"{result['total_tokens']} tokens, {result['requests']} requests, {result['wall_time']:.1f}s")
+            else:
+                print(f"[{len(results)}/{len(configs)}] {result['name']}: {result['status']}")
+    if server:
+        server.shutdown()
+
+    # Keep the grid order in the results file
+    results.sort(key=lambda result: configs.index(result['config']))
+    front = pareto_front(results)
+    for position, result in enumerate(results):
+        result['pareto'] = position in front
+    table = format_table(results, front)
+    print(f"\n{table}\n\n* Pareto-optimal: no other run is as accurate, as cheap and as fast while better in one of them")
+    if args.parallel > 1:
+        print("Runs shared the machine, so wall times include contention; use --parallel 1 for exact timings")
+
+    with open(os.path.join(args.output_dir, 'results.json'), 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(args.output_dir, 'results.md'), 'w', encoding='utf-8') as f:
+        f.write(table + '\n')
+    print(f"Saved the results to {args.output_dir}")
@@ -0,0 +1,289 @@
+import re
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# Characters counted as one token each; other text is estimated at four characters per token
+CJK_PATTERN = re.compile(r'[　-鿿＀-￯]')
+
+# Rough token cost of one high-detail page image
+IMAGE_TOKENS = 1000
+
+def estimate_tokens(text: str, num_images: int = 0) -> int:
+    """
+    Roughly estimate the tokens of a request before sending it.
+
+    Args:
+        text (str): Prompt text
+        num_images (int): Number of attached images
+
+    Returns:
+        int: Estimated token count
+    """
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4 + num_images * IMAGE_TOKENS
+
+def retry_after_seconds(error) -> float:
+    """
+    Read the server's requested wait from a failed API call.
+
+    Args:
+        error: Exception raised by the API client
+
+    Returns:
+        float or None: Seconds to wait from the retry-after-ms or retry-after header, if present
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            value = headers['retry-after']
+            try:
+                return float(value)
+            except ValueError:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def status_code_of(error) -> int:
+    """
+    Get the HTTP status code of a failed API call, or None for other errors.
+    """
+    return getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+
+# Errors without a status code that the OpenAI client would retry
+RETRYABLE_ERRORS = ('APIConnectionError', 'APITimeoutError', 'ConnectionError', 'TimeoutError')
+
+def is_retryable(error) -> bool:
+    """
+    Whether a failed API call is worth retrying, as the OpenAI client decides
+    when its own retries are enabled: 408, 409, 429 and 5xx responses, and
+    connection errors and timeouts, which have no status code.
+    """
+    status = status_code_of(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+def is_overload(error) -> bool:
+    """
+    Whether a failed API call points to an overloaded server: 5xx responses,
+    and connection errors and timeouts, which have no status code.
+    """
+    status = status_code_of(error)
+    if status is not None:
+        return status >= 500
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit: int = 10, max_limit: int = 100, min_limit: int = 1,
+                 tokens_per_minute: int = None, max_tokens_per_minute: int = None,
+                 decrease_factor: float = 0.5, latency_factor: float = 2.0, latency_decrease: float = 0.9,
+                 cooldown: float = 5.0, max_retries: int = 6):
+        """
+        Additive-increase/multiplicative-decrease control of concurrent API requests.
+
+        The number of requests in flight and, optionally, the tokens sent per
+        minute are limited. Each success raises the concurrency limit by
+        1/limit (about +1 per round trip) and the token budget by 1%. A 429
+        response halves both and pauses all requests for the server's
+        retry-after time, and a server error, connection error or timeout
+        halves the concurrency limit. Failed requests never raise a limit
+        and their latency is not measured. Latency rising above
+        latency_factor times the fastest observed latency of requests of the
+        same size shrinks the concurrency limit by latency_decrease. Sizes are grouped by powers of
+        two of the estimated tokens, so that a mix of small and large prompts
+        is not mistaken for congestion. Decreases happen at most once per cooldown, so a
+        burst of 429s from one overloaded moment counts once.
+
+        Args:
+            initial_limit (int): Starting number of concurrent requests
+            max_limit (int): Upper bound of concurrent requests
+            min_limit (int): Lower bound of concurrent requests
+            tokens_per_minute (int): Starting token budget per minute, or None for no token limit
+            max_tokens_per_minute (int): Upper bound of the token budget (default: 4x the starting budget)
+            decrease_factor (float): Multiplier applied on a 429 or a server error
+            latency_factor (float): Latency ratio to the fastest observed latency of the same
+                request size that counts as congestion
+            latency_decrease (float): Multiplier applied on congestion
+            cooldown (float): Minimum seconds between two decreases
+            max_retries (int): Retries of a request that failed with a retryable error (see is_retryable)
+        """
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.tpm_limit = float(tokens_per_minute) if tokens_per_minute else None
+        self.max_tpm = max_tokens_per_minute or (4 * tokens_per_minute if tokens_per_minute else None)
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.latency_decrease = latency_decrease
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.token_window = deque()   # [timestamp, tokens] of requests sent in the last minute
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.latency_ewma = {}      # size bucket -> smoothed latency
+        self.fastest_latency = {}   # size bucket -> fastest smoothed latency
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.retries = 0
+
+    def window_tokens(self, now: float) -> float:
+        """
+        Tokens sent during the last minute; callers must hold the condition.
+        """
+        while self.token_window and now - self.token_window[0][0] >= 60:
+            self.token_window.popleft()
+        return sum(tokens for _, tokens in self.token_window)
+
+    def acquire(self, estimated_tokens: int = 0) -> list:
+        """
+        Wait until a request may be sent.
+
+        Args:
+            estimated_tokens (int): Estimated tokens of the request
+
+        Returns:
+            list: Token reservation to pass to release
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                    continue
+                if self.in_flight >= max(int(self.limit), self.min_limit):
+                    self.condition.wait(1.0)
+                    continue
+                if self.tpm_limit and self.token_window and self.window_tokens(now) + estimated_tokens > self.tpm_limit:
+                    self.condition.wait(max(60 - (now - self.token_window[0][0]), 0.05))
+                    continue
+                self.in_flight += 1
+                self.requests += 1
+                reservation = [now, estimated_tokens]
+                self.token_window.append(reservation)
+                return reservation
+
+    def release(self, reservation: list, latency: float, tokens: int = None, rate_limited: bool = False,
+                retry_after: float = None, error: Exception = None):
+        """
+        Report the outcome of a request and adapt the limits.
+
+        Args:
+            reservation (list): Value returned by acquire
+            latency (float): Duration of the request in seconds
+            tokens (int): Tokens actually used, replacing the estimate if given
+            rate_limited (bool): Whether the request was rejected with a 429
+            retry_after (float): Seconds the server asked to wait, if any
+            error (Exception): Error of a request that failed other than with a 429
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            # Latencies are only compared between requests of a similar estimated size
+            size = int(reservation[1]).bit_length()
+            if rate_limited:
+                # Rejected requests consume no quota
+                reservation[1] = 0
+                self.rate_limited += 1
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.limit * self.decrease_factor, self.min_limit)
+                    if self.tpm_limit:
+                        self.tpm_limit *= self.decrease_factor
+                    self.last_decrease = now
+            elif error is not None:
+                # A failure says nothing about the latency of served requests
+                self.failed += 1
+                if is_overload(error) and now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.limit * self.decrease_factor, self.min_limit)
+                    self.last_decrease = now
+            else:
+                if tokens is not None:
+                    reservation[1] = tokens
+                previous = self.latency_ewma.get(size)
+                latency_ewma = latency if previous is None else 0.8 * previous + 0.2 * latency
+                self.latency_ewma[size] = latency_ewma
+                # The fastest latency slowly forgets old values so that the reference can follow slower models
+                fastest = self.fastest_latency.get(size)
+                fastest = latency_ewma if fastest is None else min(fastest * 1.001, latency_ewma)
+                self.fastest_latency[size] = fastest
+                congested = latency_ewma > self.latency_factor * fastest
+                if congested and now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.limit * self.latency_decrease, self.min_limit)
+                    self.last_decrease = now
+                elif not congested:
+                    self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                    if self.tpm_limit:
+                        self.tpm_limit = min(self.tpm_limit * 1.01, self.max_tpm)
+            self.condition.notify_all()
+
+    def call(self, request, estimated_tokens: int = 0):
+        """
+        Send a request under the limiter, retrying 429s, server errors, 408/409,
+        connection errors and timeouts.
+
+        Args:
+            request: Zero-argument callable performing the API call; if its result
+                has usage.total_tokens, that replaces the estimate
+            estimated_tokens (int): Estimated tokens of the request
+
+        Returns:
+            Result of request()
+
+        Raises:
+            Exception: The last error once the retries are exhausted, or any
+                error that is not retryable
+        """
+        for attempt in range(self.max_retries + 1):
+            reservation = self.acquire(estimated_tokens)
+            start = time.monotonic()
+            try:
+                result = request()
+            except Exception as e:
+                status = status_code_of(e)
+                retryable = is_retryable(e)
+                retry_after = retry_after_seconds(e)
+                if retryable and retry_after is None:
+                    # Exponential backoff with jitter when the server gives no hint
+                    retry_after = min(2 ** attempt, 60) * (0.5 + random.random() / 2)
+                self.release(reservation, time.monotonic() - start, rate_limited=status == 429,
+                             retry_after=retry_after if status == 429 else None,
+                             error=e if status != 429 else None)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                with self.condition:
+                    self.retries += 1
+                if status != 429:
+                    time.sleep(retry_after)
+                continue
+            usage = getattr(result, 'usage', None)
+            self.release(reservation, time.monotonic() - start, tokens=getattr(usage, 'total_tokens', None))
+            return result
+
+    def status(self) -> str:
+        """
+        Describe the current limits for progress output.
+
+        Returns:
+            str: e.g. "limit 12 (in flight 10, 45,000/90,000 TPM, 3 rate-limited)"
+        """
+        with self.condition:
+            parts = [f"in flight {self.in_flight}"]
+            if self.tpm_limit:
+                parts.append(f"{self.window_tokens(time.monotonic()):,.0f}/{self.tpm_limit:,.0f} TPM")
+            if self.rate_limited:
+                parts.append(f"{self.rate_limited} rate-limited")
+            if self.failed:
+                parts.append(f"{self.failed} failed")
+            return f"limit {int(self.limit)} ({', '.join(parts)})"
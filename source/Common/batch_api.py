@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import hashlib
+
+# Endpoint and limits of one OpenAI batch input file
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+# Batch statuses after which no more results will arrive
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+class BatchPending(Exception):
+    """Raised by BatchSession.request for a request that was queued for the next batch"""
+
+class BatchRequestError(Exception):
+    """Raised for a request that still failed after all batch attempts"""
+
+def request_id(body: dict) -> str:
+    """
+    Stable custom ID of a request: the same body always gets the same ID, across runs.
+
+    Args:
+        body (dict): Chat completion request body
+
+    Returns:
+        str: e.g. "req-3f2a9c0d41b7e855"
+    """
+    canonical = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return 'req-' + hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+def completion_content(completion: dict) -> str:
+    """
+    Get the message content of a chat completion returned by a batch.
+    """
+    return completion['choices'][0]['message']['content']
+
+class BatchSession:
+    def __init__(self, client, batch_dir: str, poll_interval: float = 30.0, max_attempts: int = 3):
+        """
+        Run chat completion requests through the OpenAI Batch API.
+
+        Requests are added with a custom ID and written to JSONL input files in
+        batch_dir as they arrive, so their bodies (including page images) are not
+        kept in memory. flush() uploads the files, creates the batches, polls
+        them and ingests the results. Requests that failed or were not answered
+        are resubmitted, up to max_attempts times in total.
+
+        Everything is saved in batch_dir: results.jsonl holds the ingested
+        responses and state.json the submitted batches. A run interrupted while
+        waiting can be restarted with the same batch_dir; it waits for the
+        batches already submitted and reuses all results instead of paying for
+        them again.
+
+        Args:
+            client: OpenAI client (its base_url may point to a local stand-in such as batch_server.py)
+            batch_dir (str): Working directory for input files, results and state
+            poll_interval (float): Seconds between two status checks
+            max_attempts (int): Number of submissions of a request before it counts as failed
+        """
+        self.client = client
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        os.makedirs(batch_dir, exist_ok=True)
+
+        self.results = {}     # custom ID -> chat completion
+        self.failures = {}    # custom ID -> error message of the last attempt
+        self.queued = set()   # custom IDs written to the current input files
+        self.writer = None
+        self.input_paths = []   # (input file, custom IDs) written since the last submission
+        self.state = {'batches': [], 'attempts': {}}
+
+        results_path = os.path.join(batch_dir, 'results.jsonl')
+        if os.path.exists(results_path):
+            with open(results_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.results[record['custom_id']] = record['response']
+        state_path = os.path.join(batch_dir, 'state.json')
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        # Custom IDs of submitted batches whose results have not been ingested yet
+        self.in_flight = {cid for batch in self.state['batches'] if not batch['ingested'] for cid in batch['custom_ids']}
+        if self.results or self.state['batches']:
+            print(f"Resuming batch session in {batch_dir}: {len(self.results)} results, "
+                  f"{len(self.in_flight)} requests still in submitted batches")
+
+    def save_state(self):
+        """Write state.json atomically"""
+        state_path = os.path.join(self.batch_dir, 'state.json')
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(state_path + '.tmp', state_path)
+
+    def result(self, custom_id: str):
+        """
+        Look up the outcome of a request.
+
+        Args:
+            custom_id (str): Custom ID of the request
+
+        Returns:
+            dict or None: Chat completion, or None if the request has no result yet
+
+        Raises:
+            BatchRequestError: If the request failed in every attempt
+        """
+        if custom_id in self.results:
+            return self.results[custom_id]
+        if custom_id in self.failures:
+            raise BatchRequestError(self.failures[custom_id])
+        return None
+
+    def add(self, custom_id: str, body: dict):
+        """
+        Queue a request for the next flush, unless it is already queued or submitted.
+
+        Args:
+            custom_id (str): Stable custom ID, unique per request body
+            body (dict): Chat completion request body
+        """
+        if custom_id in self.results or custom_id in self.queued or custom_id in self.in_flight:
+            return
+        self.write_line(custom_id, json.dumps({
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': body
+        }, ensure_ascii=False))
+
+    def request(self, body: dict) -> dict:
+        """
+        Get the completion of a request, queueing it if it has not been answered yet.
+
+        Args:
+            body (dict): Chat completion request body
+
+        Returns:
+            dict: Chat completion
+
+        Raises:
+            BatchPending: If the request was queued; call flush() and ask again
+            BatchRequestError: If the request failed in every attempt
+        """
+        custom_id = request_id(body)
+        completion = self.result(custom_id)
+        if completion is None:
+            self.add(custom_id, body)
+            raise BatchPending(custom_id)
+        return completion
+
+    @property
+    def pending(self) -> int:
+        """Number of requests waiting for a flush or for a submitted batch"""
+        return len(self.queued) + len(self.in_flight)
+
+    def write_line(self, custom_id: str, line: str):
+        """Append a request line, starting a new input file when the current one is full"""
+        size = len(line.encode('utf-8')) + 1
+        if self.writer is None or self.writer_count >= MAX_BATCH_REQUESTS or self.writer_bytes + size > MAX_BATCH_BYTES:
+            self.close_writer()
+            path = os.path.join(self.batch_dir, f"input_{len(self.state['batches']) + len(self.input_paths):04d}.jsonl")
+            self.writer = open(path, 'w', encoding='utf-8')
+            self.writer_count = 0
+            self.writer_bytes = 0
+            self.input_paths.append((path, []))
+        self.writer.write(line + '\n')
+        self.input_paths[-1][1].append(custom_id)
+        self.queued.add(custom_id)
+        self.writer_count += 1
+        self.writer_bytes += size
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def submit(self):
+        """Upload the written input files and create one batch for each"""
+        self.close_writer()
+        for path, custom_ids in self.input_paths:
+            with open(path, 'rb') as f:
+                input_file = self.client.files.create(file=f, purpose='batch')
+            batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                               completion_window=COMPLETION_WINDOW)
+            for custom_id in custom_ids:
+                self.state['attempts'][custom_id] = self.state['attempts'].get(custom_id, 0) + 1
+            self.in_flight.update(custom_ids)
+            self.state['batches'].append({'id': batch.id, 'input_path': path, 'custom_ids': custom_ids, 'ingested': False})
+            self.save_state()
+            print(f"Submitted batch {batch.id}: {len(custom_ids)} requests from {path}")
+        self.input_paths = []
+        self.queued = set()
+
+    def wait(self, batch_id: str):
+        """
+        Poll a batch until it reaches a terminal status.
+
+        Returns:
+            Batch object of the finished batch
+        """
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            progress = f" ({counts.completed + counts.failed}/{counts.total} requests)" if counts else ""
+            print(f"Batch {batch_id}: {batch.status}{progress}")
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            time.sleep(self.poll_interval)
+
+    def ingest(self, entry: dict, batch) -> list:
+        """
+        Store the results of a finished batch and collect the requests to resubmit.
+
+        Args:
+            entry (dict): State entry of the batch
+            batch: Finished Batch object
+
+        Returns:
+            list: (custom ID, input line) of the requests that failed or got no answer and have attempts left
+        """
+        errors = {}
+        answered = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get('response') or {}
+                if response.get('status_code') == 200 and response.get('body'):
+                    answered[record['custom_id']] = response['body']
+                else:
+                    error = record.get('error') or (response.get('body') or {}).get('error') or response
+                    errors[record['custom_id']] = str(error.get('message', error) if isinstance(error, dict) else error)
+        if batch.status == 'failed' and batch.errors:
+            reason = '; '.join(str(error.message) for error in batch.errors.data or [])
+        else:
+            reason = f"batch {batch.status} without a result"
+
+        with open(os.path.join(self.batch_dir, 'results.jsonl'), 'a', encoding='utf-8') as f:
+            for custom_id, completion in answered.items():
+                f.write(json.dumps({'custom_id': custom_id, 'response': completion}, ensure_ascii=False) + '\n')
+        self.results.update(answered)
+
+        retry_lines = []
+        with open(entry['input_path'], 'r', encoding='utf-8') as f:
+            for custom_id, line in zip(entry['custom_ids'], f):
+                if custom_id in answered:
+                    continue
+                if self.state['attempts'].get(custom_id, 0) < self.max_attempts:
+                    retry_lines.append((custom_id, line.rstrip('\n')))
+                else:
+                    self.failures[custom_id] = errors.get(custom_id, reason)
+        entry['ingested'] = True
+        self.in_flight.difference_update(entry['custom_ids'])
+        self.save_state()
+        print(f"Ingested batch {entry['id']}: {len(answered)} answered, {len(entry['custom_ids']) - len(answered)} failed")
+        return retry_lines
+
+    def flush(self):
+        """
+        Submit the queued requests and wait until every request has a result or has used all attempts.
+        """
+        while True:
+            self.submit()
+            waiting = [entry for entry in self.state['batches'] if not entry['ingested']]
+            if not waiting:
+                return
+            retry_lines = []
+            for entry in waiting:
+                retry_lines.extend(self.ingest(entry, self.wait(entry['id'])))
+            if retry_lines:
+                print(f"Resubmitting {len(retry_lines)} failed requests")
+            for custom_id, line in retry_lines:
+                self.write_line(custom_id, line)
@@ -0,0 +1,284 @@
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from adaptive_limit import estimate_tokens
+
+DOCUMENT_ID_PATTERN = re.compile(r'文件 (\d+)')
+FINALISTS_PATTERN = re.compile(r'選出最可能包含問題答案的 (\d+) 個文件編號')
+PAGES_PATTERN = re.compile(r'The images are pages ([\d, ]+) of the PDF document')
+
+def stub_answer(body: dict) -> str:
+    """
+    Deterministic stand-in for the model's JSON answer.
+
+    Retrieval prompts are answered with their first document, card selection
+    prompts with their first documents, page analysis prompts for several
+    pages with the start of their text for each page, and any other prompt
+    (e.g. single-page analysis) with the start of its text as page1_text.
+
+    Args:
+        body (dict): Chat completion request body
+
+    Returns:
+        str: JSON answer
+    """
+    content = body['messages'][-1]['content']
+    if isinstance(content, list):
+        content = ' '.join(part.get('text', '') for part in content if part.get('type') == 'text')
+    document_ids = [int(file_id) for file_id in DOCUMENT_ID_PATTERN.findall(content)]
+    finalists = FINALISTS_PATTERN.search(content)
+    if finalists:
+        return json.dumps({'candidates': document_ids[:int(finalists.group(1))]})
+    if '"retrieve"' in content and document_ids:
+        return json.dumps({'retrieve': document_ids[0]})
+    pages = PAGES_PATTERN.search(content)
+    if pages:
+        return json.dumps({f"page{number.strip()}_text": content[:200] for number in pages.group(1).split(',')},
+                          ensure_ascii=False)
+    return json.dumps({'page1_text': content[:200]}, ensure_ascii=False)
+
+def stub_completion(body: dict, completion_id: str) -> dict:
+    """
+    Chat completion object answering a request body with stub_answer.
+
+    Token usage is estimated like the adaptive limiter does (one token per CJK
+    character, one per four other characters, IMAGE_TOKENS per image), so token
+    totals of stand-in runs can be compared between configurations.
+    """
+    answer = stub_answer(body)
+    texts = []
+    num_images = 0
+    for message in body['messages']:
+        content = message['content']
+        if isinstance(content, list):
+            texts.extend(part.get('text', '') for part in content if part.get('type') == 'text')
+            num_images += sum(1 for part in content if part.get('type') == 'image_url')
+        else:
+            texts.append(content)
+    prompt_tokens = estimate_tokens('\n'.join(texts), num_images)
+    completion_tokens = estimate_tokens(answer)
+    return {
+        'id': f"chatcmpl-{completion_id}", 'object': 'chat.completion', 'created': int(time.time()),
+        'model': body.get('model'),
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': answer}}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+class StubBatchBackend:
+    def __init__(self, fail_rate: float = 0.0, delay: float = 0.0, latency: float = 0.0,
+                 token_latency: float = 0.0):
+        """
+        In-memory stand-in for the OpenAI Files, Batch and Chat Completions APIs.
+
+        Args:
+            fail_rate (float): Share of requests whose first attempt fails with a 500, chosen by custom ID
+            delay (float): Seconds a batch stays in_progress before it completes
+            latency (float): Seconds before a chat completion is answered
+            token_latency (float): Additional seconds per 1000 prompt tokens, so that
+                                   large prompts take longer than small ones
+        """
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.latency = latency
+        self.token_latency = token_latency
+        self.completions = 0
+        self.lock = threading.Lock()
+        self.files = {}      # file ID -> (file object, content bytes)
+        self.batches = {}    # batch ID -> batch object
+        self.attempted = set()
+
+    def create_file(self, filename: str, content: bytes, purpose: str) -> dict:
+        with self.lock:
+            file_id = f"file-{len(self.files) + 1}"
+            file_object = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                           'filename': filename, 'purpose': purpose, 'status': 'processed'}
+            self.files[file_id] = (file_object, content)
+            return file_object
+
+    def create_batch(self, params: dict) -> dict:
+        with self.lock:
+            batch_id = f"batch-{len(self.batches) + 1}"
+            batch = {'id': batch_id, 'object': 'batch', 'endpoint': params['endpoint'],
+                     'input_file_id': params['input_file_id'], 'completion_window': params['completion_window'],
+                     'status': 'in_progress', 'created_at': int(time.time()), 'output_file_id': None,
+                     'error_file_id': None, 'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+                     'ready_at': time.time() + self.delay}
+            self.batches[batch_id] = batch
+            return self.batch_view(batch)
+
+    def batch_view(self, batch: dict) -> dict:
+        return {key: value for key, value in batch.items() if key != 'ready_at'}
+
+    def retrieve_batch(self, batch_id: str) -> dict:
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch['status'] == 'in_progress' and time.time() >= batch['ready_at']:
+                self.run_batch(batch)
+            return self.batch_view(batch)
+
+    def run_batch(self, batch: dict):
+        """Answer every request of a batch and write its output and error files"""
+        outputs, errors = [], []
+        for line in self.files[batch['input_file_id']][1].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            custom_id = request['custom_id']
+            first_attempt = custom_id not in self.attempted
+            self.attempted.add(custom_id)
+            if first_attempt and zlib.crc32(custom_id.encode('utf-8')) % 1000 < self.fail_rate * 1000:
+                errors.append({'id': f"batch_req_{len(errors)}", 'custom_id': custom_id, 'response': {
+                    'status_code': 500, 'body': {'error': {'message': 'Stub server error', 'type': 'server_error'}}}, 'error': None})
+                continue
+            outputs.append({'id': f"batch_req_{len(outputs)}", 'custom_id': custom_id, 'error': None, 'response': {
+                'status_code': 200, 'body': stub_completion(request['body'], custom_id)}})
+        for key, records in (('output_file_id', outputs), ('error_file_id', errors)):
+            if records:
+                content = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+                file_id = f"file-{len(self.files) + 1}"
+                self.files[file_id] = ({'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                                        'filename': f"{batch['id']}_{key}.jsonl", 'purpose': 'batch_output', 'status': 'processed'}, content)
+                batch[key] = file_id
+        batch['request_counts'] = {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)}
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+
+    def chat_completion(self, body: dict) -> dict:
+        """Answer one interactive chat completion request after the configured latency"""
+        with self.lock:
+            self.completions += 1
+            completion_id = str(self.completions)
+        completion = stub_completion(body, completion_id)
+        latency = self.latency + self.token_latency * completion['usage']['prompt_tokens'] / 1000
+        if latency > 0:
+            time.sleep(latency)
+        return completion
+
+class BatchRequestHandler(BaseHTTPRequestHandler):
+    backend = None
+
+    def send_json(self, payload: dict, status: int = 200):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def not_found(self):
+        self.send_json({'error': {'message': f"Unknown route {self.path}", 'type': 'invalid_request_error'}}, 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.endswith('/files'):
+            # Multipart upload with the fields "file" and "purpose"
+            message = BytesParser(policy=policy.default).parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+            fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+            self.send_json(self.backend.create_file(fields['file'].get_filename() or 'input.jsonl',
+                                                    fields['file'].get_payload(decode=True),
+                                                    fields['purpose'].get_content().strip()))
+        elif self.path.endswith('/batches'):
+            self.send_json(self.backend.create_batch(json.loads(body)))
+        elif self.path.endswith('/chat/completions'):
+            self.send_json(self.backend.chat_completion(json.loads(body)))
+        else:
+            self.not_found()
+
+    def do_GET(self):
+        match = re.search(r'/files/([^/]+)/content$', self.path)
+        if match and match.group(1) in self.backend.files:
+            content = self.backend.files[match.group(1)][1]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        match = re.search(r'/batches/([^/]+)$', self.path)
+        if match and match.group(1) in self.backend.batches:
+            self.send_json(self.backend.retrieve_batch(match.group(1)))
+            return
+        self.not_found()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port: int = 0, fail_rate: float = 0.0, delay: float = 0.0, latency: float = 0.0,
+                 token_latency: float = 0.0):
+    """
+    Start the stand-in endpoint in a background thread.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port
+        fail_rate (float): Share of batch requests whose first attempt fails
+        delay (float): Seconds until a batch completes
+        latency (float): Seconds before a chat completion is answered
+        token_latency (float): Additional seconds per 1000 prompt tokens
+
+    Returns:
+        tuple: (server, base_url) where base_url can be passed to OpenAI(base_url=...)
+
+    Example:
+        server, base_url = start_server(fail_rate=0.1)
+        client = OpenAI(base_url=base_url, api_key="stub")
+        ...
+        server.shutdown()
+    """
+    handler = type('Handler', (BatchRequestHandler,), {'backend': StubBatchBackend(fail_rate, delay, latency, token_latency)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    """
+    Main entry point for the local stand-in API endpoint.
+
+    Serves the subset of the OpenAI Files and Batch APIs used by batch_api.py,
+    and interactive chat completions, and answers every request with a
+    deterministic stub, so that runs of my_retrieve.py and MultiModel.py can be
+    tested without cost.
+
+    Usage:
+        python batch_server.py [--port 8765] [--fail_rate 0.1] [--delay 2] [--latency 0.5] [--token_latency 0.05]
+
+        OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub \
+            python ../Model/my_retrieve.py ... --batch_dir ./batch --poll_interval 1
+    """
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the OpenAI Batch and Chat Completions APIs.')
+    parser.add_argument('--port',
+                       type=int,
+                       default=8765,
+                       help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--fail_rate',
+                       type=float,
+                       default=0.0,
+                       help='Share of requests whose first attempt fails with a server error (default: %(default)s)')
+    parser.add_argument('--delay',
+                       type=float,
+                       default=0.0,
+                       help='Seconds a batch stays in progress (default: %(default)s)')
+    parser.add_argument('--latency',
+                       type=float,
+                       default=0.0,
+                       help='Seconds before a chat completion is answered (default: %(default)s)')
+    parser.add_argument('--token_latency',
+                       type=float,
+                       default=0.0,
+                       help='Additional seconds per 1000 prompt tokens of a chat completion (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.fail_rate, args.delay, args.latency, args.token_latency)
+    print(f"Stand-in endpoint listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import threading
+from openai.types.chat import ChatCompletion
+from batch_api import request_id
+
+MODES = ('record', 'replay')
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for a request that was not recorded"""
+
+class Cassette:
+    def __init__(self, path: str, mode: str = 'replay', time_scale: float = 1.0):
+        """
+        Record chat completion requests with their responses and latencies, and serve them back.
+
+        Each request is keyed by a hash of its body (see batch_api.request_id), so a
+        replay answers exactly the requests that were recorded, whatever their order
+        or concurrency. Any change to the prompt, model or parameters changes the key
+        and makes the request a miss.
+
+        The cassette is a JSONL file with one record per request: its key, body,
+        response and observed latency. Records are appended and flushed as soon as a
+        response arrives, so an interrupted recording keeps everything recorded so
+        far; recording again into the same file adds to it, and the last record of a
+        key wins.
+
+        Args:
+            path (str): Cassette file
+            mode (str): 'record' to call the API and save each response,
+                        'replay' to answer from the file without network access
+            time_scale (float): In replay mode, factor applied to the recorded latencies
+                                (1.0 replays them as observed, 0 answers immediately)
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}', expected one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.lock = threading.Lock()
+        self.records = {}   # key -> record
+        self.played = 0
+        self.recorded = 0
+        self.misses = 0
+        self.latency = 0.0  # Sum of the recorded latencies played or recorded
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record['key']] = record
+        elif mode == 'replay':
+            raise FileNotFoundError(f"Cassette not found: {path}")
+
+    def call(self, body: dict, request):
+        """
+        Answer one chat completion request.
+
+        Args:
+            body (dict): Request body, used as the key
+            request: Zero-argument function sending the request to the API; only called in record mode
+
+        Returns:
+            ChatCompletion: The recorded or received response
+
+        Raises:
+            CassetteMiss: In replay mode, if the request was not recorded
+        """
+        key = request_id(body)
+        if self.mode == 'replay':
+            record = self.records.get(key)
+            if record is None:
+                with self.lock:
+                    self.misses += 1
+                raise CassetteMiss(f"No recorded response for request {key} in {self.path}")
+            if self.time_scale > 0:
+                time.sleep(record['latency'] * self.time_scale)
+            with self.lock:
+                self.played += 1
+                self.latency += record['latency']
+            return ChatCompletion.model_validate(record['response'])
+
+        start = time.perf_counter()
+        response = request()
+        latency = time.perf_counter() - start
+        record = {'key': key, 'latency': round(latency, 4), 'body': body, 'response': response.model_dump()}
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.records[key] = record
+            self.recorded += 1
+            self.latency += latency
+        return response
+
+    def summary(self) -> str:
+        """
+        Describe what was recorded or replayed, for the end of a run
+        """
+        if self.mode == 'record':
+            return f"Cassette: recorded {self.recorded} requests ({self.latency:.1f}s of API latency) to {self.path}"
+        return (f"Cassette: replayed {self.played} requests, {self.misses} not recorded "
+                f"({self.latency:.1f}s of recorded latency, time scale {self.time_scale:g})")
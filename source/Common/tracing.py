@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+# Active tracer, or None while tracing is disabled
+tracer = None
+
+class NullSpan:
+    """Span returned while tracing is disabled; entering and leaving it does nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.cat, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        """Attach values known only at the end of the span, e.g. token counts"""
+        self.args.update(args)
+
+class Tracer:
+    def __init__(self, path: str):
+        """
+        Collect spans in memory and write them as a Chrome trace / Perfetto JSON file.
+
+        Args:
+            path (str): Output file; "{pid}" in the path is replaced by the process ID
+        """
+        self.path = path.replace('{pid}', str(os.getpid()))
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+            'args': {'name': os.path.basename(sys.argv[0]) or 'python'}
+        }]
+
+    def add(self, name: str, cat: str, start_ns: int, end_ns: int, args: dict):
+        """Record one complete event of the calling thread"""
+        tid = threading.get_ident()
+        event = {
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+            'ts': (start_ns - self.origin) / 1000, 'dur': (end_ns - start_ns) / 1000
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            if tid not in self.threads:
+                # Name each thread's track after the Python thread, e.g. ThreadPoolExecutor-0_3
+                self.threads.add(tid)
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                    'args': {'name': threading.current_thread().name}})
+            self.events.append(event)
+
+    def save(self):
+        """Write all events recorded so far"""
+        with self.lock:
+            events = list(self.events)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+        print(f"Saved {len(events)} trace events to {self.path}")
+
+def enable(path: str):
+    """
+    Start tracing; the trace is written to path when the process exits.
+
+    Open the file in https://ui.perfetto.dev or chrome://tracing.
+
+    Args:
+        path (str): Output file; use "{pid}" in the path when several processes trace at once
+    """
+    global tracer
+    if tracer is None:
+        tracer = Tracer(path)
+        atexit.register(tracer.save)
+
+def span(name: str, cat: str = 'preprocess', **args):
+    """
+    Time a block of code as one span of the calling thread.
+
+    While tracing is disabled this returns a shared no-op object, so
+    instrumented code pays about one function call per span.
+
+    Args:
+        name (str): Span name shown in the trace viewer
+        cat (str): Span category, for filtering
+        **args: Values shown with the span, e.g. pdf=..., page=...
+
+    Returns:
+        Context manager with a set(**args) method for values known at the end
+
+    Example:
+        with span('render_page', pdf=pdf_name, page=page_num):
+            pix = page.get_pixmap(matrix=mat)
+    """
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, cat, args)
@@ -0,0 +1,653 @@
+import os
+import json
+import zlib
+import shutil
+import argparse
+import threading
+import numpy as np
+from tqdm import tqdm
+from faq_matcher import normalize
+from finance_facts import document_pages
+from doc_cards import CATEGORIES, content_hash, load_corpus
+
+# Chunks longer than this are split so that every chunk fits one embedding request
+MAX_CHUNK_CHARS = 4000
+DEFAULT_DIM = 512
+VECTORS_FILE = 'vectors.f16'
+OFFSETS_FILE = 'offsets.npy'
+META_FILE = 'meta.json'
+MANIFEST_FILE = 'manifest.json'
+
+# Segments are merged once there are more than MAX_SEGMENTS of them or more than MAX_DEAD_RATIO of their rows are dead
+MAX_SEGMENTS = 4
+MAX_DEAD_RATIO = 0.25
+
+# Serializes manifest changes within a process; only one process may update an index at a time
+WRITE_LOCK = threading.Lock()
+
+# Names of segments being written by a merge, protected from cleanup
+MERGING = set()
+
+class HashingEncoder:
+    def __init__(self, dim: int = DEFAULT_DIM):
+        """
+        Deterministic local encoder: signed feature hashing of character bigrams.
+
+        Needs no network access or model weights, so it suits offline tests and
+        CPU-only machines. Similar texts share bigrams and get similar vectors.
+
+        Args:
+            dim (int): Vector dimension
+        """
+        self.dim = dim
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        Encode texts into L2-normalized vectors.
+
+        Args:
+            texts (list): Texts to encode
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(texts), dim)
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = normalize(text)
+            hashes = np.fromiter(
+                (zlib.crc32(text[i:i + 2].encode('utf-8')) for i in range(len(text) - 1)),
+                dtype=np.int64, count=max(len(text) - 1, 0)
+            )
+            if hashes.size == 0:
+                continue
+            signs = np.where(hashes & (1 << 31), -1.0, 1.0)
+            counts = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+            # Sublinear term frequency keeps long pages from being dominated by repeated bigrams
+            vectors[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class OpenAIEncoder:
+    def __init__(self, dim: int = DEFAULT_DIM, model: str = "text-embedding-3-small"):
+        """
+        Remote encoder using the OpenAI embeddings API.
+
+        Args:
+            dim (int): Vector dimension requested from the API
+            model (str): Embedding model name
+        """
+        from openai import OpenAI
+        self.client = OpenAI()
+        self.dim = dim
+        self.model = model
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        Encode texts into L2-normalized vectors.
+
+        Args:
+            texts (list): Texts to encode
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(texts), dim)
+        """
+        response = self.client.embeddings.create(
+            model=self.model,
+            input=[text or ' ' for text in texts],
+            dimensions=self.dim
+        )
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+ENCODERS = {
+    'hashing': HashingEncoder,
+    'openai': OpenAIEncoder,
+}
+
+def get_encoder(name: str, dim: int):
+    """
+    Create an embedding backend by name.
+
+    Args:
+        name (str): Key of ENCODERS
+        dim (int): Vector dimension
+
+    Returns:
+        Encoder with an encode(texts) -> np.ndarray method
+
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{name}', expected one of {sorted(ENCODERS)}")
+    return ENCODERS[name](dim)
+
+def document_chunks(doc, category: str) -> list:
+    """
+    Split a corpus entry into page-level chunks.
+
+    Args:
+        doc: Document from updated_*_output, or the list of FAQ entries for a pid
+        category (str): 'finance', 'insurance' or 'faq'
+
+    Returns:
+        list: (page, text) tuples; FAQ entries use their entry index as page and
+              text without a page marker uses -1
+    """
+    if category == 'faq':
+        pages = [(index, '\n'.join([entry['question']] + list(entry['answers']))) for index, entry in enumerate(doc)]
+    else:
+        pages = [(-1 if page is None else page, text) for page, text in document_pages(doc)]
+    chunks = []
+    for page, text in pages:
+        text = text.strip()
+        for start in range(0, len(text), MAX_CHUNK_CHARS):
+            chunks.append((page, text[start:start + MAX_CHUNK_CHARS]))
+    return chunks
+
+def load_manifest(index_dir: str) -> dict:
+    """
+    Load the manifest of a segmented index.
+
+    Args:
+        index_dir (str): Directory of the index files
+
+    Returns:
+        dict: Manifest, or None if the directory holds no segmented index
+    """
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(index_dir: str, manifest: dict):
+    """
+    Replace the manifest atomically, so that readers see either the old or the new segments.
+    """
+    manifest['generation'] = manifest.get('generation', 0) + 1
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def empty_manifest(encoder_name: str, dim: int) -> dict:
+    """Manifest of an index without segments"""
+    return {
+        'encoder': encoder_name,
+        'dim': dim,
+        'max_chunk_chars': MAX_CHUNK_CHARS,
+        'categories': list(CATEGORIES),
+        'generation': 0,
+        'next_segment': 0,
+        'segments': [],
+        'documents': {category: {} for category in CATEGORIES},
+    }
+
+def new_segment_name(manifest: dict) -> str:
+    """Allocate the name of the next segment"""
+    name = f"segment_{manifest['next_segment']:06d}"
+    manifest['next_segment'] += 1
+    return name
+
+def write_segment(index_dir: str, name: str, chunks: list, offsets: list, encoder, batch_size: int):
+    """
+    Embed chunks into a new segment directory.
+
+    Args:
+        index_dir (str): Directory of the index files
+        name (str): Segment name
+        chunks (list): Chunk texts, grouped by document
+        offsets (list): (category index, doc ID, page) of each chunk
+        encoder: Encoder with an encode(texts) method
+        batch_size (int): Chunks per encode call
+    """
+    segment_dir = os.path.join(index_dir, name)
+    os.makedirs(segment_dir, exist_ok=True)
+    vectors = np.memmap(os.path.join(segment_dir, VECTORS_FILE), dtype=np.float16, mode='w+',
+                        shape=(max(len(chunks), 1), encoder.dim))
+    for start in tqdm(range(0, len(chunks), batch_size), desc=f'Embedding {name}'):
+        batch = chunks[start:start + batch_size]
+        vectors[start:start + len(batch)] = encoder.encode(batch).astype(np.float16)
+    vectors.flush()
+    del vectors
+    np.save(os.path.join(segment_dir, OFFSETS_FILE), np.array(offsets, dtype=np.int32).reshape(-1, 3))
+
+def remove_files(index_dir: str, names: list):
+    """
+    Delete segment directories and legacy files that are no longer in the manifest.
+
+    Readers that still have them memory-mapped keep working on POSIX systems;
+    elsewhere, files in use are left for the next cleanup.
+    """
+    for name in names:
+        path = os.path.join(index_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.isfile(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def stale_files(index_dir: str, manifest: dict) -> list:
+    """
+    List the segment directories and legacy files of index_dir not referenced by the manifest
+    """
+    live = {segment['name'] for segment in manifest['segments']} | MERGING
+    stale = [name for name in os.listdir(index_dir)
+             if name.startswith('segment_') and name not in live]
+    return stale + [name for name in (VECTORS_FILE, OFFSETS_FILE, META_FILE)
+                    if os.path.isfile(os.path.join(index_dir, name))]
+
+def update_dense_index(source_path: str, index_dir: str, encoder_name: str = 'hashing',
+                       dim: int = DEFAULT_DIM, batch_size: int = 64, rebuild: bool = False) -> dict:
+    """
+    Bring the index up to date with the corpus, embedding only what changed.
+
+    The manifest records the content hash and the live row range of every document.
+    New and modified documents are embedded into one new delta segment. The rows of
+    modified and deleted documents stay in their old segment as tombstones: the
+    manifest no longer points to them, and they are counted as dead until the
+    segment is merged. Changing the encoder, the dimension or the chunk size
+    rebuilds the whole index.
+
+    Args:
+        source_path (str): Reference directory containing updated_*_output and faq/
+        index_dir (str): Directory of the index files
+        encoder_name (str): Embedding backend, a key of ENCODERS
+        dim (int): Vector dimension
+        batch_size (int): Chunks per encode call
+        rebuild (bool): Embed every document into one new segment
+
+    Returns:
+        dict: Category -> counts of 'added', 'modified', 'deleted' and 'unchanged'
+              documents, plus 'segment' (name of the delta segment or None) and
+              'chunks' (number of chunks embedded)
+    """
+    encoder = get_encoder(encoder_name, dim)
+    os.makedirs(index_dir, exist_ok=True)
+
+    with WRITE_LOCK:
+        manifest = load_manifest(index_dir)
+        if (rebuild or manifest is None or manifest['encoder'] != encoder_name or manifest['dim'] != dim
+                or manifest['max_chunk_chars'] != MAX_CHUNK_CHARS):
+            previous = manifest
+            manifest = empty_manifest(encoder_name, dim)
+            if previous:
+                manifest['next_segment'] = previous['next_segment']
+                manifest['generation'] = previous['generation']
+
+        name = new_segment_name(manifest)
+        chunks = []
+        offsets = []
+        new_rows = {}
+        stats = {'segment': None, 'chunks': 0}
+        dead = {}
+        for category_index, category in enumerate(CATEGORIES):
+            corpus_dict = load_corpus(source_path, category)
+            documents = manifest['documents'][category]
+            counts = {'added': 0, 'modified': 0, 'deleted': 0, 'unchanged': 0}
+            for doc_id in sorted(corpus_dict):
+                doc_hash = content_hash(corpus_dict[doc_id])
+                entry = documents.get(str(doc_id))
+                if entry and entry['hash'] == doc_hash:
+                    counts['unchanged'] += 1
+                    continue
+                if entry:
+                    counts['modified'] += 1
+                    dead[entry['segment']] = dead.get(entry['segment'], 0) + entry['rows'][1] - entry['rows'][0]
+                else:
+                    counts['added'] += 1
+                start = len(chunks)
+                for page, text in document_chunks(corpus_dict[doc_id], category):
+                    chunks.append(text)
+                    offsets.append((category_index, doc_id, page))
+                new_rows[(category, str(doc_id))] = {'hash': doc_hash, 'segment': name, 'rows': [start, len(chunks)]}
+            for doc_id in [doc_id for doc_id in documents if int(doc_id) not in corpus_dict]:
+                entry = documents.pop(doc_id)
+                counts['deleted'] += 1
+                dead[entry['segment']] = dead.get(entry['segment'], 0) + entry['rows'][1] - entry['rows'][0]
+            stats[category] = counts
+
+        if new_rows:
+            write_segment(index_dir, name, chunks, offsets, encoder, batch_size)
+            manifest['segments'].append({'name': name, 'num_chunks': len(chunks), 'dead_chunks': 0})
+            for (category, doc_id), entry in new_rows.items():
+                manifest['documents'][category][doc_id] = entry
+            stats['segment'] = name
+            stats['chunks'] = len(chunks)
+        for segment in manifest['segments']:
+            segment['dead_chunks'] += dead.get(segment['name'], 0)
+
+        if new_rows or dead or not os.path.isfile(os.path.join(index_dir, MANIFEST_FILE)):
+            save_manifest(index_dir, manifest)
+        remove_files(index_dir, stale_files(index_dir, manifest))
+    return stats
+
+def build_dense_index(source_path: str, output_dir: str, encoder_name: str = 'hashing',
+                      dim: int = DEFAULT_DIM, batch_size: int = 64) -> dict:
+    """
+    Embed every page chunk of all corpora into one new segment, replacing any existing index.
+
+    Args:
+        source_path (str): Reference directory containing updated_*_output and faq/
+        output_dir (str): Directory for the index files
+        encoder_name (str): Embedding backend, a key of ENCODERS
+        dim (int): Vector dimension
+        batch_size (int): Chunks per encode call
+
+    Returns:
+        dict: Update statistics, see update_dense_index
+    """
+    return update_dense_index(source_path, output_dir, encoder_name, dim, batch_size, rebuild=True)
+
+def needs_merge(manifest: dict, max_segments: int = MAX_SEGMENTS, max_dead_ratio: float = MAX_DEAD_RATIO) -> bool:
+    """
+    Whether the index has more than max_segments segments or more than max_dead_ratio dead rows
+    """
+    total = sum(segment['num_chunks'] for segment in manifest['segments'])
+    dead = sum(segment['dead_chunks'] for segment in manifest['segments'])
+    return len(manifest['segments']) > max_segments or (total > 0 and dead / total > max_dead_ratio)
+
+def merge_segments(index_dir: str) -> dict:
+    """
+    Copy the live rows of all segments into one segment and drop the tombstoned rows.
+
+    Vectors are copied, not re-embedded. The copy works on a snapshot of the manifest
+    without holding the write lock, so queries and updates continue meanwhile.
+    Documents updated or deleted during the merge keep their newer state; segments
+    added during the merge are kept as they are.
+
+    Args:
+        index_dir (str): Directory of the index files
+
+    Returns:
+        dict: 'segments' merged, 'live_chunks' copied and 'dead_chunks' dropped,
+              or an empty dict if there was nothing to merge
+    """
+    with WRITE_LOCK:
+        snapshot = load_manifest(index_dir)
+        if snapshot is None or not snapshot['segments']:
+            return {}
+        # Reserve the segment name so that updates during the merge neither reuse nor delete it
+        name = new_segment_name(snapshot)
+        save_manifest(index_dir, snapshot)
+        MERGING.add(name)
+
+    sources = {segment['name']: np.memmap(os.path.join(index_dir, segment['name'], VECTORS_FILE), dtype=np.float16,
+                                          mode='r', shape=(max(segment['num_chunks'], 1), snapshot['dim']))
+               for segment in snapshot['segments']}
+    source_offsets = {segment['name']: np.load(os.path.join(index_dir, segment['name'], OFFSETS_FILE))
+                      for segment in snapshot['segments']}
+    entries = [(category, doc_id, entry) for category in CATEGORIES
+               for doc_id, entry in sorted(snapshot['documents'][category].items(), key=lambda item: int(item[0]))]
+    live_chunks = sum(entry['rows'][1] - entry['rows'][0] for _, _, entry in entries)
+
+    segment_dir = os.path.join(index_dir, name)
+    os.makedirs(segment_dir, exist_ok=True)
+    vectors = np.memmap(os.path.join(segment_dir, VECTORS_FILE), dtype=np.float16, mode='w+',
+                        shape=(max(live_chunks, 1), snapshot['dim']))
+    offsets = np.zeros((live_chunks, 3), dtype=np.int32)
+    merged_rows = {}
+    row = 0
+    for category, doc_id, entry in entries:
+        start, end = entry['rows']
+        vectors[row:row + end - start] = sources[entry['segment']][start:end]
+        offsets[row:row + end - start] = source_offsets[entry['segment']][start:end]
+        merged_rows[(category, doc_id)] = (entry, [row, row + end - start])
+        row += end - start
+    vectors.flush()
+    del vectors, sources
+    np.save(os.path.join(segment_dir, OFFSETS_FILE), offsets)
+
+    with WRITE_LOCK:
+        manifest = load_manifest(index_dir)
+        merged_names = {segment['name'] for segment in snapshot['segments']}
+        dead_chunks = live_chunks
+        for (category, doc_id), (old_entry, rows) in merged_rows.items():
+            entry = manifest['documents'][category].get(doc_id)
+            if entry == old_entry:
+                manifest['documents'][category][doc_id] = {'hash': entry['hash'], 'segment': name, 'rows': rows}
+                dead_chunks -= rows[1] - rows[0]
+        manifest['segments'] = [{'name': name, 'num_chunks': live_chunks, 'dead_chunks': dead_chunks}] + \
+            [segment for segment in manifest['segments'] if segment['name'] not in merged_names]
+        save_manifest(index_dir, manifest)
+        MERGING.discard(name)
+        remove_files(index_dir, stale_files(index_dir, manifest))
+
+    return {
+        'segments': len(merged_names),
+        'live_chunks': live_chunks - dead_chunks,
+        'dead_chunks': sum(segment['dead_chunks'] for segment in snapshot['segments']),
+    }
+
+def start_merge(index_dir: str) -> threading.Thread:
+    """
+    Run merge_segments in a background thread, e.g. from a long-running process after an update.
+
+    Returns:
+        threading.Thread: The started thread; join it before the process exits
+    """
+    thread = threading.Thread(target=merge_segments, args=(index_dir,), name='dense-index-merge')
+    thread.start()
+    return thread
+
+class DenseIndex:
+    def __init__(self, index_dir: str, encoder=None):
+        """
+        Open a dense index built by update_dense_index without loading the vectors into memory.
+
+        Each segment's vectors are memory-mapped. Indexes written before segments
+        were introduced (a single meta.json) are opened as one segment.
+
+        Args:
+            index_dir (str): Directory of the index files
+            encoder: Optional encoder overriding the one recorded in the manifest;
+                it must produce vectors of the same kind and dimension
+        """
+        self.index_dir = index_dir
+        self.encoder_override = encoder
+        self.encoder = None
+        self.generation = None
+        self.open()
+
+    def open(self):
+        """Map the segments listed in the current manifest"""
+        manifest = load_manifest(self.index_dir)
+        if manifest is None:
+            with open(os.path.join(self.index_dir, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            segments = [('', meta['num_chunks'])]
+            documents = {category: {doc_id: (0, *row_range) for doc_id, row_range in ranges.items()}
+                         for category, ranges in meta['ranges'].items()}
+        else:
+            meta = manifest
+            segment_index = {segment['name']: index for index, segment in enumerate(manifest['segments'])}
+            segments = [(segment['name'], segment['num_chunks']) for segment in manifest['segments']]
+            documents = {category: {doc_id: (segment_index[entry['segment']], *entry['rows'])
+                                    for doc_id, entry in entries.items()}
+                         for category, entries in manifest['documents'].items()}
+        if self.encoder is None or (self.encoder_override is None and (meta['encoder'], meta['dim']) != self.encoder_spec):
+            self.encoder = self.encoder_override or get_encoder(meta['encoder'], meta['dim'])
+        self.encoder_spec = (meta['encoder'], meta['dim'])
+        self.dim = meta['dim']
+        # Category -> document ID -> (segment index, start row, end row)
+        self.ranges = {category: {int(doc_id): location for doc_id, location in entries.items()}
+                       for category, entries in documents.items()}
+        self.segments = [np.memmap(os.path.join(self.index_dir, name, VECTORS_FILE), dtype=np.float16, mode='r',
+                                   shape=(max(num_chunks, 1), self.dim))
+                         for name, num_chunks in segments]
+        self.num_chunks = sum(end - start for entries in self.ranges.values() for _, start, end in entries.values())
+        self.generation = manifest['generation'] if manifest else None
+
+    def refresh(self) -> bool:
+        """
+        Reopen the index if an update or merge has replaced the manifest since it was opened.
+
+        Returns:
+            bool: True if the index was reopened
+        """
+        manifest = load_manifest(self.index_dir)
+        if manifest is None or manifest['generation'] == self.generation:
+            return False
+        self.open()
+        return True
+
+    def score(self, query: str, category: str, source_ids: list, query_vector: np.ndarray = None) -> dict:
+        """
+        Score candidate documents by their best page similarity to the query.
+
+        Only the rows of the candidate documents are read from the memory maps.
+
+        Args:
+            query (str): User's question
+            category (str): 'finance', 'insurance' or 'faq'
+            source_ids (list): Candidate document IDs
+            query_vector (np.ndarray): The query already encoded, e.g. together with
+                other queries in one encoder call (default: encode query)
+
+        Returns:
+            dict: Document ID -> cosine similarity of its best chunk; documents
+                  missing from the index are left out
+        """
+        ranges = self.ranges.get(category, {})
+        by_segment = {}
+        for doc_id in source_ids:
+            location = ranges.get(int(doc_id))
+            if location and location[2] > location[1]:
+                by_segment.setdefault(location[0], []).append(int(doc_id))
+        if not by_segment:
+            return {}
+        if query_vector is None:
+            query_vector = self.encoder.encode([query])[0]
+        scores = {}
+        for segment_index, doc_ids in by_segment.items():
+            rows = np.concatenate([np.arange(*ranges[doc_id][1:]) for doc_id in doc_ids])
+            similarities = self.segments[segment_index][rows].astype(np.float32) @ query_vector
+            # Each document's rows are one contiguous segment of `rows`; take the maximum per segment
+            lengths = [ranges[doc_id][2] - ranges[doc_id][1] for doc_id in doc_ids]
+            segment_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            best = np.maximum.reduceat(similarities, segment_starts)
+            scores.update((doc_id, float(value)) for doc_id, value in zip(doc_ids, best))
+        return scores
+
+    def rank(self, query: str, category: str, source_ids: list, query_vector: np.ndarray = None) -> list:
+        """
+        Order candidate documents from most to least similar.
+
+        Documents missing from the index keep their relative order at the end.
+
+        Args:
+            query (str): User's question
+            category (str): 'finance', 'insurance' or 'faq'
+            source_ids (list): Candidate document IDs
+            query_vector (np.ndarray): The query already encoded (default: encode query)
+
+        Returns:
+            list: Candidate IDs sorted by dense similarity
+        """
+        scores = self.score(query, category, source_ids, query_vector)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return ranked + [doc_id for doc_id in source_ids if int(doc_id) not in scores]
+
+if __name__ == "__main__":
+    """
+    Main entry point for building and updating the dense vector index.
+
+    Embeds every page of the finance and insurance documents and every FAQ entry,
+    and stores the vectors as memory-mapped float16 segments with offset tables.
+    Reruns embed only new and modified documents into a delta segment, tombstone
+    deleted ones, and merge the segments once there are too many or too many dead rows.
+
+    Usage:
+        python dense_index.py --source_path ./reference --output_dir ./reference/dense
+                              [--encoder hashing|openai] [--dim 512] [--batch_size 64]
+                              [--rebuild] [--merge auto|always|never]
+                              [--question_path questions.json --truth_path ground_truths.json]
+    """
+    import time
+
+    parser = argparse.ArgumentParser(description='Build the dense vector index of the reference documents.')
+    parser.add_argument('--source_path',
+                       type=str,
+                       default="./reference",
+                       help='Reference directory (default: %(default)s)')
+    parser.add_argument('--output_dir',
+                       type=str,
+                       default="./reference/dense",
+                       help='Directory where the index will be saved (default: %(default)s)')
+    parser.add_argument('--encoder',
+                       type=str,
+                       choices=sorted(ENCODERS),
+                       default='hashing',
+                       help='Embedding backend (default: %(default)s)')
+    parser.add_argument('--dim',
+                       type=int,
+                       default=DEFAULT_DIM,
+                       help='Vector dimension (default: %(default)s)')
+    parser.add_argument('--batch_size',
+                       type=int,
+                       default=64,
+                       help='Chunks per embedding request (default: %(default)s)')
+    parser.add_argument('--rebuild',
+                       action='store_true',
+                       help='Embed every document again instead of only the changed ones')
+    parser.add_argument('--merge',
+                       type=str,
+                       choices=['auto', 'always', 'never'],
+                       default='auto',
+                       help=f'Merge segments after the update: auto merges beyond {MAX_SEGMENTS} segments '
+                            f'or {MAX_DEAD_RATIO * 100:.0f}%% dead rows (default: %(default)s)')
+    parser.add_argument('--question_path',
+                       type=str,
+                       default=None,
+                       help='Optional question file to evaluate the ranking on after building')
+    parser.add_argument('--truth_path',
+                       type=str,
+                       default=None,
+                       help='Ground truth file for --question_path')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = update_dense_index(args.source_path, args.output_dir, args.encoder, args.dim, args.batch_size, args.rebuild)
+    for category in CATEGORIES:
+        counts = stats[category]
+        print(f"{category}: {counts['added']} added, {counts['modified']} modified, "
+              f"{counts['deleted']} deleted, {counts['unchanged']} unchanged documents")
+    print(f"Embedded {stats['chunks']} chunks in {time.perf_counter() - start:.1f}s"
+          + (f" into {stats['segment']}" if stats['segment'] else ""))
+
+    manifest = load_manifest(args.output_dir)
+    if args.merge == 'always' or (args.merge == 'auto' and needs_merge(manifest)):
+        start = time.perf_counter()
+        merged = merge_segments(args.output_dir)
+        if merged:
+            print(f"Merged {merged['segments']} segments in {time.perf_counter() - start:.1f}s: "
+                  f"{merged['live_chunks']} live chunks kept, {merged['dead_chunks']} dead chunks dropped")
+        manifest = load_manifest(args.output_dir)
+    dead = sum(segment['dead_chunks'] for segment in manifest['segments'])
+    total = sum(segment['num_chunks'] for segment in manifest['segments'])
+    print(f"Index {args.output_dir}: {len(manifest['segments'])} segments, {total - dead} live and {dead} dead chunks")
+
+    if args.question_path and args.truth_path:
+        with open(args.question_path, 'r', encoding='utf-8') as f:
+            questions = json.load(f)['questions']
+        with open(args.truth_path, 'r', encoding='utf-8') as f:
+            truths = {truth['qid']: truth['retrieve'] for truth in json.load(f)['ground_truths']}
+
+        index = DenseIndex(args.output_dir)
+        start = time.perf_counter()
+        for category in CATEGORIES:
+            selected = [q for q in questions if q['category'] == category and q['qid'] in truths]
+            if not selected:
+                continue
+            top1 = top3 = 0
+            for q in selected:
+                ranked = index.rank(q['query'], category, q['source'])
+                top1 += ranked[0] == truths[q['qid']]
+                top3 += truths[q['qid']] in ranked[:3]
+            print(f"{category}: top-1 {top1}/{len(selected)}, top-3 {top3}/{len(selected)}")
+        print(f"Average ranking time: {(time.perf_counter() - start) / max(len(questions), 1) * 1e3:.2f} ms")
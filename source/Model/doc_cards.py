@@ -0,0 +1,388 @@
+import os
+import re
+import json
+import math
+import hashlib
+import argparse
+import concurrent.futures
+from collections import Counter
+from pathlib import Path
+import jieba
+from dotenv import load_dotenv
+from openai import OpenAI
+
+# Set the path to the .env file
+env_path = Path(__file__).resolve().parent.parent / '.env'
+
+# Load the .env file
+load_dotenv(dotenv_path=env_path)
+
+CATEGORIES = ('finance', 'insurance', 'faq')
+
+# Number of entries kept per card field
+MAX_PERIODS = 3
+MAX_PRODUCTS = 3
+MAX_TOPICS = 8
+MAX_HEADINGS = 8
+
+COMPANY_PATTERN = re.compile(r'([\u4e00-\u9fff]{2,8})股份有限公司')
+PRODUCT_PATTERN = re.compile(r'[「《]([^」》\n]{2,30}?(?:保險|附約|條款|計畫))[」》]')
+ROC_DATE_PATTERN = re.compile(r'(?:民國)?\s*(\d{2,3})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日')
+AD_DATE_PATTERN = re.compile(r'(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日')
+QUARTER_PATTERN = re.compile(r'(?:民國)?\s*(\d{2,4})\s*年\s*第\s*([一二三四1-4])\s*季')
+CJK_WORD_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+PAGE_KEY_PATTERN = re.compile(r'"page(\d+)_text"')
+HEADING_PATTERNS = [
+    re.compile(r'^第\s*[一二三四五六七八九十百零〇\d\s]+\s*條'),
+    re.compile(r'^[一二三四五六七八九十]+\s*、'),
+    re.compile(r'^[（(][一二三四五六七八九十]+[)）]'),
+    re.compile(r'^【[^】]+】'),
+]
+QUARTER_NUMBERS = {'一': 1, '二': 2, '三': 3, '四': 4}
+
+def document_text(doc, category: str) -> str:
+    """
+    Flatten a corpus entry to plain text.
+
+    Args:
+        doc: Document from updated_*_output, or the list of FAQ entries for a pid
+        category (str): 'finance', 'insurance' or 'faq'
+
+    Returns:
+        str: Text of the raw PDF text and vision responses, or of the FAQ questions and answers
+    """
+    if category == 'faq':
+        return '\n'.join(
+            '\n'.join([entry['question']] + list(entry['answers'])) for entry in doc
+        )
+    responses = [response for response in doc.get('combined_responses', []) if response]
+    return '\n'.join(responses + [doc.get('raw_text') or ''])
+
+def content_hash(doc) -> str:
+    """
+    Hash a document so that cached cards can be reused while it is unchanged.
+
+    Args:
+        doc: Corpus entry
+
+    Returns:
+        str: Hex digest of the canonical JSON form of the document
+    """
+    return hashlib.sha1(json.dumps(doc, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def to_ad_year(year: int) -> int:
+    """Convert an ROC year (e.g. 111) to an AD year (e.g. 2022); AD years are kept"""
+    return year + 1911 if year < 1000 else year
+
+def extract_periods(text: str) -> list:
+    """
+    Find the reporting periods mentioned in a document.
+
+    Args:
+        text (str): Document text
+
+    Returns:
+        list: Most frequent periods, as 'YYYY-MM-DD' dates or 'YYYYQn' quarters
+    """
+    periods = Counter()
+    for pattern in (ROC_DATE_PATTERN, AD_DATE_PATTERN):
+        for year, month, day in pattern.findall(text):
+            if 1 <= int(month) <= 12 and 1 <= int(day) <= 31:
+                periods[f"{to_ad_year(int(year))}-{int(month):02d}-{int(day):02d}"] += 1
+    for year, quarter in QUARTER_PATTERN.findall(text):
+        quarter = QUARTER_NUMBERS.get(quarter, quarter)
+        periods[f"{to_ad_year(int(year))}Q{quarter}"] += 1
+    return [period for period, _ in periods.most_common(MAX_PERIODS)]
+
+def extract_headings(text: str) -> list:
+    """
+    Find heading-like lines such as "第十六條", "一、", "(二)" and "【除外責任】".
+
+    Args:
+        text (str): Document text with line breaks
+
+    Returns:
+        list: First distinct headings, truncated to 30 characters
+    """
+    headings = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if line and any(pattern.match(line) for pattern in HEADING_PATTERNS):
+            heading = line[:30]
+            if heading not in headings:
+                headings.append(heading)
+                if len(headings) >= MAX_HEADINGS:
+                    break
+    return headings
+
+def tokenize(text: str) -> list:
+    """Split text into CJK words of at least two characters and English words of at least four letters"""
+    return [
+        word for word in jieba.lcut(text)
+        if (len(word) >= 2 and CJK_WORD_PATTERN.fullmatch(word)) or (len(word) >= 4 and word.isascii() and word.isalpha())
+    ]
+
+def build_card(doc_id: int, doc, category: str, tokens: list, document_frequency: Counter, num_docs: int) -> dict:
+    """
+    Build an extractive summary card for one document.
+
+    Args:
+        doc_id (int): Document ID
+        doc: Corpus entry
+        category (str): 'finance', 'insurance' or 'faq'
+        tokens (list): Terms of the document text, from tokenize()
+        document_frequency (Counter): Number of documents of the category containing each term
+        num_docs (int): Number of documents of the category
+
+    Returns:
+        dict: Card with company, periods, products, topics, headings and pages
+    """
+    text = document_text(doc, category)
+    if category == 'faq':
+        # FAQ entries are short: the listed questions are the best headings
+        headings = [entry['question'] for entry in doc][:MAX_HEADINGS]
+        pages = []
+    else:
+        headings = extract_headings(doc.get('raw_text') or '')
+        pages = sorted({int(n) for n in PAGE_KEY_PATTERN.findall(text)})
+
+    companies = Counter(COMPANY_PATTERN.findall(text))
+    products = Counter(PRODUCT_PATTERN.findall(text))
+
+    # Topics are the terms that are frequent in the document but rare in its category
+    term_frequency = Counter(tokens)
+    scores = {
+        term: count * math.log((1 + num_docs) / (1 + document_frequency[term]))
+        for term, count in term_frequency.items()
+    }
+    topics = sorted(scores, key=lambda term: (-scores[term], term))[:MAX_TOPICS]
+
+    return {
+        'doc_id': doc_id,
+        'category': category,
+        'hash': content_hash(doc),
+        'company': companies.most_common(1)[0][0] if companies else None,
+        'periods': extract_periods(text),
+        'products': [product for product, _ in products.most_common(MAX_PRODUCTS)],
+        'topics': topics,
+        'headings': headings,
+        'pages': pages,
+        'summary': None,
+        'refined': False
+    }
+
+def refine_card(client: OpenAI, card: dict, doc, category: str) -> dict:
+    """
+    Improve an extractive card with the LLM.
+
+    Args:
+        client (OpenAI): OpenAI client
+        card (dict): Extractive card
+        doc: Corpus entry the card describes
+        category (str): 'finance', 'insurance' or 'faq'
+
+    Returns:
+        dict: Card with corrected fields and a one-sentence summary, or the
+              original card if the API call fails
+    """
+    prompt = f"""你是一個文件索引助理。以下是一份文件的自動摘要卡與文件內容。
+請修正摘要卡中的公司名稱、期間、商品名稱與主題關鍵字，並以一句繁體中文寫出文件摘要。
+
+摘要卡：
+{json.dumps({key: card[key] for key in ('company', 'periods', 'products', 'topics')}, ensure_ascii=False)}
+
+文件內容：
+{document_text(doc, category)[:6000]}
+
+回答格式，用JSON格式：
+{{
+    "company": 公司名稱或null,
+    "periods": [期間],
+    "products": [商品名稱],
+    "topics": [主題關鍵字],
+    "summary": 一句摘要
+}}"""
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=400,
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
+        refined = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        print(f"Error refining card for document {card['doc_id']}: {e}")
+        return card
+
+    card = dict(card)
+    for key in ('company', 'periods', 'products', 'topics', 'summary'):
+        if refined.get(key):
+            card[key] = refined[key]
+    card['refined'] = True
+    return card
+
+def build_cards(corpus_dict: dict, category: str, cached_cards: dict = None, refine: bool = False, max_tasks: int = 20) -> dict:
+    """
+    Build the cards of one category, reusing cached cards of unchanged documents.
+
+    Args:
+        corpus_dict (dict): Document ID -> corpus entry
+        category (str): 'finance', 'insurance' or 'faq'
+        cached_cards (dict): Previously built cards, keyed by document ID
+        refine (bool): Whether to improve the cards with the LLM
+        max_tasks (int): Maximum number of concurrent refinement requests
+
+    Returns:
+        dict: Document ID -> card
+    """
+    cached_cards = cached_cards or {}
+
+    cards = {}
+    stale_ids = []
+    for doc_id, doc in corpus_dict.items():
+        cached = cached_cards.get(doc_id)
+        if cached and cached['hash'] == content_hash(doc):
+            cards[doc_id] = cached
+        else:
+            stale_ids.append(doc_id)
+
+    if stale_ids:
+        # Topic scores of the rebuilt cards need document frequencies over the whole category
+        tokens_by_doc = {}
+        document_frequency = Counter()
+        for doc_id, doc in corpus_dict.items():
+            tokens_by_doc[doc_id] = tokenize(document_text(doc, category))
+            document_frequency.update(set(tokens_by_doc[doc_id]))
+        for doc_id in stale_ids:
+            cards[doc_id] = build_card(doc_id, corpus_dict[doc_id], category, tokens_by_doc[doc_id], document_frequency, len(corpus_dict))
+    print(f"{category}: {len(stale_ids)} cards built, {len(cards) - len(stale_ids)} reused from cache")
+
+    if refine:
+        to_refine = [doc_id for doc_id, card in cards.items() if not card['refined']]
+        print(f"{category}: refining {len(to_refine)} cards with the LLM")
+        client = OpenAI()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_tasks) as executor:
+            futures = {
+                executor.submit(refine_card, client, cards[doc_id], corpus_dict[doc_id], category): doc_id
+                for doc_id in to_refine
+            }
+            for future in concurrent.futures.as_completed(futures):
+                cards[futures[future]] = future.result()
+    return cards
+
+def format_card(card: dict) -> str:
+    """
+    Render a card as a compact line for the card-selection prompt.
+
+    Args:
+        card (dict): Document card
+
+    Returns:
+        str: One-line description of the document
+    """
+    fields = []
+    if card.get('company'):
+        fields.append(f"公司: {card['company']}")
+    if card.get('periods'):
+        fields.append(f"期間: {', '.join(card['periods'])}")
+    if card.get('products'):
+        fields.append(f"商品: {', '.join(card['products'])}")
+    if card.get('pages'):
+        fields.append(f"頁碼: {', '.join(str(page) for page in card['pages'][:5])}")
+    if card.get('summary'):
+        fields.append(f"摘要: {card['summary']}")
+    if card.get('topics'):
+        fields.append(f"主題: {', '.join(card['topics'])}")
+    if card.get('headings'):
+        fields.append(f"標題: {'; '.join(card['headings'])}")
+    return ' | '.join(fields)
+
+def load_cards(cards_dir: str) -> dict:
+    """
+    Load the cards written by this script.
+
+    Args:
+        cards_dir (str): Directory containing '{category}.json' card files
+
+    Returns:
+        dict: Category -> (document ID -> card); categories without a file are omitted
+    """
+    cards_dict = {}
+    for category in CATEGORIES:
+        card_path = os.path.join(cards_dir, f'{category}.json')
+        if os.path.isfile(card_path):
+            with open(card_path, 'r', encoding='utf-8') as f:
+                cards_dict[category] = {int(key): card for key, card in json.load(f).items()}
+            print(f"Loaded {len(cards_dict[category])} {category} cards")
+    return cards_dict
+
+def load_corpus(source_path: str, category: str) -> dict:
+    """
+    Load one category of the reference data.
+
+    Args:
+        source_path (str): Reference directory containing updated_*_output and faq/
+        category (str): 'finance', 'insurance' or 'faq'
+
+    Returns:
+        dict: Document ID -> corpus entry
+    """
+    if category == 'faq':
+        with open(os.path.join(source_path, 'faq', 'pid_map_content.json'), 'r', encoding='utf-8') as f:
+            return {int(key): value for key, value in json.load(f).items()}
+    corpus_dir = os.path.join(source_path, f'updated_{category}_output')
+    corpus_dict = {}
+    for file in os.listdir(corpus_dir):
+        if file.endswith('.json'):
+            with open(os.path.join(corpus_dir, file), 'r', encoding='utf-8') as f:
+                corpus_dict[int(file.replace('.json', ''))] = json.load(f)
+    return corpus_dict
+
+if __name__ == "__main__":
+    """
+    Main entry point for building document summary cards.
+
+    Builds one compact card per finance, insurance and FAQ document with the
+    company, reporting periods, product names, key topics and page headings.
+    Cards are extracted from the text, optionally refined by the LLM, and cached:
+    rerunning the script only rebuilds cards of documents whose content changed.
+
+    Usage:
+        python doc_cards.py --source_path ./reference --output_dir ./reference/cards [--refine] [--max_tasks 20]
+    """
+    parser = argparse.ArgumentParser(description='Build cached summary cards for the reference documents.')
+    parser.add_argument('--source_path',
+                       type=str,
+                       default="./reference",
+                       help='Reference directory (default: %(default)s)')
+    parser.add_argument('--output_dir',
+                       type=str,
+                       default="./reference/cards",
+                       help='Directory where the card files are saved (default: %(default)s)')
+    parser.add_argument('--refine',
+                       action='store_true',
+                       help='Improve the extractive cards with the LLM')
+    parser.add_argument('--max_tasks',
+                       type=int,
+                       default=20,
+                       help='Maximum number of concurrent refinement requests (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    print(f"Reading reference data from: {args.source_path}")
+    print(f"Saving cards to: {args.output_dir}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    cached_cards_dict = load_cards(args.output_dir)
+
+    for category in CATEGORIES:
+        corpus_dict = load_corpus(args.source_path, category)
+        card_path = os.path.join(args.output_dir, f'{category}.json')
+        cards = build_cards(corpus_dict, category, cached_cards_dict.get(category), args.refine, args.max_tasks)
+        with open(card_path, 'w', encoding='utf-8') as f:
+            json.dump({str(doc_id): cards[doc_id] for doc_id in sorted(cards)}, f, ensure_ascii=False, indent=2)
+        print(f"Saved {len(cards)} {category} cards to: {card_path}")
+
+    print("\nProcessing complete!")
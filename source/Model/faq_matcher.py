@@ -0,0 +1,258 @@
+import re
+import json
+import zlib
+import argparse
+import unicodedata
+import numpy as np
+
+# MinHash parameters: 32 bands of 2 rows find strings with a character bigram
+# Jaccard similarity of 0.3 with a probability of about 95%
+NGRAM_SIZE = 2
+NUM_BANDS = 32
+ROWS_PER_BAND = 2
+MERSENNE_PRIME = (1 << 31) - 1
+SEED = 1
+
+# A match is answered locally only if it is similar enough and clearly ahead of the runner-up
+MIN_SCORE = 0.3
+MIN_MARGIN = 0.1
+
+NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+def normalize(text: str) -> str:
+    """
+    Normalize text for matching: full-width to half-width, lower case, no whitespace or punctuation.
+
+    Args:
+        text (str): Text to normalize
+
+    Returns:
+        str: Normalized text
+
+    Example:
+        normalize("如何取消 LINE 個人化通知服務？") -> "如何取消line個人化通知服務"
+    """
+    return NON_WORD_PATTERN.sub('', unicodedata.normalize('NFKC', text).lower())
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> set:
+    """
+    Split normalized text into its set of character n-grams.
+
+    Args:
+        text (str): Normalized text
+        n (int): N-gram size
+
+    Returns:
+        set: Character n-grams; texts shorter than n yield themselves
+    """
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class FAQMatcher:
+    def __init__(self, faq_dict: dict, min_score: float = MIN_SCORE, min_margin: float = MIN_MARGIN):
+        """
+        Index every question and answer string of the FAQ mapping.
+
+        Args:
+            faq_dict (dict): Mapping of pid to a list of {'question': str, 'answers': [str]}
+                as loaded from pid_map_content.json
+            min_score (float): Minimum n-gram Jaccard similarity of a local answer
+            min_margin (float): Minimum lead of the best pid over the runner-up
+        """
+        self.min_score = min_score
+        self.min_margin = min_margin
+
+        rng = np.random.RandomState(SEED)
+        num_perm = NUM_BANDS * ROWS_PER_BAND
+        self.perm_a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.perm_b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+        self.string_pids = []    # String index -> pid
+        self.string_grams = []   # String index -> set of n-grams
+        self.exact = {}          # Normalized string -> set of pids
+        self.buckets = {}        # (band, band signature) -> list of string indexes
+
+        for pid, entries in faq_dict.items():
+            for entry in entries:
+                for text in [entry['question']] + list(entry['answers']):
+                    self.add_string(int(pid), text)
+
+    def minhash(self, grams: set) -> np.ndarray:
+        """
+        Compute the MinHash signature of a set of n-grams.
+
+        Args:
+            grams (set): Non-empty set of n-grams
+
+        Returns:
+            np.ndarray: Signature of NUM_BANDS * ROWS_PER_BAND values
+        """
+        hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) % MERSENNE_PRIME for gram in grams), dtype=np.uint64, count=len(grams))
+        # Operands below 2^31 keep the products below 2^62, so uint64 never overflows
+        values = (np.outer(hashes, self.perm_a) + self.perm_b) % MERSENNE_PRIME
+        return values.min(axis=0)
+
+    def band_keys(self, signature: np.ndarray) -> list:
+        """
+        Split a signature into its LSH bucket keys, one per band.
+        """
+        return [(band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()) for band in range(NUM_BANDS)]
+
+    def add_string(self, pid: int, text: str):
+        """
+        Add one question or answer string of a pid to the index.
+        """
+        normalized = normalize(text)
+        grams = char_ngrams(normalized)
+        if not grams:
+            return
+        self.exact.setdefault(normalized, set()).add(pid)
+        index = len(self.string_pids)
+        self.string_pids.append(pid)
+        self.string_grams.append(grams)
+        for key in self.band_keys(self.minhash(grams)):
+            self.buckets.setdefault(key, []).append(index)
+
+    def score(self, query: str, source_ids: list) -> dict:
+        """
+        Score the candidate pids of a query.
+
+        A pid whose question or answer equals the query after normalization scores 1.0.
+        Otherwise the strings sharing an LSH bucket with the query are compared by
+        n-gram Jaccard similarity, and each pid keeps its best string. Pids without
+        a similar string score 0.0.
+
+        Args:
+            query (str): User's question
+            source_ids (list): Candidate pids
+
+        Returns:
+            dict: Mapping of each candidate pid to its score
+        """
+        candidates = {int(pid) for pid in source_ids}
+        scores = dict.fromkeys(candidates, 0.0)
+
+        normalized = normalize(query)
+        for pid in self.exact.get(normalized, ()):
+            if pid in candidates:
+                scores[pid] = 1.0
+
+        grams = char_ngrams(normalized)
+        if not grams:
+            return scores
+        seen = set()
+        for key in self.band_keys(self.minhash(grams)):
+            for index in self.buckets.get(key, ()):
+                pid = self.string_pids[index]
+                if index in seen or pid not in candidates:
+                    continue
+                seen.add(index)
+                string_grams = self.string_grams[index]
+                similarity = len(grams & string_grams) / len(grams | string_grams)
+                scores[pid] = max(scores[pid], similarity)
+        return scores
+
+    def match(self, query: str, source_ids: list):
+        """
+        Answer a FAQ question locally if one candidate is a confident match.
+
+        Args:
+            query (str): User's question
+            source_ids (list): Candidate pids
+
+        Returns:
+            int or None: Matched pid, or None if the question is ambiguous and should go to the LLM
+
+        Example:
+            matcher.match("請問如何取消LINE個人化通知服務?", [117, 20, 63]) -> 63
+        """
+        scores = self.score(query, source_ids)
+        if not scores:
+            return None
+        ranked = sorted(scores.values(), reverse=True)
+        best_pid = max(scores, key=scores.get)
+        runner_up = ranked[1] if len(ranked) > 1 else 0.0
+        if ranked[0] >= 1.0 and runner_up < 1.0:
+            return best_pid
+        if ranked[0] >= self.min_score and ranked[0] - runner_up >= self.min_margin:
+            return best_pid
+        return None
+
+def load_faq(faq_path: str) -> dict:
+    """
+    Load pid_map_content.json with integer pids.
+
+    Args:
+        faq_path (str): Path to pid_map_content.json
+
+    Returns:
+        dict: Mapping of pid to its list of question entries
+    """
+    with open(faq_path, 'r', encoding='utf-8') as f:
+        return {int(key): value for key, value in json.load(f).items()}
+
+if __name__ == "__main__":
+    """
+    Main entry point for checking the FAQ matcher on a question file.
+
+    Reports how many FAQ questions would be answered locally and, if ground
+    truths are given, how many of the local answers are correct.
+
+    Usage:
+        python faq_matcher.py --faq_path ./reference/faq/pid_map_content.json
+                              --question_path /path/to/questions.json
+                              [--truth_path /path/to/ground_truths.json]
+                              [--min_score 0.3] [--min_margin 0.1]
+    """
+    import time
+
+    parser = argparse.ArgumentParser(description='Check which FAQ questions the local matcher answers.')
+    parser.add_argument('--faq_path',
+                       type=str,
+                       default="./reference/faq/pid_map_content.json",
+                       help='FAQ mapping file (default: %(default)s)')
+    parser.add_argument('--question_path',
+                       type=str,
+                       default="./dataset/preliminary/questions_example.json",
+                       help='Question file (default: %(default)s)')
+    parser.add_argument('--truth_path',
+                       type=str,
+                       default=None,
+                       help='Ground truth file for checking the local answers (default: none)')
+    parser.add_argument('--min_score',
+                       type=float,
+                       default=MIN_SCORE,
+                       help='Minimum similarity of a local answer (default: %(default)s)')
+    parser.add_argument('--min_margin',
+                       type=float,
+                       default=MIN_MARGIN,
+                       help='Minimum lead over the runner-up (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    matcher = FAQMatcher(load_faq(args.faq_path), args.min_score, args.min_margin)
+    print(f"Indexed {len(matcher.string_pids)} FAQ strings in {time.perf_counter() - start:.2f}s")
+
+    with open(args.question_path, 'r', encoding='utf-8') as f:
+        questions = [q for q in json.load(f)['questions'] if q['category'] == 'faq']
+
+    truths = {}
+    if args.truth_path:
+        with open(args.truth_path, 'r', encoding='utf-8') as f:
+            truths = {truth['qid']: truth['retrieve'] for truth in json.load(f)['ground_truths']}
+
+    start = time.perf_counter()
+    matches = {q['qid']: matcher.match(q['query'], q['source']) for q in questions}
+    elapsed = time.perf_counter() - start
+
+    answered = {qid: pid for qid, pid in matches.items() if pid is not None}
+    print(f"Answered locally: {len(answered)}/{len(questions)} FAQ questions")
+    print(f"Average match time: {elapsed / max(len(questions), 1) * 1e6:.0f} µs")
+    if truths:
+        correct = sum(1 for qid, pid in answered.items() if truths.get(qid) == pid)
+        print(f"Correct local answers: {correct}/{len(answered)}")
+        for qid, pid in answered.items():
+            if truths.get(qid) != pid:
+                print(f"  Question ID {qid}: matched {pid}, expected {truths.get(qid)}")
@@ -0,0 +1,454 @@
+import os
+import re
+import json
+import bisect
+import argparse
+from collections import Counter
+from doc_cards import content_hash, load_corpus
+
+# Chinese numerals used in ROC dates such as 民國一一二年三月三十一日
+CHINESE_DIGITS = {'零': 0, '○': 0, '〇': 0, 'Ｏ': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5,
+                  '六': 6, '七': 7, '八': 8, '九': 9}
+CHINESE_NUMBER = r'[\d零○〇Ｏ一二三四五六七八九十]'
+
+DATE_PATTERN = re.compile(
+    rf'(?:民國\s*)?({CHINESE_NUMBER}{{2,4}})\s*年\s*(?:度\s*)?({CHINESE_NUMBER}{{1,3}})\s*月\s*({CHINESE_NUMBER}{{1,3}})\s*日'
+)
+QUARTER_PATTERN = re.compile(rf'(?:民國\s*)?({CHINESE_NUMBER}{{2,4}})\s*年\s*(?:度\s*)?第\s*([一二三四1-4])\s*季')
+# Filings name the reporting group in their page headers, e.g. "聯華電子股份有限公司及子公司"
+COMPANY_PATTERN = re.compile(r'(?:^|\n|"|\s)([\u4e00-\u9fff]{2,8})股份有限公司(?:及|暨)(?:其)?子公司')
+PAGE_TEXT_PATTERN = re.compile(r'"page(\d+)_text"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# "<metric> 為 新台幣 1,234,567 千元" style statements in the vision text
+STATEMENT_PATTERN = re.compile(
+    r'([\u4e00-\u9fff（）()、\-－]{2,24}?)\s*(?:金額|總額|合計)?\s*(?:分別)?(?:約為|為|是|計|達|：|:)\s*'
+    r'(?:新[臺台]幣)?\s*\$?\s*(\(?-?[\d,]+(?:\.\d+)?\)?)\s*(千元|仟元|億元|萬元|元|%)?'
+)
+VALUE_PATTERN = re.compile(r'^\(?-?\$?\s*[\d,]+(?:\.\d+)?\)?%?$')
+QUERY_QUARTER_PATTERN = re.compile(rf'({CHINESE_NUMBER}{{2,4}})\s*年\s*(?:度\s*)?第\s*([一二三四1-4])\s*季')
+QUARTER_END = {1: (3, 31), 2: (6, 30), 3: (9, 30), 4: (12, 31)}
+
+def chinese_to_int(value: str) -> int:
+    """
+    Convert Arabic or Chinese numerals to an integer.
+
+    Args:
+        value (str): Digits such as "112", "一一二", "三十一" or "十二"
+
+    Returns:
+        int: Parsed number
+
+    Example:
+        chinese_to_int("一一二") -> 112, chinese_to_int("三十一") -> 31
+    """
+    if value.isdigit():
+        return int(value)
+    if '十' in value:
+        tens, _, units = value.partition('十')
+        return (CHINESE_DIGITS.get(tens, 1) if tens else 1) * 10 + (CHINESE_DIGITS.get(units, 0) if units else 0)
+    number = 0
+    for char in value:
+        number = number * 10 + CHINESE_DIGITS[char]
+    return number
+
+def normalize_date(year: str, month: str, day: str) -> str:
+    """
+    Normalize an ROC or AD date to ISO format.
+
+    Args:
+        year (str): ROC year (e.g. "111", "一一一") or AD year (e.g. "2022")
+        month (str): Month
+        day (str): Day
+
+    Returns:
+        str: 'YYYY-MM-DD', or None if the date is invalid
+    """
+    year, month, day = chinese_to_int(year), chinese_to_int(month), chinese_to_int(day)
+    if year < 1000:
+        year += 1911
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f"{year}-{month:02d}-{day:02d}"
+
+def quarter_end(year: str, quarter: str) -> str:
+    """
+    Map a quarter to the ISO date at which its report is made up.
+
+    Args:
+        year (str): ROC or AD year
+        quarter (str): Quarter number, Arabic or Chinese
+
+    Returns:
+        str: 'YYYY-MM-DD' of the last day of the quarter
+    """
+    month, day = QUARTER_END[chinese_to_int(quarter)]
+    return normalize_date(year, str(month), str(day))
+
+def find_periods(text: str) -> list:
+    """
+    Find all dates and quarters in a text, in order of appearance.
+
+    Args:
+        text (str): Text to scan
+
+    Returns:
+        list: (position, ISO date) tuples
+    """
+    periods = []
+    for match in DATE_PATTERN.finditer(text):
+        period = normalize_date(*match.groups())
+        if period:
+            periods.append((match.start(), period))
+    for match in QUARTER_PATTERN.finditer(text):
+        periods.append((match.start(), quarter_end(*match.groups())))
+    return sorted(periods)
+
+def report_period(text: str) -> str:
+    """
+    Guess the reporting period of a filing: the latest quarter-end date it mentions.
+
+    Args:
+        text (str): Document text
+
+    Returns:
+        str: ISO date, or None if no quarter-end date is mentioned
+    """
+    quarter_ends = {f"{month:02d}-{day:02d}" for month, day in QUARTER_END.values()}
+    dates = [period for _, period in find_periods(text) if period[5:] in quarter_ends]
+    return max(dates) if dates else None
+
+def parse_value(value: str) -> float:
+    """
+    Parse a reported figure; parentheses denote a negative amount.
+
+    Args:
+        value (str): Figure such as "10,023,003", "(1,234)" or "12.5%"
+
+    Returns:
+        float: Parsed value, or None if it is not a number
+    """
+    negative = value.startswith('(') or value.startswith('-')
+    digits = value.strip('()$%- ').replace(',', '')
+    try:
+        number = float(digits)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+def document_pages(doc: dict) -> list:
+    """
+    Split a document into page texts.
+
+    Args:
+        doc (dict): Document from updated_finance_output
+
+    Returns:
+        list: (page number or None, text) tuples for the vision responses and the raw text
+    """
+    pages = []
+    for response in doc.get('combined_responses', []):
+        if not response:
+            continue
+        matches = PAGE_TEXT_PATTERN.findall(response)
+        for page, text in matches:
+            try:
+                text = json.loads(f'"{text}"')
+            except json.JSONDecodeError:
+                pass
+            pages.append((int(page), text))
+        if not matches:
+            pages.append((None, response))
+    # The raw text has no page markers; attribute it to the only page if there is one
+    page_numbers = {page for page, _ in pages if page is not None}
+    raw_page = page_numbers.pop() if len(page_numbers) == 1 else None
+    pages.append((raw_page, doc.get('raw_text') or ''))
+    return pages
+
+def extract_table_facts(text: str, default_period: str) -> list:
+    """
+    Extract facts from table rows written by ExtractPDF as "cell | cell | cell".
+
+    A row whose cells contain dates is used as the header that assigns a
+    period to each column; other rows give one fact per numeric cell.
+
+    Args:
+        text (str): Page text
+        default_period (str): Period used when no header date applies
+
+    Returns:
+        list: (metric, period, value, unit) tuples
+    """
+    facts = []
+    column_periods = {}
+    for line in text.split('\n'):
+        if ' | ' not in line:
+            continue
+        cells = [cell.strip() for cell in line.split(' | ')]
+        header_periods = {index: find_periods(cell) for index, cell in enumerate(cells)}
+        if any(header_periods.values()):
+            column_periods = {index: periods[-1][1] for index, periods in header_periods.items() if periods}
+            continue
+        metric = re.sub(r'\s+', '', cells[0])
+        if not re.search(r'[\u4e00-\u9fff]', metric):
+            continue
+        for index, cell in enumerate(cells[1:], 1):
+            cell = cell.replace(' ', '')
+            if VALUE_PATTERN.match(cell):
+                value = parse_value(cell)
+                if value is not None:
+                    facts.append((metric, column_periods.get(index, default_period), value, None))
+    return facts
+
+def extract_statement_facts(text: str, default_period: str) -> list:
+    """
+    Extract facts from sentences such as "營業利益為新台幣10,023,003千元".
+
+    The period of a fact is the last date mentioned before it in the same text.
+
+    Args:
+        text (str): Page text
+        default_period (str): Period used when no date precedes the statement
+
+    Returns:
+        list: (metric, period, value, unit) tuples
+    """
+    facts = []
+    periods = find_periods(text)
+    positions = [position for position, _ in periods]
+    for match in STATEMENT_PATTERN.finditer(text):
+        metric, raw_value, unit = match.groups()
+        value = parse_value(raw_value)
+        if value is None:
+            continue
+        preceding = bisect.bisect_left(positions, match.start())
+        period = periods[preceding - 1][1] if preceding else default_period
+        facts.append((metric.strip('（）()、-－'), period, value, unit))
+    return facts
+
+def extract_company(text: str) -> str:
+    """
+    Find the reporting company from the "XX股份有限公司及子公司" page headers.
+
+    Other companies mentioned in the text (subsidiaries, banks, counterparties)
+    are ignored, so pages without a header have no company.
+
+    Args:
+        text (str): Document text
+
+    Returns:
+        str: Company name without the 股份有限公司 suffix, or None
+    """
+    companies = Counter(COMPANY_PATTERN.findall(text))
+    return companies.most_common(1)[0][0] if companies else None
+
+def build_fact_index(corpus_dict: dict, cached_index: dict = None) -> dict:
+    """
+    Build the structured facts index of the finance corpus.
+
+    Documents whose content hash matches cached_index keep their cached entry and
+    facts, so an update only extracts facts from new and modified documents.
+
+    Args:
+        corpus_dict (dict): Document ID -> document from updated_finance_output
+        cached_index (dict): Previously built index, as loaded from its JSON file (optional)
+
+    Returns:
+        dict: {'documents': {doc_id: {'company', 'period', 'hash'}},
+               'facts': [{'doc_id', 'company', 'period', 'metric', 'value', 'unit', 'page', 'source'}]}
+    """
+    cached_documents = {}
+    cached_facts = {}
+    if cached_index:
+        cached_documents = {int(doc_id): info for doc_id, info in cached_index['documents'].items()}
+        for fact in cached_index['facts']:
+            cached_facts.setdefault(int(fact['doc_id']), []).append(fact)
+
+    documents = {}
+    facts = []
+    for doc_id in sorted(corpus_dict):
+        doc = corpus_dict[doc_id]
+        doc_hash = content_hash(doc)
+        if doc_id in cached_documents and cached_documents[doc_id]['hash'] == doc_hash:
+            documents[doc_id] = cached_documents[doc_id]
+            facts.extend(cached_facts.get(doc_id, []))
+            continue
+        pages = document_pages(doc)
+        full_text = '\n'.join(text for _, text in pages)
+        company = extract_company(full_text)
+        period = report_period(full_text)
+        documents[doc_id] = {'company': company, 'period': period, 'hash': doc_hash}
+
+        seen = set()
+        for page, text in pages:
+            for source, extracted in (('table', extract_table_facts(text, period)),
+                                      ('text', extract_statement_facts(text, period))):
+                for metric, fact_period, value, unit in extracted:
+                    key = (metric, fact_period, value)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    facts.append({
+                        'doc_id': doc_id,
+                        'company': company,
+                        'period': fact_period,
+                        'metric': metric,
+                        'value': value,
+                        'unit': unit,
+                        'page': page,
+                        'source': source
+                    })
+    return {'documents': documents, 'facts': facts}
+
+def load_fact_index(index_path: str) -> dict:
+    """
+    Load a facts index and build its in-memory lookups.
+
+    Args:
+        index_path (str): JSON file written by this script
+
+    Returns:
+        dict: Index with the extra lookup 'period_metrics' ((doc ID, period) -> metrics)
+    """
+    with open(index_path, 'r', encoding='utf-8') as f:
+        fact_index = json.load(f)
+    fact_index['documents'] = {int(doc_id): info for doc_id, info in fact_index['documents'].items()}
+
+    period_metrics = {}
+    for fact in fact_index['facts']:
+        if fact['period']:
+            period_metrics.setdefault((fact['doc_id'], fact['period']), set()).add(fact['metric'])
+    fact_index['period_metrics'] = period_metrics
+    print(f"Loaded {len(fact_index['facts'])} facts for {len(fact_index['documents'])} finance documents")
+    return fact_index
+
+def match_company(query: str, companies) -> str:
+    """
+    Find the company a query refers to, allowing abbreviations such as 聯電 for 聯華電子.
+
+    A company matches if a run of query characters starting with its first
+    character is a subsequence of its name; the longest run wins.
+
+    Args:
+        query (str): User's question
+        companies: Known company names
+
+    Returns:
+        str: Best matching company, or None if no run of at least 2 characters matches
+    """
+    best_company, best_length = None, 1
+    for company in companies:
+        for start, char in enumerate(query):
+            if char != company[0]:
+                continue
+            length, position = 0, 0
+            for query_char in query[start:]:
+                position = company.find(query_char, position)
+                if position < 0:
+                    break
+                length += 1
+                position += 1
+            if length > best_length or (length == best_length and best_company and len(company) < len(best_company)):
+                best_company, best_length = company, length
+    return best_company
+
+def parse_query_period(query: str) -> str:
+    """
+    Find the reporting period a query asks about.
+
+    Args:
+        query (str): User's question, e.g. "聯電在2023年第1季的營業利益是多少？"
+
+    Returns:
+        str: ISO date of the period end, or None
+    """
+    match = QUERY_QUARTER_PATTERN.search(query)
+    if match:
+        return quarter_end(*match.groups())
+    periods = find_periods(query)
+    return periods[0][1] if periods else None
+
+def narrow_candidates(query: str, source_ids: list, fact_index: dict) -> tuple:
+    """
+    Narrow or resolve the finance candidates of a question with the facts index.
+
+    Candidates whose header company differs from the company named in the
+    query are removed; candidates without a known company are kept. If the
+    company was identified and exactly one remaining candidate holds a fact
+    whose metric is named in the query for the queried period, the question
+    is resolved to that document.
+
+    Args:
+        query (str): User's question
+        source_ids (list): Candidate document IDs
+        fact_index (dict): Index returned by load_fact_index
+
+    Returns:
+        tuple: (remaining candidate IDs, resolved document ID or None)
+    """
+    documents = fact_index['documents']
+    companies = {documents[int(file_id)]['company'] for file_id in source_ids if int(file_id) in documents} - {None}
+    company = match_company(query, companies)
+    if not company:
+        return source_ids, None
+
+    candidates = [
+        file_id for file_id in source_ids
+        if int(file_id) not in documents or documents[int(file_id)]['company'] in (None, company)
+    ]
+
+    period = parse_query_period(query)
+    if not period:
+        return candidates, None
+    matching = [
+        file_id for file_id in candidates
+        if any(metric in query and len(metric) >= 4 for metric in fact_index['period_metrics'].get((int(file_id), period), ()))
+    ]
+    return candidates, matching[0] if len(matching) == 1 else None
+
+if __name__ == "__main__":
+    """
+    Main entry point for building the finance facts index.
+
+    Extracts (company, period, metric, value, page) facts from the table rows of
+    the raw PDF text and from statements in the vision text of every document in
+    updated_finance_output, and saves them as one JSON index. If the index already
+    exists, only documents whose content changed are extracted again.
+
+    Usage:
+        python finance_facts.py --source_path ./reference --output_path ./reference/facts/finance_facts.json [--rebuild]
+    """
+    parser = argparse.ArgumentParser(description='Build the structured facts index of the finance corpus.')
+    parser.add_argument('--source_path',
+                       type=str,
+                       default="./reference",
+                       help='Reference directory (default: %(default)s)')
+    parser.add_argument('--output_path',
+                       type=str,
+                       default="./reference/facts/finance_facts.json",
+                       help='Path where the facts index is saved (default: %(default)s)')
+    parser.add_argument('--rebuild',
+                       action='store_true',
+                       help='Extract the facts of every document again instead of only the changed ones')
+
+    args = parser.parse_args()
+
+    print(f"Reading finance documents from: {args.source_path}")
+    corpus_dict = load_corpus(args.source_path, 'finance')
+    cached_index = None
+    if os.path.isfile(args.output_path) and not args.rebuild:
+        with open(args.output_path, 'r', encoding='utf-8') as f:
+            cached_index = json.load(f)
+    fact_index = build_fact_index(corpus_dict, cached_index)
+    if cached_index:
+        reused = sum(1 for doc_id, info in fact_index['documents'].items()
+                     if cached_index['documents'].get(str(doc_id), {}).get('hash') == info['hash'])
+        print(f"Reused the facts of {reused} unchanged documents")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    with open(args.output_path, 'w', encoding='utf-8') as f:
+        json.dump(fact_index, f, ensure_ascii=False, indent=1)
+
+    with_company = sum(1 for info in fact_index['documents'].values() if info['company'])
+    with_period = sum(1 for info in fact_index['documents'].values() if info['period'])
+    print(f"Documents: {len(fact_index['documents'])} ({with_company} with company, {with_period} with period)")
+    print(f"Facts: {len(fact_index['facts'])}")
+    print(f"Saved facts index to: {args.output_path}")
@@ -6,7 +6,22 @@ from openai import OpenAI
 from dotenv import load_dotenv
 from pathlib import Path
 import concurrent.futures
+import threading
 import logging
+import time
+import sys
+from sharding import parse_shard, select_shard
+from doc_cards import format_card, load_cards
+from finance_facts import load_fact_index, narrow_candidates
+from faq_matcher import FAQMatcher
+from dense_index import DenseIndex
+from policy_articles import load_article_index, article_context
+from scheduler import QuestionScheduler, parse_lane_values
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+from adaptive_limit import AdaptiveLimiter, estimate_tokens
+from batch_api import BatchSession, BatchPending, completion_content, request_id
+from cassette import Cassette
 
 # Set the path to the .env file
 env_path = Path(__file__).resolve().parent.parent / '.env'
@@ -14,12 +29,70 @@ env_path = Path(__file__).resolve().parent.parent / '.env'
 # Load the .env file
 load_dotenv(dotenv_path=env_path)
 
-client = OpenAI()
+# Created on first use so that offline tools can import this module without an API key
+client = None
+
+def get_client() -> OpenAI:
+    """
+    Return the shared OpenAI client, creating it on first use.
+    
+    Returns:
+        OpenAI: Client configured from the environment
+    """
+    global client
+    if client is None:
+        # With adaptive concurrency the limiter retries, so it must see every 429 itself
+        client = OpenAI(max_retries=0) if rate_limiter else OpenAI()
+    return client
 
 # Configure logging for errors
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR, 
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Reference corpora, loaded by load_resources
+corpus_dict_finance = None
+corpus_dict_insurance = None
+key_to_source_dict = None
+
+# Chat model answering the retrieval prompts, set with --model
+model_name = "gpt-4o"
+
+# LLM requests and token usage of this run, written with --stats_path
+usage_lock = threading.Lock()
+usage_totals = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+# Batch results are returned again in every round; each request is counted once
+counted_requests = set()
+
+# Summary cards for two-stage retrieval, loaded when --cards_path is given
+cards_dict = None
+num_finalists = 3
+
+# Structured finance facts, loaded when --facts_path is given
+fact_index = None
+
+# Insurance article index, loaded when --articles_path is given
+article_index = None
+article_units = 3
+
+# Local FAQ matcher, built when --faq_match is given
+faq_matcher = None
+
+# Dense vector index, opened when --dense_path is given
+dense_index = None
+dense_top_k = 0
+
+# Adaptive concurrency limiter, created when --adaptive is given
+rate_limiter = None
+
+# Batch API session, created when --batch_dir is given
+batch_session = None
+
+# Request/response cassette, opened when --record or --replay is given
+cassette = None
+
+# Rendered document texts, id(doc) -> (doc, text); a dict enables caching (retrieve_server.py does)
+rendered_documents = None
+
 # Load reference data from JSON files, returning a dictionary with file names as keys and content as values
 def load_data_json(source_path: str) -> dict:
     """
@@ -52,34 +125,84 @@ def load_data_json(source_path: str) -> dict:
     print(f"Successfully loaded {len(corpus_dict)} JSON files")
     return corpus_dict
 
-def LLM_API(query: str, source_ids: list, corpus_dict: dict, category: str) -> str:
+def record_usage(usage: dict, key: str = None):
     """
-    Process a query using the LLM API to identify the most relevant document.
+    Count one answered LLM request and its token usage in usage_totals.
+
+    Args:
+        usage (dict): 'usage' of the chat completion, or None if the response has none
+        key (str): Request ID; a request already counted under this key is not counted again
+    """
+    with usage_lock:
+        if key is not None:
+            if key in counted_requests:
+                return
+            counted_requests.add(key)
+        usage_totals['requests'] += 1
+        if usage:
+            usage_totals['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            usage_totals['completion_tokens'] += usage.get('completion_tokens') or 0
+
+def chat_json(prompt: str, max_tokens: int) -> str:
+    """
+    Send a single-message prompt to the LLM and return its JSON answer.
     
     Args:
-        query (str): User's question or query
-        source_ids (list): List of document IDs to search through
-        corpus_dict (dict): Dictionary containing document contents
-        category (str): Type of documents ('faq', 'finance', or 'insurance')
+        prompt (str): User prompt
+        max_tokens (int): Maximum number of tokens in the answer
         
     Returns:
-        str: JSON string containing the most relevant document ID
+        str: JSON string returned by the model
+    """
+    body = {
+        "model": model_name,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0,
+        "response_format": {"type": "json_object"}
+    }
+
+    # In batch mode the request is queued and BatchPending is raised until the batch has answered it
+    if batch_session:
+        completion = batch_session.request(body)
+        record_usage(completion.get('usage'), request_id(body))
+        content = completion_content(completion)
+        print(f"Response: {content}")
+        return content
+
+    def request():
+        # With a cassette, responses are recorded, or replayed without calling the API
+        if cassette:
+            return cassette.call(body, lambda: get_client().chat.completions.create(**body))
+        return get_client().chat.completions.create(**body)
+
+    if rate_limiter:
+        response = rate_limiter.call(request, estimate_tokens(prompt) + max_tokens)
+    else:
+        response = request()
+    record_usage(response.usage.model_dump() if response.usage else None)
+
+    print(f"Response: {response.choices[0].message.content}")
+    return response.choices[0].message.content
+
+def build_context(source_ids: list, corpus_dict: dict) -> str:
+    """
+    Build the reference context passed to the LLM from the candidate documents.
+    
+    Args:
+        source_ids (list): List of document IDs to include
+        corpus_dict (dict): Dictionary containing document contents
         
-    Example:
-        Input:
-            query: "How do I file a claim?"
-            source_ids: [1, 2, 3]
-            category: "insurance"
-        Output:
-            '{"retrieve": 2}'
+    Returns:
+        str: Context string with one "文件 {id}" section per document found
     """
-    print(f"\nProcessing query: {query}...")
-    print(f"Source IDs to check: {source_ids}")
     documents = []
     for file_id in source_ids:
         doc = corpus_dict.get(int(file_id))
         if doc:
-            documents.append((file_id, str(doc)))
+            documents.append((file_id, render_document(doc)))
         else:
             print(f"Warning: Document ID {file_id} not found in corpus.")
 
@@ -87,10 +210,65 @@ def LLM_API(query: str, source_ids: list, corpus_dict: dict, category: str) -> s
     context = ''
     for file_id, doc in documents:
         context += f"文件 {file_id}:\n{doc}\n\n"
+    return context
 
-    print(f"Built context with {len(context)} characters")
+def render_document(doc) -> str:
+    """
+    Render a document as it appears in the context, from the render cache when enabled.
 
-    prompt = f"""你是一個有幫助的助理。根據以下參考資料，回答用戶的問題。
+    Args:
+        doc: Document content (page dict of a finance or insurance document, or FAQ text)
+
+    Returns:
+        str: str(doc)
+    """
+    if rendered_documents is None or isinstance(doc, str):
+        return str(doc)
+    # The document is kept with its text so that a reused id() cannot return another document's text
+    entry = rendered_documents.get(id(doc))
+    if entry is None or entry[0] is not doc:
+        entry = (doc, str(doc))
+        rendered_documents[id(doc)] = entry
+    return entry[1]
+
+def build_article_context(query: str, source_ids: list, corpus_dict: dict) -> str:
+    """
+    Build the context of insurance candidates from the articles relevant to the query.
+
+    Documents without articles in the index are included in full, as in build_context.
+
+    Args:
+        query (str): User's question
+        source_ids (list): List of document IDs to include
+        corpus_dict (dict): Dictionary containing document contents
+
+    Returns:
+        str: Context string with one "文件 {id}" section per document found
+    """
+    context = ''
+    for file_id in source_ids:
+        doc = corpus_dict.get(int(file_id))
+        if not doc:
+            print(f"Warning: Document ID {file_id} not found in corpus.")
+            continue
+        text = article_context(query, file_id, article_index, article_units)
+        if text is None:
+            text = render_document(doc)
+        context += f"文件 {file_id}:\n{text}\n\n"
+    return context
+
+def build_prompt(query: str, context: str) -> str:
+    """
+    Build the retrieval prompt asking for the most relevant document of the context.
+
+    Args:
+        query (str): User's question
+        context (str): Candidate documents as built by build_context
+
+    Returns:
+        str: Prompt text
+    """
+    return f"""你是一個有幫助的助理。根據以下參考資料，回答用戶的問題。
 請根據參考資料找到最相關的文件編號。只需輸出文件編號，不要輸出其他內容。
 參考資料間可能會有類似的資訊，你需要分析他們的差異，並選擇最相關的文件編號。
 
@@ -106,24 +284,124 @@ def LLM_API(query: str, source_ids: list, corpus_dict: dict, category: str) -> s
     "retrieve": 文件編號: int
 }}"""
 
+def LLM_API(query: str, source_ids: list, corpus_dict: dict, category: str) -> str:
+    """
+    Process a query using the LLM API to identify the most relevant document.
+    
+    Args:
+        query (str): User's question or query
+        source_ids (list): List of document IDs to search through
+        corpus_dict (dict): Dictionary containing document contents
+        category (str): Type of documents ('faq', 'finance', or 'insurance')
+        
+    Returns:
+        str: JSON string containing the most relevant document ID
+        
+    Example:
+        Input:
+            query: "How do I file a claim?"
+            source_ids: [1, 2, 3]
+            category: "insurance"
+        Output:
+            '{"retrieve": 2}'
+    """
+    print(f"\nProcessing query: {query}...")
+    print(f"Source IDs to check: {source_ids}")
+    # Insurance documents contribute only their relevant articles when the article index is loaded
+    if article_index and category == 'insurance':
+        context = build_article_context(query, source_ids, corpus_dict)
+    else:
+        context = build_context(source_ids, corpus_dict)
+
+    print(f"Built context with {len(context)} characters")
+
+    prompt = build_prompt(query, context)
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=100,
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-
-        print(f"Response: {response.choices[0].message.content}")
-        return response.choices[0].message.content
+        return chat_json(prompt, max_tokens=100)
+    except BatchPending:
+        raise
     except Exception as e:
         print(f"Error during API call: {e}")
         return None
 
-def process_question(q_dict: dict) -> dict:
+def select_finalists(query: str, source_ids: list, cards: dict, num_finalists: int) -> list:
+    """
+    First retrieval stage: pick the most promising documents from their summary cards.
+    
+    Args:
+        query (str): User's question or query
+        source_ids (list): List of candidate document IDs
+        cards (dict): Document ID -> card built by doc_cards.py
+        num_finalists (int): Number of documents to keep for the full-text stage
+        
+    Returns:
+        list: Finalist document IDs in their original order. Documents without a
+              card are always kept, and all candidates are kept if the selection fails.
+    """
+    if len(source_ids) <= num_finalists:
+        return source_ids
+
+    uncarded_ids = [file_id for file_id in source_ids if int(file_id) not in cards]
+    card_context = ''
+    for file_id in source_ids:
+        if int(file_id) in cards:
+            card_context += f"文件 {file_id}: {format_card(cards[int(file_id)])}\n"
+
+    prompt = f"""你是一個有幫助的助理。以下是候選文件的摘要卡，每張摘要卡描述一份文件的公司、期間、商品、主題與標題。
+請根據摘要卡選出最可能包含問題答案的 {num_finalists} 個文件編號，依相關程度排序。
+
+摘要卡：
+{card_context}
+問題：
+{query}
+
+
+回答格式，用JSON格式：
+{{
+    "candidates": [文件編號: int]
+}}"""
+
+    try:
+        selected = json.loads(chat_json(prompt, max_tokens=100)).get('candidates', [])
+        selected = {int(file_id) for file_id in selected[:num_finalists]}
+    except BatchPending:
+        raise
+    except Exception as e:
+        print(f"Error selecting finalists, keeping all candidates: {e}")
+        return source_ids
+
+    finalists = [file_id for file_id in source_ids if int(file_id) in selected or file_id in uncarded_ids]
+    print(f"Selected finalists from cards: {finalists}")
+    return finalists or source_ids
+
+def get_corpus_dict(category: str, source_ids: list) -> dict:
+    """
+    Select the corpus to search for a question category.
+    
+    Args:
+        category (str): Type of documents ('faq', 'finance', or 'insurance')
+        source_ids (list): List of candidate document IDs, used to filter the FAQ map
+        
+    Returns:
+        dict: Dictionary with document IDs as keys and document content as values
+        
+    Raises:
+        ValueError: If the category is unknown
+    """
+    # Access the shared data
+    global corpus_dict_finance, corpus_dict_insurance, key_to_source_dict
+
+    if category == 'finance':
+        return corpus_dict_finance
+    elif category == 'insurance':
+        return corpus_dict_insurance
+    elif category == 'faq':
+        return {key: str(value) for key, value in key_to_source_dict.items() if key in source_ids}
+    else:
+        raise ValueError(f"Unknown category: {category}")
+
+def process_question(q_dict: dict, query_vector=None) -> dict:
     """
     Process a single question using the appropriate corpus and LLM.
     
@@ -135,6 +413,8 @@ def process_question(q_dict: dict) -> dict:
                 'query': str,     # The actual question
                 'source': list    # List of source document IDs to search
             }
+        query_vector: Dense encoding of the query computed in advance, e.g. for a
+            batch of questions at once (default: encoded by the dense index)
             
     Returns:
         dict: Dictionary containing question ID and retrieved document ID:
@@ -144,6 +424,9 @@ def process_question(q_dict: dict) -> dict:
             }
         or None if processing fails
         
+    Raises:
+        BatchPending: In batch mode, if an LLM request was queued for the next batch
+        
     Example:
         Input:
             {
@@ -163,18 +446,32 @@ def process_question(q_dict: dict) -> dict:
     query = q_dict['query']
     source_ids = q_dict['source']
 
-    # Access the shared data
-    global corpus_dict_finance, corpus_dict_insurance, key_to_source_dict
-
     try:
-        if category == 'finance':
-            corpus_dict = corpus_dict_finance
-        elif category == 'insurance':
-            corpus_dict = corpus_dict_insurance
-        elif category == 'faq':
-            corpus_dict = {key: str(value) for key, value in key_to_source_dict.items() if key in source_ids}
-        else:
-            raise ValueError(f"Unknown category: {category}")
+        # Finance questions are narrowed with the facts index and answered locally when unambiguous
+        if fact_index and category == 'finance':
+            source_ids, resolved = narrow_candidates(query, source_ids, fact_index)
+            if resolved is not None:
+                print(f"Resolved question ID {qid} from the facts index: {resolved}")
+                return {"qid": qid, "retrieve": int(resolved)}
+
+        # FAQ questions with a confident match are answered locally
+        if faq_matcher and category == 'faq':
+            matched = faq_matcher.match(query, source_ids)
+            if matched is not None:
+                print(f"Matched question ID {qid} locally: {matched}")
+                return {"qid": qid, "retrieve": matched}
+
+        # Dense ranking puts the most similar documents first and optionally keeps only the top k
+        if dense_index:
+            source_ids = dense_index.rank(query, category, source_ids, query_vector)
+            if dense_top_k:
+                source_ids = source_ids[:dense_top_k]
+
+        # Two-stage retrieval: narrow the candidates with the summary cards first
+        if cards_dict and category in cards_dict:
+            source_ids = select_finalists(query, source_ids, cards_dict[category], num_finalists)
+
+        corpus_dict = get_corpus_dict(category, source_ids)
 
         retrieved = LLM_API(query, source_ids, corpus_dict, category)
 
@@ -187,10 +484,178 @@ def process_question(q_dict: dict) -> dict:
                 print(f"Error parsing retrieved JSON for question ID {qid}: {e}")
         else:
             print(f"Failed to retrieve answer for question ID {qid}")
+    except BatchPending:
+        raise
     except Exception as e:
         print(f"Exception processing question ID {qid}: {e}")
     return None
 
+def run_batch_questions(questions: list) -> tuple:
+    """
+    Answer questions through the Batch API in rounds.
+
+    Each round runs every unanswered question until it is answered or reaches an
+    LLM request without a result; those requests are collected into one batch.
+    Requests are identified by a hash of their body, so a later round replays
+    the answered ones and continues with the next stage (e.g. the full-text
+    stage after card selection), and a rerun with the same batch directory
+    reuses every result that was already paid for.
+
+    Args:
+        questions (list): Question dicts as in process_question
+
+    Returns:
+        tuple: (answers, failed question IDs)
+    """
+    answers = {}
+    failed = []
+    remaining = list(questions)
+    round_index = 0
+    while remaining:
+        round_index += 1
+        waiting = []
+        for q_dict in remaining:
+            try:
+                result = process_question(q_dict)
+            except BatchPending:
+                waiting.append(q_dict)
+                continue
+            if result and result['qid'] == q_dict['qid']:
+                answers[q_dict['qid']] = result
+            else:
+                failed.append(q_dict['qid'])
+        print(f"Batch round {round_index}: {len(answers)} answered, {len(failed)} failed, "
+              f"{len(waiting)} waiting for {batch_session.pending} requests")
+        if waiting:
+            batch_session.flush()
+        remaining = waiting
+    return [answers[qid] for qid in sorted(answers)], failed
+
+def add_retrieval_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the options selecting the reference data, indexes and LLM transport of a retrieval run.
+
+    Shared by my_retrieve.py and retrieve_server.py; see load_resources.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+    """
+    parser.add_argument('--source_path', 
+                       type=str, 
+                       default="./reference",
+                       required=True, 
+                       help='讀取參考資料路徑 (default: %(default)s)')
+    parser.add_argument('--model',
+                       type=str,
+                       default="gpt-4o",
+                       help='Chat model answering the retrieval and card prompts (default: %(default)s)')
+    parser.add_argument('--cards_path',
+                       type=str,
+                       default=None,
+                       help='Directory of document cards for two-stage retrieval (default: single stage)')
+    parser.add_argument('--finalists',
+                       type=int,
+                       default=3,
+                       help='Number of documents sent in full after card selection (default: %(default)s)')
+    parser.add_argument('--facts_path',
+                       type=str,
+                       default=None,
+                       help='Finance facts index for narrowing and local answers (default: disabled)')
+    parser.add_argument('--articles_path',
+                       type=str,
+                       default=None,
+                       help='Insurance article index; prompts then contain only the relevant articles (default: full documents)')
+    parser.add_argument('--article_units',
+                       type=int,
+                       default=3,
+                       help='Articles or clauses kept per insurance document, besides the ones the question names (default: %(default)s)')
+    parser.add_argument('--faq_match',
+                       action='store_true',
+                       help='Answer confidently matched FAQ questions without the LLM')
+    parser.add_argument('--dense_path',
+                       type=str,
+                       default=None,
+                       help='Dense vector index for ranking candidates (default: disabled)')
+    parser.add_argument('--dense_top_k',
+                       type=int,
+                       default=0,
+                       help='Keep only the k most similar candidates, 0 keeps all (default: %(default)s)')
+    parser.add_argument('--adaptive',
+                       action='store_true',
+                       help='Adapt the number of concurrent API requests to rate limits, up to --max_tasks')
+    parser.add_argument('--tpm',
+                       type=int,
+                       default=None,
+                       help='Starting tokens-per-minute budget with --adaptive (default: no token limit)')
+    parser.add_argument('--record',
+                       type=str,
+                       default=None,
+                       help='Save every LLM request and response with its latency to this cassette file')
+    parser.add_argument('--replay',
+                       type=str,
+                       default=None,
+                       help='Answer LLM requests from this cassette file without network access')
+    parser.add_argument('--time_scale',
+                       type=float,
+                       default=1.0,
+                       help='Factor applied to the recorded latencies with --replay (default: %(default)s)')
+
+def load_resources(args: argparse.Namespace):
+    """
+    Load the corpora and open the indexes and cassette selected by add_retrieval_arguments.
+
+    Sets the module-level state used by process_question, so it is done once per
+    process: per run in my_retrieve.py, at startup in retrieve_server.py.
+
+    Args:
+        args (argparse.Namespace): Parsed options
+    """
+    global corpus_dict_finance, corpus_dict_insurance, key_to_source_dict
+    global model_name, cards_dict, num_finalists, fact_index, article_index, article_units
+    global faq_matcher, dense_index, dense_top_k, cassette
+
+    model_name = args.model
+
+    source_path_insurance = os.path.join(args.source_path, 'updated_insurance_output')
+    corpus_dict_insurance = load_data_json(source_path_insurance)
+
+    source_path_finance = os.path.join(args.source_path, 'updated_finance_output')
+    corpus_dict_finance = load_data_json(source_path_finance)
+
+    with open(os.path.join(args.source_path, 'faq', 'pid_map_content.json'), 'r', encoding='utf-8') as f_s:
+        key_to_source_dict = json.load(f_s)
+        # Ensure keys are integers
+        key_to_source_dict = {int(key): value for key, value in key_to_source_dict.items()}
+
+    if args.cards_path:
+        print(f"\nLoading document cards from: {args.cards_path}")
+        cards_dict = load_cards(args.cards_path)
+        num_finalists = args.finalists
+
+    if args.facts_path:
+        print(f"\nLoading finance facts index from: {args.facts_path}")
+        fact_index = load_fact_index(args.facts_path)
+        print(f"Loaded {len(fact_index['facts'])} facts for {len(fact_index['documents'])} documents")
+
+    if args.articles_path:
+        print(f"\nLoading insurance article index from: {args.articles_path}")
+        article_index = load_article_index(args.articles_path)
+        article_units = args.article_units
+
+    if args.faq_match:
+        faq_matcher = FAQMatcher(key_to_source_dict)
+        print(f"Indexed {len(faq_matcher.string_pids)} FAQ strings for local matching")
+
+    if args.dense_path:
+        print(f"\nOpening dense index from: {args.dense_path}")
+        dense_index = DenseIndex(args.dense_path)
+        dense_top_k = args.dense_top_k
+        print(f"Opened {dense_index.num_chunks} chunk vectors in {len(dense_index.segments)} segments, dimension {dense_index.dim}")
+
+    if args.record or args.replay:
+        cassette = Cassette(args.record or args.replay, 'record' if args.record else 'replay', args.time_scale)
+        print(f"Cassette: {cassette.mode} {cassette.path} ({len(cassette.records)} recorded requests)")
+
 if __name__ == "__main__":
     """
     Main entry point for the document retrieval system.
@@ -202,13 +667,61 @@ if __name__ == "__main__":
         python my_retrieve.py --question_path /path/to/questions.json 
                             --source_path /path/to/source/dir 
                             --output_path /path/to/output.json
-                            [--max_tasks 100]
+                            [--max_tasks 100] [--shard i/N]
+                            [--cards_path ./reference/cards --finalists 3]
+                            [--facts_path ./reference/facts/finance_facts.json]
+                            [--articles_path ./reference/articles/insurance_articles.json [--article_units 3]]
+                            [--faq_match]
+                            [--dense_path ./reference/dense --dense_top_k 0]
+                            [--adaptive [--tpm 30000]]
+                            [--batch_dir ./batch/retrieve [--poll_interval 30] [--batch_attempts 3]]
+                            [--record cassette.jsonl | --replay cassette.jsonl [--time_scale 1.0]]
+                            [--schedule edf [--lane_weights faq=2,finance=1] [--lane_deadlines faq=10]]
+                            [--model gpt-4o] [--stats_path stats.json]
     
     Args:
         question_path: Path to JSON file containing questions
         source_path: Path to directory containing reference documents
         output_path: Path where output JSON will be saved
         max_tasks: Maximum number of concurrent tasks (default: 100)
+        shard: Only process shard i of N (questions with qid % N == i) and write
+               a partial output to be combined with sharding.py
+        cards_path: Directory of summary cards built by doc_cards.py; enables
+                    two-stage retrieval (cards first, full text for the finalists)
+        finalists: Number of documents passed to the full-text stage (default: 3)
+        facts_path: Finance facts index built by finance_facts.py; narrows finance
+                    candidates and answers unambiguous questions without an LLM call
+        articles_path: Insurance article index built by policy_articles.py; insurance
+                       prompts contain only the articles and clauses relevant to the question
+        article_units: Articles or clauses kept per insurance document, besides the
+                       articles the question names (default: 3)
+        faq_match: Answer FAQ questions that clearly match one candidate's listed
+                   questions or answers locally; only ambiguous ones go to the LLM
+        dense_path: Dense vector index built by dense_index.py; candidates are
+                    ordered by embedding similarity before the LLM sees them
+        dense_top_k: Keep only the k most similar candidates (default: 0, keep all)
+        adaptive: Adapt the number of concurrent API requests to rate-limit feedback
+                  (AIMD); max_tasks becomes the upper bound, and 429s are retried
+                  after the server's retry-after time instead of failing the question
+        tpm: Starting tokens-per-minute budget of the adaptive limiter (default: no token limit)
+        batch_dir: Send the LLM requests through the Batch API instead of one by one,
+                   keeping input files, results and state in this directory
+        poll_interval: Seconds between two batch status checks (default: 30)
+        batch_attempts: Submissions of a failed request before its question fails (default: 3)
+        record: Save every LLM request and response with its latency to this cassette file
+        replay: Answer LLM requests from this cassette file instead of the API, keyed by
+                a hash of the request; requests that were not recorded fail
+        time_scale: Factor applied to the recorded latencies when replaying (default: 1.0,
+                    0 answers immediately)
+        schedule: 'fifo' submits questions in file order; 'edf' queues them in one lane
+                  per category, ordered by their optional 'priority' and 'deadline' fields,
+                  sends questions about to miss their deadline first and otherwise shares
+                  the workers between the lanes by --lane_weights (default: fifo)
+        lane_weights: Share of the workers per category for --schedule edf (default: 1 each)
+        lane_deadlines: Default deadline per category in seconds after the start (default: none)
+        model: Chat model answering the retrieval and card prompts (default: gpt-4o)
+        stats_path: Save the number of LLM requests, their token usage and the
+                    processing time of the run as JSON (e.g. for sweep.py)
     
     The script:
     1. Loads questions from the question file
@@ -233,11 +746,6 @@ if __name__ == "__main__":
                        default="./dataset/preliminary/questions_example.json",
                        required=True, 
                        help='讀取發布題目路徑 (default: %(default)s)')
-    parser.add_argument('--source_path', 
-                       type=str, 
-                       default="./reference",
-                       required=True, 
-                       help='讀取參考資料路徑 (default: %(default)s)')
     parser.add_argument('--output_path', 
                        type=str, 
                        default="./dataset/preliminary/example_pred_retrieve.json",
@@ -247,13 +755,56 @@ if __name__ == "__main__":
                        type=int, 
                        default=100, 
                        help='Maximum number of concurrent tasks (default: %(default)s)')
+    parser.add_argument('--shard',
+                       type=parse_shard,
+                       default=None,
+                       help='Only process shard i of N, e.g. 0/4, and write a partial output (default: all questions)')
+    parser.add_argument('--batch_dir',
+                       type=str,
+                       default=None,
+                       help='Use the Batch API with this working directory (default: interactive requests)')
+    parser.add_argument('--poll_interval',
+                       type=float,
+                       default=30,
+                       help='Seconds between two batch status checks (default: %(default)s)')
+    parser.add_argument('--batch_attempts',
+                       type=int,
+                       default=3,
+                       help='Submissions of a failed batch request before giving up (default: %(default)s)')
+    parser.add_argument('--stats_path',
+                       type=str,
+                       default=None,
+                       help='Save the run\'s LLM requests, token usage and wall time as JSON (default: not saved)')
+    parser.add_argument('--schedule',
+                       type=str,
+                       choices=['fifo', 'edf'],
+                       default='fifo',
+                       help='Order of submitting questions: file order, or priority, deadlines and fair '
+                            'per-category lanes (default: %(default)s)')
+    parser.add_argument('--lane_weights',
+                       type=parse_lane_values,
+                       default=None,
+                       help='Share of the workers per category with --schedule edf, e.g. faq=2,finance=1; '
+                            '0 only uses idle workers (default: 1 each)')
+    parser.add_argument('--lane_deadlines',
+                       type=parse_lane_values,
+                       default=None,
+                       help='Deadline in seconds after the start for questions of a category without their own, '
+                            'e.g. faq=10 (default: none)')
+    add_retrieval_arguments(parser)
 
     args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be combined")
+    if args.batch_dir and (args.record or args.replay):
+        parser.error("--record and --replay cannot be combined with --batch_dir")
     
     print(f"Question file: {args.question_path}")
     print(f"Source directory: {args.source_path}")
     print(f"Output file: {args.output_path}")
     print(f"Max concurrent tasks: {args.max_tasks}")
+    if args.shard:
+        print(f"Shard: {args.shard[0]}/{args.shard[1]}")
 
     answer_dict = {"answers": []}
 
@@ -263,67 +814,109 @@ if __name__ == "__main__":
         qs_ref = json.load(f)
     print(f"Loaded {len(qs_ref['questions'])} questions")
 
-    # Load reference data
-    source_path_insurance = os.path.join(args.source_path, 'updated_insurance_output')
-    corpus_dict_insurance = load_data_json(source_path_insurance)
-
-    source_path_finance = os.path.join(args.source_path, 'updated_finance_output')
-    corpus_dict_finance = load_data_json(source_path_finance)
+    # Load reference data and indexes
+    load_resources(args)
 
-    with open(os.path.join(args.source_path, 'faq', 'pid_map_content.json'), 'r', encoding='utf-8') as f_s:
-        key_to_source_dict = json.load(f_s)
-        # Ensure keys are integers
-        key_to_source_dict = {int(key): value for key, value in key_to_source_dict.items()}
+    if args.adaptive and not args.batch_dir:
+        rate_limiter = AdaptiveLimiter(initial_limit=min(10, args.max_tasks), max_limit=args.max_tasks,
+                                       tokens_per_minute=args.tpm)
+        print(f"Adaptive concurrency: {rate_limiter.status()}")
 
     print("\nProcessing questions...")
+    processing_start = time.perf_counter()
 
     # Create list to store all tasks
     all_tasks = qs_ref['questions']
-    max_concurrent_tasks = args.max_tasks
-    error_count = 0
-    total_tasks = len(all_tasks)
-    task_index = 0  # Index to keep track of the next task to submit
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_tasks) as executor:
-        futures = {}  # Dictionary to map futures to q_dict
-
-        while task_index < total_tasks or futures:
-            # Submit new tasks if we have less than max_concurrent_tasks running and there are tasks left
-            while len(futures) < max_concurrent_tasks and task_index < total_tasks:
-                q_dict = all_tasks[task_index]
-                future = executor.submit(process_question, q_dict)
-                futures[future] = q_dict  # Store the entire q_dict
-                task_index += 1
-                print(f"Submitted task {task_index}/{total_tasks}: Question ID {q_dict['qid']}")
-
-            # Wait for any future to complete
-            done, _ = concurrent.futures.wait(futures.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
-
-            # Remove completed futures and update error count
-            for future in done:
-                q_dict = futures.pop(future)
-                result = future.result()
-                if result:
-                    if result['qid'] != q_dict['qid']:
-                        print(f"QID mismatch for question ID {q_dict['qid']}")
-                        error_count += 1
+    if args.shard:
+        all_tasks = select_shard(all_tasks, *args.shard)
+        print(f"Selected {len(all_tasks)} questions for shard {args.shard[0]}/{args.shard[1]}")
+    if args.batch_dir:
+        batch_session = BatchSession(get_client(), args.batch_dir, args.poll_interval, args.batch_attempts)
+        answers, failed_qids = run_batch_questions(all_tasks)
+        answer_dict['answers'].extend(answers)
+        error_count = len(failed_qids)
+        for qid in failed_qids:
+            print(f"Failed to process question ID {qid}")
+    else:
+        max_concurrent_tasks = args.max_tasks
+        error_count = 0
+        total_tasks = len(all_tasks)
+        task_index = 0  # Number of tasks submitted so far
+        scheduler = QuestionScheduler(all_tasks, args.schedule, args.lane_weights, args.lane_deadlines)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_tasks) as executor:
+            futures = {}  # Dictionary to map futures to q_dict
+
+            while len(scheduler) or futures:
+                # Submit new tasks if we have less than max_concurrent_tasks running and there are tasks left
+                while len(futures) < max_concurrent_tasks and len(scheduler):
+                    q_dict = scheduler.next()
+                    future = executor.submit(process_question, q_dict)
+                    futures[future] = q_dict  # Store the entire q_dict
+                    task_index += 1
+                    print(f"Submitted task {task_index}/{total_tasks}: Question ID {q_dict['qid']}")
+
+                # Wait for any future to complete
+                done, _ = concurrent.futures.wait(futures.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
+
+                # Remove completed futures and update error count
+                for future in done:
+                    q_dict = futures.pop(future)
+                    scheduler.done(q_dict)
+                    result = future.result()
+                    if result:
+                        if result['qid'] != q_dict['qid']:
+                            print(f"QID mismatch for question ID {q_dict['qid']}")
+                            error_count += 1
+                        else:
+                            answer_dict['answers'].append(result)
+                            print(f"Completed task: Question ID {result['qid']}"
+                                  + (f" [{rate_limiter.status()}]" if rate_limiter else ""))
                     else:
-                        answer_dict['answers'].append(result)
-                        print(f"Completed task: Question ID {result['qid']}")
-                else:
-                    print(f"Failed to process question ID {q_dict['qid']}")
-                    error_count += 1
+                        print(f"Failed to process question ID {q_dict['qid']}")
+                        error_count += 1
 
-        # Ensure all futures are done
-        concurrent.futures.wait(futures.keys())
+            # Ensure all futures are done
+            concurrent.futures.wait(futures.keys())
+
+    processing_time = time.perf_counter() - processing_start
 
     # Sort answers by qid before saving
     answer_dict['answers'].sort(key=lambda x: x['qid'])
 
+    # Partial outputs record which shard they cover so that they can be merged safely
+    if args.shard:
+        answer_dict = {
+            "shard": {"index": args.shard[0], "count": args.shard[1]},
+            "qids": sorted(q_dict['qid'] for q_dict in all_tasks),
+            "answers": answer_dict['answers']
+        }
+
     # Save the answers to a JSON file
     print(f"\nSaving results to: {args.output_path}")
     with open(args.output_path, 'w', encoding='utf8') as f:
         json.dump(answer_dict, f, ensure_ascii=False, indent=4)
     print(f"Successfully processed {len(answer_dict['answers'])} answers")
     print(f"Total number of errors: {error_count}")
+    if rate_limiter:
+        print(f"API requests: {rate_limiter.requests}, rate-limited: {rate_limiter.rate_limited}, "
+              f"retries: {rate_limiter.retries}, final {rate_limiter.status()}")
+    if cassette:
+        print(cassette.summary())
+    if not args.batch_dir:
+        for category, lane_stats in scheduler.summary().items():
+            print(f"{category}: {lane_stats['questions']} questions finished after p50 {lane_stats['p50_s']}s, "
+                  f"p90 {lane_stats['p90_s']}s, max {lane_stats['max_s']}s, "
+                  f"{lane_stats['missed_deadlines']} missed deadlines")
+    print(f"LLM requests: {usage_totals['requests']}, prompt tokens: {usage_totals['prompt_tokens']}, "
+          f"completion tokens: {usage_totals['completion_tokens']}, processing time: {processing_time:.1f}s")
+    if args.stats_path:
+        run_stats = dict(usage_totals, total_tokens=usage_totals['prompt_tokens'] + usage_totals['completion_tokens'],
+                         model=model_name, questions=len(all_tasks), answers=len(answer_dict['answers']),
+                         errors=error_count, processing_time=round(processing_time, 3))
+        if not args.batch_dir:
+            run_stats['lanes'] = scheduler.summary()
+        with open(args.stats_path, 'w', encoding='utf-8') as f:
+            json.dump(run_stats, f, ensure_ascii=False, indent=2)
+        print(f"Saved run statistics to: {args.stats_path}")
     print("\n=== Processing Complete ===")
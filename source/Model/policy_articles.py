@@ -0,0 +1,412 @@
+import os
+import re
+import json
+import math
+import argparse
+from collections import Counter
+from doc_cards import content_hash, load_corpus
+from faq_matcher import normalize
+
+ARTICLE_NUMBER = r'[\d一二三四五六七八九十百零〇○]+'
+# An article starts a line with 第X條 (numerals possibly spaced out, "第 二 十 九 條") followed by
+# 【heading】 or by whitespace and a heading or its text; "第X條" in running text, including lines
+# wrapped just before it ("第十八條約定給付..."), is a reference
+ARTICLE_PATTERN = re.compile(
+    rf'^[ \t]*第[ \t]*({ARTICLE_NUMBER}(?:[ \t]+{ARTICLE_NUMBER})*)[ \t]*條(?=[ \t]*【|[ \t]+\S)', re.M)
+HEADING_PATTERN = re.compile(r'[ \t]*(?:【([^】\n]*)】|([^\n]*))')
+# Some policies put the heading on its own line above the article: "【時效】\n第 三 十 條 由本契約..."
+PRECEDING_HEADING_PATTERN = re.compile(r'(?:^|\n)[ \t]*【([^】\n]*)】[ \t]*\n[ \t]*$')
+# A heading on the header line is short and is not a sentence
+SENTENCE_PATTERN = re.compile(r'[。，；：︰:,;]')
+MAX_HEADING_CHARS = 30
+# Enumerated clauses (款) of an article: "一、..." at the start of a line
+CLAUSE_PATTERN = re.compile(r'^[ \t]*([一二三四五六七八九十]+)、', re.M)
+QUERY_ARTICLE_PATTERN = re.compile(rf'第\s*({ARTICLE_NUMBER})\s*條')
+
+# Articles longer than this are split into their clauses, e.g. the definitions of 名詞定義
+CLAUSE_SPLIT_CHARS = 600
+
+# Units selected per document, not counting units of articles the query names
+MAX_UNITS = 3
+
+# BM25 parameters over character bigrams; heading bigrams count HEADING_WEIGHT times more
+BM25_K1 = 1.2
+BM25_B = 0.75
+HEADING_WEIGHT = 2.0
+
+NUMERAL_DIGITS = {'零': 0, '〇': 0, '○': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5,
+                  '六': 6, '七': 7, '八': 8, '九': 9}
+
+def article_number(value: str) -> int:
+    """
+    Convert an article number to an integer.
+
+    Args:
+        value (str): Arabic or Chinese numerals, e.g. "32", "三十二", "一百零二"
+
+    Returns:
+        int: Article number
+
+    Example:
+        article_number("十") -> 10, article_number("二十四") -> 24, article_number("一百零二") -> 102
+    """
+    value = re.sub(r'\s', '', value)
+    if value.isdigit():
+        return int(value)
+    number = 0
+    if '百' in value:
+        hundreds, _, value = value.partition('百')
+        number += (NUMERAL_DIGITS.get(hundreds, 1) if hundreds else 1) * 100
+        value = value.lstrip('零〇○')
+    if '十' in value:
+        tens, _, units = value.partition('十')
+        return number + (NUMERAL_DIGITS.get(tens, 1) if tens else 1) * 10 + (NUMERAL_DIGITS.get(units, 0) if units else 0)
+    digits = 0
+    for char in value:
+        digits = digits * 10 + NUMERAL_DIGITS[char]
+    return number + digits
+
+def split_clauses(text: str) -> list:
+    """
+    Split the body of an article into its lead-in and enumerated clauses.
+
+    Returns:
+        list: (clause label or None for the lead-in, text) pairs; a body without
+              at least two clauses is returned whole
+    """
+    starts = [match for match in CLAUSE_PATTERN.finditer(text)]
+    if len(starts) < 2:
+        return [(None, text)]
+    clauses = []
+    if text[:starts[0].start()].strip():
+        clauses.append((None, text[:starts[0].start()]))
+    for match, following in zip(starts, starts[1:] + [None]):
+        clauses.append((match.group(1), text[match.start():following.start() if following else len(text)]))
+    return clauses
+
+def segment_articles(text: str) -> list:
+    """
+    Segment the text of a policy document into article and clause units.
+
+    Article numbers must increase within a document; a header numbered at or below
+    the previous article is treated as running text (e.g. an annex quoting an article).
+    Text before the first article, often the end of an article from the previous
+    page, is a unit without article number. The heading is taken from 【...】 after
+    第X條, from a short phrase on the header line, or from a 【...】 line just above it. Articles longer than CLAUSE_SPLIT_CHARS
+    are split into their enumerated clauses, each unit keeping the article's title.
+
+    Args:
+        text (str): raw_text of an updated_insurance_output document
+
+    Returns:
+        list: Units {'article': int or None, 'title': str, 'heading': str, 'clause': str or None, 'text': str}
+              in document order; empty for a document without articles
+    """
+    headers = []
+    for match in ARTICLE_PATTERN.finditer(text):
+        number = article_number(match.group(1))
+        if headers and number <= headers[-1][0]:
+            continue
+        # (number, start of the article including a heading line above it, header match, that heading)
+        preceding = PRECEDING_HEADING_PATTERN.search(text, max(match.start() - 60, 0), match.start())
+        if preceding:
+            start = preceding.start() + (1 if text[preceding.start()] == '\n' else 0)
+            headers.append((number, start, match, preceding.group(1).strip()))
+        else:
+            headers.append((number, match.start(), match, None))
+    if not headers:
+        return []
+
+    units = []
+    preamble = text[:headers[0][1]]
+    if preamble.strip():
+        units.append({'article': None, 'title': '', 'heading': '', 'clause': None, 'text': preamble.strip()})
+    for (number, start, match, preceding_heading), following in zip(headers, headers[1:] + [None]):
+        end = following[1] if following else len(text)
+        heading_match = HEADING_PATTERN.match(text, match.end())
+        bracketed, inline = heading_match.groups() if heading_match else (None, None)
+        if preceding_heading is not None:
+            # The header line holds the start of the text
+            heading, body_start = preceding_heading, match.end()
+        elif bracketed is not None:
+            heading, body_start = bracketed.strip(), heading_match.end()
+        elif inline and len(inline.strip()) <= MAX_HEADING_CHARS and not SENTENCE_PATTERN.search(inline):
+            heading, body_start = inline.strip(), heading_match.end()
+        else:
+            # "第 十 條 要保人得隨時終止本契約。": the text starts on the header line
+            heading, body_start = '', match.end()
+        title = text[start:body_start].strip()
+        body = text[body_start:end].strip()
+        parts = split_clauses(body) if len(body) > CLAUSE_SPLIT_CHARS else [(None, body)]
+        for clause, clause_text in parts:
+            units.append({'article': number, 'title': title, 'heading': heading,
+                          'clause': clause, 'text': clause_text.strip()})
+    return units
+
+def build_article_index(corpus_dict: dict, cached_index: dict = None) -> dict:
+    """
+    Build the article index of the insurance corpus.
+
+    Documents whose content hash matches cached_index keep their cached units, so an
+    update only segments new and modified documents.
+
+    Args:
+        corpus_dict (dict): Document ID -> document from updated_insurance_output
+        cached_index (dict): Previously built index, as loaded from its JSON file (optional)
+
+    Returns:
+        dict: {'documents': {doc_id: {'hash', 'units'}}}; documents without articles have no units
+    """
+    cached_documents = {}
+    if cached_index:
+        cached_documents = {int(doc_id): info for doc_id, info in cached_index['documents'].items()}
+
+    documents = {}
+    for doc_id in sorted(corpus_dict):
+        doc = corpus_dict[doc_id]
+        doc_hash = content_hash(doc)
+        if doc_id in cached_documents and cached_documents[doc_id]['hash'] == doc_hash:
+            documents[doc_id] = cached_documents[doc_id]
+            continue
+        documents[doc_id] = {'hash': doc_hash, 'units': segment_articles(doc.get('raw_text') or '')}
+    return {'documents': documents}
+
+def unit_bigrams(text: str) -> Counter:
+    """Character bigram counts of normalized text"""
+    text = normalize(text)
+    return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+def load_article_index(index_path: str) -> dict:
+    """
+    Load an article index and build its in-memory lookups.
+
+    Args:
+        index_path (str): JSON file written by this script
+
+    Returns:
+        dict: Index whose documents also have 'by_article' (article number -> unit
+              positions, the O(1) lookup of "第X條" references), and for scoring the
+              bigram counts of each unit's text and heading, 'idf' and 'mean_length'
+    """
+    with open(index_path, 'r', encoding='utf-8') as f:
+        article_index = json.load(f)
+    article_index['documents'] = {int(doc_id): info for doc_id, info in article_index['documents'].items()}
+
+    document_frequency = Counter()
+    total_length = 0
+    num_units = 0
+    for info in article_index['documents'].values():
+        info['by_article'] = {}
+        info['bigrams'] = []
+        info['heading_bigrams'] = []
+        for position, unit in enumerate(info['units']):
+            if unit['article'] is not None:
+                info['by_article'].setdefault(unit['article'], []).append(position)
+            bigrams = unit_bigrams(unit['text'])
+            info['bigrams'].append(bigrams)
+            info['heading_bigrams'].append(set(unit_bigrams(unit['heading'])))
+            document_frequency.update(bigrams.keys())
+            total_length += sum(bigrams.values())
+            num_units += 1
+    article_index['idf'] = {bigram: math.log(1 + (num_units - count + 0.5) / (count + 0.5))
+                            for bigram, count in document_frequency.items()}
+    article_index['mean_length'] = total_length / max(num_units, 1)
+    with_units = sum(1 for info in article_index['documents'].values() if info['units'])
+    print(f"Loaded {num_units} article units of {with_units} insurance documents")
+    return article_index
+
+def article_references(query: str) -> list:
+    """
+    Article numbers named in a query, e.g. [16] for "第十六條的保險金如何計算？"
+    """
+    references = []
+    for match in QUERY_ARTICLE_PATTERN.finditer(query):
+        try:
+            references.append(article_number(match.group(1)))
+        except KeyError:
+            continue
+    return references
+
+def score_units(query: str, info: dict, article_index: dict) -> list:
+    """
+    Score the units of one document against a query with BM25 over character bigrams.
+
+    Bigrams of the query found in a unit's heading add HEADING_WEIGHT times their IDF.
+
+    Returns:
+        list: Score of each unit, in document order
+    """
+    idf = article_index['idf']
+    mean_length = article_index['mean_length']
+    query_bigrams = set(unit_bigrams(query))
+    scores = []
+    for bigrams, heading_bigrams in zip(info['bigrams'], info['heading_bigrams']):
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * sum(bigrams.values()) / mean_length)
+        score = 0.0
+        for bigram in query_bigrams:
+            count = bigrams.get(bigram)
+            if count:
+                score += idf.get(bigram, 0.0) * count * (BM25_K1 + 1) / (count + length_norm)
+            if bigram in heading_bigrams:
+                score += HEADING_WEIGHT * idf.get(bigram, 0.0)
+        scores.append(score)
+    return scores
+
+def select_units(query: str, info: dict, article_index: dict, max_units: int = MAX_UNITS) -> list:
+    """
+    Select the units of one document to show for a query.
+
+    Units of articles named in the query ("第X條") are always selected, then the
+    max_units best-scoring other units.
+
+    Returns:
+        list: Positions of the selected units, in document order
+    """
+    selected = {position for number in article_references(query) for position in info['by_article'].get(number, [])}
+    if len(info['units']) <= max_units + len(selected):
+        return list(range(len(info['units'])))
+    scores = score_units(query, info, article_index)
+    ranked = sorted((position for position in range(len(scores)) if position not in selected),
+                    key=lambda position: scores[position], reverse=True)
+    selected.update(ranked[:max_units])
+    return sorted(selected)
+
+def format_units(units: list, positions: list) -> str:
+    """
+    Render selected units, printing each article's title once before its first selected unit.
+    """
+    lines = []
+    current_article = None
+    for position in positions:
+        unit = units[position]
+        if unit['title'] and unit['article'] != current_article:
+            lines.append(unit['title'])
+        current_article = unit['article']
+        lines.append(unit['text'])
+    return '\n'.join(lines)
+
+def article_context(query: str, file_id, article_index: dict, max_units: int = MAX_UNITS) -> str:
+    """
+    The relevant clauses of one insurance document for a query.
+
+    Args:
+        query (str): User's question
+        file_id: Document ID
+        article_index (dict): Index from load_article_index
+        max_units (int): Units selected besides the articles the query names
+
+    Returns:
+        str: Selected article and clause text, or None if the document has no articles
+             in the index (the caller then uses the whole document)
+    """
+    info = article_index['documents'].get(int(file_id))
+    if not info or not info['units']:
+        return None
+    return format_units(info['units'], select_units(query, info, article_index, max_units))
+
+def evaluate(questions: list, truths: dict, corpus_dict: dict, article_index: dict, max_units: int):
+    """
+    Report the context size saved on insurance questions, and how often the true
+    document holds the best-scoring unit among the candidates (a lexical check that
+    the relevant clauses are found).
+    """
+    full_chars = 0
+    article_chars = 0
+    best_unit_hits = 0
+    judged = 0
+    insurance = [q_dict for q_dict in questions if q_dict['category'] == 'insurance']
+    for q_dict in insurance:
+        best = None
+        for file_id in q_dict['source']:
+            doc = corpus_dict.get(int(file_id))
+            if not doc:
+                continue
+            full_chars += len(str(doc))
+            context = article_context(q_dict['query'], file_id, article_index, max_units)
+            article_chars += len(context) if context is not None else len(str(doc))
+            info = article_index['documents'].get(int(file_id))
+            if info and info['units']:
+                score = max(score_units(q_dict['query'], info, article_index))
+                if best is None or score > best[0]:
+                    best = (score, int(file_id))
+        if q_dict['qid'] in truths and best:
+            judged += 1
+            best_unit_hits += best[1] == truths[q_dict['qid']]
+    print(f"Insurance questions: {len(insurance)}")
+    if full_chars:
+        print(f"Document context: {full_chars} characters in full, {article_chars} with articles "
+              f"({1 - article_chars / full_chars:.1%} less)")
+    if judged:
+        print(f"True document holds the best-scoring unit: {best_unit_hits}/{judged} ({best_unit_hits / judged:.1%})")
+
+if __name__ == "__main__":
+    """
+    Main entry point for building the article index of the insurance corpus.
+
+    Segments the raw text of every document in updated_insurance_output into
+    article units (第X條 with its heading) and, for long articles, clause units,
+    and saves them as one JSON index. If the index already exists, only documents
+    whose content changed are segmented again.
+
+    Usage:
+        python policy_articles.py --source_path ./reference --output_path ./reference/articles/insurance_articles.json
+                                  [--rebuild] [--question_path questions.json [--truth_path ground_truths.json]]
+    """
+    parser = argparse.ArgumentParser(description='Build the article index of the insurance corpus.')
+    parser.add_argument('--source_path',
+                       type=str,
+                       default="./reference",
+                       help='Reference directory (default: %(default)s)')
+    parser.add_argument('--output_path',
+                       type=str,
+                       default="./reference/articles/insurance_articles.json",
+                       help='Path where the article index is saved (default: %(default)s)')
+    parser.add_argument('--rebuild',
+                       action='store_true',
+                       help='Segment every document again instead of only the changed ones')
+    parser.add_argument('--question_path',
+                       type=str,
+                       default=None,
+                       help='Report the context saved on the insurance questions of this file (default: no report)')
+    parser.add_argument('--truth_path',
+                       type=str,
+                       default=None,
+                       help='Ground truths for the lexical check of the report (default: no check)')
+    parser.add_argument('--max_units',
+                       type=int,
+                       default=MAX_UNITS,
+                       help='Units selected per document in the report (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    print(f"Reading insurance documents from: {args.source_path}")
+    corpus_dict = load_corpus(args.source_path, 'insurance')
+    cached_index = None
+    if os.path.isfile(args.output_path) and not args.rebuild:
+        with open(args.output_path, 'r', encoding='utf-8') as f:
+            cached_index = json.load(f)
+    article_index = build_article_index(corpus_dict, cached_index)
+    if cached_index:
+        reused = sum(1 for doc_id, info in article_index['documents'].items()
+                     if cached_index['documents'].get(str(doc_id), {}).get('hash') == info['hash'])
+        print(f"Reused the units of {reused} unchanged documents")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    with open(args.output_path, 'w', encoding='utf-8') as f:
+        json.dump(article_index, f, ensure_ascii=False, indent=1)
+
+    units = [unit for info in article_index['documents'].values() for unit in info['units']]
+    with_units = sum(1 for info in article_index['documents'].values() if info['units'])
+    print(f"Documents: {len(article_index['documents'])} ({with_units} with articles)")
+    print(f"Units: {len(units)} ({sum(1 for unit in units if unit['clause'])} clauses, "
+          f"{sum(1 for unit in units if unit['article'] is None)} before the first article)")
+    print(f"Saved article index to: {args.output_path}")
+
+    if args.question_path:
+        with open(args.question_path, 'r', encoding='utf-8') as f:
+            questions = json.load(f)['questions']
+        truths = {}
+        if args.truth_path:
+            with open(args.truth_path, 'r', encoding='utf-8') as f:
+                truths = {item['qid']: item['retrieve'] for item in json.load(f)['ground_truths']}
+        evaluate(questions, truths, corpus_dict, load_article_index(args.output_path), args.max_units)
@@ -0,0 +1,496 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import my_retrieve
+from my_retrieve import add_retrieval_arguments, load_resources, process_question, render_document
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+from adaptive_limit import AdaptiveLimiter
+
+# Latencies kept for the percentiles reported by /stats
+LATENCY_WINDOW = 10000
+
+def question_key(q_dict: dict) -> tuple:
+    """
+    Identify a question by what its answer depends on, ignoring its qid.
+
+    The candidate order is kept, since it is the order of the documents in the prompt.
+    """
+    return (q_dict['category'], q_dict['query'], tuple(int(file_id) for file_id in q_dict['source']))
+
+class LatencyStats:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """
+        Latencies of the most recent answers, for percentiles.
+
+        Args:
+            window (int): Number of latencies kept
+        """
+        self.samples = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: Number of samples and p50/p90/p99/max latency in milliseconds
+        """
+        with self.lock:
+            samples = np.array(self.samples, dtype=np.float64)
+        if samples.size == 0:
+            return {'samples': 0}
+        p50, p90, p99 = (float(value) for value in np.percentile(samples, [50, 90, 99]) * 1000)
+        return {'samples': int(samples.size), 'p50_ms': round(p50, 1), 'p90_ms': round(p90, 1),
+                'p99_ms': round(p99, 1), 'max_ms': round(samples.max() * 1000, 1)}
+
+class MicroBatcher:
+    def __init__(self, handler, max_batch: int = 32, window: float = 0.005, max_workers: int = 16,
+                 cache_size: int = 4096, encode=None):
+        """
+        Group concurrent questions into micro-batches and answer identical ones once.
+
+        A question identical to one being answered (same category, query and
+        candidates, see question_key) waits for that answer instead of being
+        processed again; answered questions are kept in a bounded LRU cache.
+        New questions are collected for up to `window` seconds or `max_batch`
+        questions. The queries of a batch are encoded in one encoder call, which
+        is one embeddings request instead of one per question with the OpenAI
+        encoder, and the questions are then answered by a pool of `max_workers`
+        threads.
+
+        Args:
+            handler: Function answering a question, handler(q_dict, query_vector) -> result dict or None
+            max_batch (int): Maximum number of questions per batch
+            window (float): Seconds to wait for more questions after the first one of a batch
+            max_workers (int): Questions answered concurrently
+            cache_size (int): Answers kept for repeated questions, 0 disables the cache
+            encode: Optional function encoding a list of queries into vectors, whose rows
+                are passed to the handler (default: no batch encoding)
+        """
+        self.handler = handler
+        self.max_batch = max_batch
+        self.window = window
+        self.cache_size = cache_size
+        self.encode = encode
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retrieve-worker')
+        self.condition = threading.Condition()
+        self.pending = []                        # (key, q_dict, future) waiting for the next batch
+        self.inflight = {}                       # key -> future of the question being answered
+        self.cache = collections.OrderedDict()   # key -> answer, least recently used first
+        self.closed = False
+        self.questions = 0
+        self.processed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+        self.thread = threading.Thread(target=self.run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, q_dict: dict) -> concurrent.futures.Future:
+        """
+        Queue a question.
+
+        Args:
+            q_dict (dict): Question with 'category', 'query' and 'source'
+
+        Returns:
+            concurrent.futures.Future: Resolves to the answer {'retrieve': int, ...} or None
+                if the question failed; the result may be shared with identical questions
+        """
+        key = question_key(q_dict)
+        with self.condition:
+            self.questions += 1
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                future = concurrent.futures.Future()
+                future.set_result(self.cache[key])
+                return future
+            future = self.inflight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future
+            future = concurrent.futures.Future()
+            self.inflight[key] = future
+            self.pending.append((key, q_dict, future))
+            self.condition.notify()
+            return future
+
+    def run(self):
+        """Batching loop, run by the micro-batcher thread"""
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.pending:
+                    return
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_batch and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                self.batches += 1
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+            vectors = [None] * len(batch)
+            if self.encode:
+                try:
+                    vectors = self.encode([q_dict['query'] for _, q_dict, _ in batch])
+                except Exception as e:
+                    # Each question encodes its own query instead
+                    print(f"Batch encoding failed, encoding queries one by one: {e}")
+            for (key, q_dict, future), vector in zip(batch, vectors):
+                self.executor.submit(self.answer, key, q_dict, future, vector)
+
+    def answer(self, key: tuple, q_dict: dict, future: concurrent.futures.Future, query_vector):
+        """Answer one question of a batch and resolve everyone waiting for it"""
+        try:
+            result = self.handler(q_dict, query_vector)
+        except Exception as e:
+            print(f"Exception processing question {q_dict.get('qid')}: {e}")
+            result = None
+        with self.condition:
+            self.processed += 1
+            del self.inflight[key]
+            if result is None:
+                self.failed += 1
+            elif self.cache_size > 0:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        future.set_result(result)
+
+    def clear_cache(self):
+        """Forget cached answers, e.g. after the indexes changed"""
+        with self.condition:
+            self.cache.clear()
+
+    def close(self):
+        """Answer the queued questions and stop the batching thread and workers"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'questions': self.questions, 'processed': self.processed, 'failed': self.failed,
+                'deduplicated': self.deduplicated, 'cache_hits': self.cache_hits, 'cached': len(self.cache),
+                'queued': len(self.pending), 'in_flight': len(self.inflight),
+                'batches': self.batches, 'max_batch': self.max_batch_seen,
+                'mean_batch': round(self.processed / self.batches, 2) if self.batches else 0.0,
+            }
+
+class RetrieveService:
+    def __init__(self, batcher: MicroBatcher, timeout: float = 300):
+        """
+        Answer retrieval questions through a micro-batcher and track their latencies.
+
+        Args:
+            batcher (MicroBatcher): Batcher wrapping process_question
+            timeout (float): Seconds a request waits for its answers
+        """
+        self.batcher = batcher
+        self.timeout = timeout
+        self.latency = LatencyStats()
+        self.started = time.time()
+
+    def retrieve(self, questions: list) -> tuple:
+        """
+        Answer questions, each with its own qid.
+
+        Returns:
+            tuple: (answers [{'qid', 'retrieve'}], qids of failed questions)
+        """
+        start = time.perf_counter()
+        futures = [(q_dict, self.batcher.submit(q_dict)) for q_dict in questions]
+        answers = []
+        failed = []
+        for q_dict, future in futures:
+            remaining = self.timeout - (time.perf_counter() - start)
+            try:
+                result = future.result(timeout=max(remaining, 0))
+            except concurrent.futures.TimeoutError:
+                result = None
+            self.latency.record(time.perf_counter() - start)
+            if result is None:
+                failed.append(q_dict.get('qid'))
+            else:
+                answers.append({'qid': q_dict.get('qid'), 'retrieve': result['retrieve']})
+        return answers, failed
+
+    def refresh(self) -> bool:
+        """
+        Reopen the dense index if it was updated, dropping the answers that may depend on it.
+
+        Returns:
+            bool: True if the index was reopened
+        """
+        if my_retrieve.dense_index and my_retrieve.dense_index.refresh():
+            self.batcher.clear_cache()
+            return True
+        return False
+
+    def stats(self) -> dict:
+        stats = {'uptime_s': round(time.time() - self.started, 1), 'latency': self.latency.summary()}
+        stats.update(self.batcher.stats())
+        if my_retrieve.rate_limiter:
+            stats['rate_limiter'] = my_retrieve.rate_limiter.status()
+        if my_retrieve.cassette:
+            stats['cassette'] = my_retrieve.cassette.summary()
+        return stats
+
+def document_id(file_id) -> int:
+    """
+    Returns:
+        int: The document ID given as an integer, an integral float or a string
+             of an integer, or None for anything else (booleans included)
+    """
+    if isinstance(file_id, bool):
+        return None
+    if isinstance(file_id, int):
+        return file_id
+    if isinstance(file_id, float):
+        return int(file_id) if file_id.is_integer() else None
+    if isinstance(file_id, str):
+        try:
+            return int(file_id)
+        except ValueError:
+            return None
+    return None
+
+def validate_question(q_dict) -> str:
+    """
+    Check a question and convert its document IDs to ints, which the corpora
+    and the answer cache are keyed by.
+
+    Returns:
+        str: Why a question cannot be answered, or None if it is well-formed
+    """
+    if not isinstance(q_dict, dict):
+        return "A question must be an object"
+    missing = [field for field in ('category', 'query', 'source') if field not in q_dict]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}"
+    if q_dict['category'] not in ('finance', 'insurance', 'faq'):
+        return f"Unknown category: {q_dict['category']}"
+    if not isinstance(q_dict['query'], str):
+        return "'query' must be a string"
+    if not isinstance(q_dict['source'], list) or not q_dict['source']:
+        return "'source' must be a non-empty list of document IDs"
+    source_ids = [document_id(file_id) for file_id in q_dict['source']]
+    for file_id, source_id in zip(q_dict['source'], source_ids):
+        if source_id is None:
+            return f"Invalid document ID in 'source': {file_id!r}, expected an integer"
+    q_dict['source'] = source_ids
+    return None
+
+class RetrieveHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 connections resets clients arriving in bursts
+    request_queue_size = 128
+    daemon_threads = True
+
+class RetrieveRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, payload: dict, status: int = 200):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, message: str, status: int):
+        self.send_json({'error': {'message': message}}, status)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/refresh':
+            self.send_json({'reopened': self.service.refresh()})
+            return
+        if self.path != '/retrieve':
+            self.send_error_json(f"Unknown route {self.path}", 404)
+            return
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError as e:
+            self.send_error_json(f"Invalid JSON: {e}", 400)
+            return
+
+        # A single question, or {"questions": [...]} as in the question files
+        single = not (isinstance(payload, dict) and 'questions' in payload)
+        questions = [payload] if single else payload['questions']
+        if not isinstance(questions, list):
+            self.send_error_json("'questions' must be a list of questions", 400)
+            return
+        for q_dict in questions:
+            error = validate_question(q_dict)
+            if error:
+                self.send_error_json(error, 400)
+                return
+
+        answers, failed = self.service.retrieve(questions)
+        if single:
+            if answers:
+                self.send_json(answers[0])
+            else:
+                self.send_error_json(f"Failed to answer question {payload.get('qid')}", 502)
+            return
+        self.send_json({'answers': answers, 'failed': failed})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(self.service.stats())
+        elif self.path == '/health':
+            self.send_json({'status': 'ok'})
+        else:
+            self.send_error_json(f"Unknown route {self.path}", 404)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(service: RetrieveService, host: str = '127.0.0.1', port: int = 0):
+    """
+    Start the retrieval API in a background thread.
+
+    Args:
+        service (RetrieveService): Service answering the requests
+        host (str): Address to listen on
+        port (int): Port to listen on, 0 for any free port
+
+    Returns:
+        tuple: (server, base_url)
+    """
+    handler = type('Handler', (RetrieveRequestHandler,), {'service': service})
+    server = RetrieveHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def prerender_corpora() -> int:
+    """
+    Fill the render cache with every finance and insurance document.
+
+    Returns:
+        int: Number of characters rendered
+    """
+    my_retrieve.rendered_documents = {}
+    characters = 0
+    for corpus_dict in (my_retrieve.corpus_dict_finance, my_retrieve.corpus_dict_insurance):
+        for doc in corpus_dict.values():
+            characters += len(render_document(doc))
+    return characters
+
+if __name__ == "__main__":
+    """
+    Main entry point for the long-running retrieval service.
+
+    Loads the corpora, indexes and cassette once, renders every document for the
+    prompts up front, and answers questions over HTTP with process_question. The
+    options are those of my_retrieve.py, so the service answers exactly as a batch
+    run with the same options would.
+
+    Routes:
+        POST /retrieve   {"qid": 1, "category": "finance", "query": "...", "source": [1, 2]}
+                         -> {"qid": 1, "retrieve": 2}
+                         {"questions": [...]} -> {"answers": [...], "failed": [qids]}
+        POST /refresh    Reopen the dense index if it was updated since it was opened
+        GET  /stats      Counters, micro-batch sizes and p50/p90/p99 latency
+        GET  /health
+
+    Usage:
+        python retrieve_server.py --source_path ./reference [--port 8780]
+                                  [--max_tasks 16] [--max_batch 32] [--batch_window 5]
+                                  [--cache_size 4096] [--no_prerender]
+                                  [retrieval options of my_retrieve.py, e.g. --replay cassette.jsonl]
+
+    Load test it offline with ../Benchmark/load_test.py against a cassette replay.
+    """
+    parser = argparse.ArgumentParser(description='Serve document retrieval over a local HTTP API.')
+    parser.add_argument('--host',
+                       type=str,
+                       default='127.0.0.1',
+                       help='Address to listen on (default: %(default)s)')
+    parser.add_argument('--port',
+                       type=int,
+                       default=8780,
+                       help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--max_tasks',
+                       type=int,
+                       default=16,
+                       help='Questions answered concurrently (default: %(default)s)')
+    parser.add_argument('--max_batch',
+                       type=int,
+                       default=32,
+                       help='Maximum number of questions per micro-batch (default: %(default)s)')
+    parser.add_argument('--batch_window',
+                       type=float,
+                       default=5,
+                       help='Milliseconds to wait for more questions before starting a micro-batch (default: %(default)s)')
+    parser.add_argument('--cache_size',
+                       type=int,
+                       default=4096,
+                       help='Answers kept for repeated questions, 0 disables the cache (default: %(default)s)')
+    parser.add_argument('--timeout',
+                       type=float,
+                       default=300,
+                       help='Seconds a request waits for its answers (default: %(default)s)')
+    parser.add_argument('--no_prerender',
+                       action='store_true',
+                       help='Render documents on first use instead of at startup')
+    add_retrieval_arguments(parser)
+
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be combined")
+
+    print("\n=== Starting Retrieval Service ===")
+    start = time.perf_counter()
+    load_resources(args)
+    if args.no_prerender:
+        my_retrieve.rendered_documents = {}
+    else:
+        characters = prerender_corpora()
+        print(f"Rendered {len(my_retrieve.rendered_documents)} documents ({characters} characters)")
+    if args.adaptive:
+        my_retrieve.rate_limiter = AdaptiveLimiter(initial_limit=min(10, args.max_tasks), max_limit=args.max_tasks,
+                                                   tokens_per_minute=args.tpm)
+        print(f"Adaptive concurrency: {my_retrieve.rate_limiter.status()}")
+    if not args.replay:
+        # Connections are reused across requests
+        my_retrieve.get_client()
+    print(f"Ready in {time.perf_counter() - start:.1f}s")
+
+    # Looked up on each batch, since /refresh may reopen the index with another encoder
+    encode = (lambda queries: my_retrieve.dense_index.encoder.encode(queries)) if my_retrieve.dense_index else None
+    batcher = MicroBatcher(process_question, args.max_batch, args.batch_window / 1000, args.max_tasks,
+                           args.cache_size, encode)
+    service = RetrieveService(batcher, args.timeout)
+    server, base_url = start_server(service, args.host, args.port)
+    print(f"Retrieval service listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        batcher.close()
+        print(json.dumps(service.stats(), ensure_ascii=False, indent=2))
+        if my_retrieve.cassette:
+            print(my_retrieve.cassette.summary())
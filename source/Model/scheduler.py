@@ -0,0 +1,160 @@
+import heapq
+import time
+import argparse
+import threading
+import numpy as np
+
+LATENCY_SMOOTHING = 0.2  # weight of a new observation in a lane's expected latency
+
+def parse_lane_values(value: str) -> dict:
+    """
+    Parse per-category values of the form "faq=2,finance=1".
+
+    Args:
+        value (str): Comma-separated category=number pairs
+
+    Returns:
+        dict: Category -> float
+
+    Raises:
+        argparse.ArgumentTypeError: If a pair is malformed or a value is negative
+    """
+    values = {}
+    for pair in value.split(','):
+        try:
+            category, number = pair.split('=')
+            values[category.strip()] = float(number)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid lane value '{pair}', expected category=number")
+        if values[category.strip()] < 0:
+            raise argparse.ArgumentTypeError(f"Invalid lane value '{pair}', expected a non-negative number")
+    return values
+
+class QuestionScheduler:
+    def __init__(self, questions: list, policy: str = 'fifo', weights: dict = None,
+                 deadlines: dict = None, clock=time.monotonic):
+        """
+        Decide which question is submitted next when a worker becomes free.
+
+        Every question is queued in the lane of its category. Within a lane,
+        questions are ordered by priority (higher first), then by deadline
+        (earliest first), then by their position in the question file.
+        Questions may carry their own 'priority' (default 0) and 'deadline'
+        (seconds after the start of the run); questions without a deadline
+        get their category's entry of `deadlines`, if any.
+
+        With policy 'edf', the next question is chosen as follows:
+        1. Lane heads at risk of missing their deadline, i.e. whose deadline is
+           closer than their lane's expected latency, go first, earliest deadline first.
+        2. Otherwise only lanes whose head has the highest priority compete, and
+           the one using the smallest share of the running questions relative
+           to its weight wins. A lane with nothing queued leaves its share to
+           the others, so one category alone still uses every worker.
+        Lanes of weight 0 are only considered when no other lane has a question
+        queued, so they only use workers that the other lanes leave idle.
+        With policy 'fifo', questions are submitted in file order, whatever
+        their priorities and deadlines.
+
+        Args:
+            questions (list): Question dicts containing 'qid' and 'category'
+            policy (str): 'fifo' or 'edf'
+            weights (dict): Category -> share of the workers (default: 1 each)
+            deadlines (dict): Category -> default deadline in seconds (default: none)
+            clock: Function returning the current time in seconds
+
+        Example:
+            scheduler = QuestionScheduler(questions, 'edf', weights={'finance': 2})
+            q_dict = scheduler.next()   # None once nothing is queued
+            ...
+            scheduler.done(q_dict)
+        """
+        if policy not in ('fifo', 'edf'):
+            raise ValueError(f"Unknown scheduling policy '{policy}'")
+        self.policy = policy
+        self.weights = weights or {}
+        self.clock = clock
+        self.start = clock()
+        self.lock = threading.Lock()
+        self.lanes = {}             # lane -> heap of (-priority, deadline, position, q_dict)
+        self.running = {}           # lane -> number of submitted, unfinished questions
+        self.expected_latency = {}  # lane -> smoothed latency in seconds
+        self.submitted_at = {}      # id(q_dict) -> submission time
+        self.deadlines = {}         # id(q_dict) -> deadline in seconds after the start
+        self.finished = {}          # category -> list of (finish time, deadline)
+        for position, q_dict in enumerate(questions):
+            deadline = q_dict.get('deadline', (deadlines or {}).get(q_dict['category'], float('inf')))
+            lane = q_dict['category'] if policy == 'edf' else 'all'
+            self.deadlines[id(q_dict)] = float(deadline)
+            self.lanes.setdefault(lane, [])
+            self.running.setdefault(lane, 0)
+            # FIFO ignores priorities and deadlines and keeps the file order
+            key = (-q_dict.get('priority', 0), float(deadline)) if policy == 'edf' else (0, 0.0)
+            heapq.heappush(self.lanes[lane], key + (position, q_dict))
+
+    def __len__(self) -> int:
+        """Number of questions not yet submitted"""
+        return sum(len(queue) for queue in self.lanes.values())
+
+    def lane_of(self, q_dict: dict) -> str:
+        return q_dict['category'] if self.policy == 'edf' else 'all'
+
+    def pick_lane(self, now: float) -> str:
+        heads = {lane: queue[0] for lane, queue in self.lanes.items() if queue}
+        if self.policy == 'fifo' or len(heads) == 1:
+            return next(iter(heads))
+        weighted = {lane: head for lane, head in heads.items() if self.weights.get(lane, 1.0) > 0}
+        if weighted:
+            heads = weighted
+
+        at_risk = [lane for lane, head in heads.items()
+                   if head[1] - now <= self.expected_latency.get(lane, 0.0)]
+        if at_risk:
+            return min(at_risk, key=lambda lane: heads[lane][1:3])
+
+        top_priority = min(head[0] for head in heads.values())
+        candidates = [lane for lane, head in heads.items() if head[0] == top_priority]
+        return min(candidates, key=lambda lane: (self.running[lane] / max(self.weights.get(lane, 1.0), 1e-9),
+                                                 heads[lane][1:3]))
+
+    def next(self) -> dict:
+        """
+        Returns:
+            dict: The question to submit next, or None if nothing is queued
+        """
+        with self.lock:
+            if not any(self.lanes.values()):
+                return None
+            now = self.clock() - self.start
+            lane = self.pick_lane(now)
+            q_dict = heapq.heappop(self.lanes[lane])[3]
+            self.running[lane] += 1
+            self.submitted_at[id(q_dict)] = now
+            return q_dict
+
+    def done(self, q_dict: dict):
+        """Record that a submitted question has finished, successfully or not"""
+        with self.lock:
+            now = self.clock() - self.start
+            lane = self.lane_of(q_dict)
+            self.running[lane] -= 1
+            latency = now - self.submitted_at.pop(id(q_dict))
+            previous = self.expected_latency.get(lane)
+            self.expected_latency[lane] = latency if previous is None else \
+                previous + LATENCY_SMOOTHING * (latency - previous)
+            self.finished.setdefault(q_dict['category'], []).append((now, self.deadlines[id(q_dict)]))
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: Per category, the number of finished questions, the p50/p90/max time
+                  from the start of the run until they finished, and missed deadlines
+        """
+        with self.lock:
+            report = {}
+            for category, records in sorted(self.finished.items()):
+                finish_times = [finish for finish, _ in records]
+                p50, p90 = (float(value) for value in np.percentile(finish_times, [50, 90]))
+                report[category] = {'questions': len(records), 'p50_s': round(p50, 2), 'p90_s': round(p90, 2),
+                                    'max_s': round(max(finish_times), 2),
+                                    'missed_deadlines': sum(1 for finish, deadline in records if finish > deadline)}
+            return report
@@ -0,0 +1,184 @@
+import json
+import argparse
+
+def parse_shard(value: str) -> tuple:
+    """
+    Parse a shard specification of the form "i/N".
+
+    Args:
+        value (str): Shard specification, with 0 <= i < N
+
+    Returns:
+        tuple: (shard_index, num_shards)
+
+    Raises:
+        argparse.ArgumentTypeError: If the specification is malformed or out of range
+
+    Example:
+        parse_shard("1/4") -> (1, 4)
+    """
+    try:
+        index_str, count_str = value.split('/')
+        shard_index, num_shards = int(index_str), int(count_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', expected i/N")
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', expected 0 <= i < N")
+    return shard_index, num_shards
+
+def shard_of(qid: int, num_shards: int) -> int:
+    """
+    Deterministically assign a question to a shard by its qid.
+
+    Args:
+        qid (int): Question ID
+        num_shards (int): Total number of shards
+
+    Returns:
+        int: Shard index in [0, num_shards)
+    """
+    return int(qid) % num_shards
+
+def select_shard(questions: list, shard_index: int, num_shards: int) -> list:
+    """
+    Select the questions belonging to one shard, keeping their original order.
+
+    Args:
+        questions (list): Question dictionaries containing 'qid'
+        shard_index (int): Index of the shard to select
+        num_shards (int): Total number of shards
+
+    Returns:
+        list: Questions assigned to the shard
+    """
+    return [q for q in questions if shard_of(q['qid'], num_shards) == shard_index]
+
+def merge_shards(questions: list, shard_outputs: list, names: list = None) -> tuple:
+    """
+    Validate partial shard outputs and merge them into one answers list.
+
+    Args:
+        questions (list): All question dictionaries of the run
+        shard_outputs (list): Loaded partial output files written with --shard
+        names (list): Names of the shard files for the problem messages (default: their position)
+
+    Returns:
+        tuple: (answers sorted by qid, list of problems found, sorted unanswered qids)
+            The merge is complete only if there are no problems and no unanswered qids.
+    """
+    problems = []
+    expected_qids = {q['qid'] for q in questions}
+    names = names or [f"shard file {position + 1}" for position in range(len(shard_outputs))]
+
+    # Every file must be a partial output written with --shard
+    valid_outputs = []
+    for name, output in zip(names, shard_outputs):
+        shard = output.get('shard') if isinstance(output, dict) else None
+        if not isinstance(shard, dict) or not isinstance(shard.get('index'), int) or not isinstance(shard.get('count'), int):
+            problems.append(f"{name} is not a partial output written with --shard (no shard index and count)")
+        elif not isinstance(output.get('answers'), list):
+            problems.append(f"{name} has no answers list")
+        else:
+            valid_outputs.append((name, output))
+    if not valid_outputs:
+        return [], problems, sorted(expected_qids)
+    shard_outputs = [output for _, output in valid_outputs]
+
+    # All shards must come from the same partition and each index must appear once
+    counts = {output['shard']['count'] for output in shard_outputs}
+    if len(counts) != 1:
+        problems.append(f"Shard files use different shard counts: {sorted(counts)}")
+        return [], problems, sorted(expected_qids)
+    num_shards = counts.pop()
+    indexes = [output['shard']['index'] for output in shard_outputs]
+    for shard_index in range(num_shards):
+        if indexes.count(shard_index) == 0:
+            problems.append(f"Missing shard {shard_index}/{num_shards}")
+        elif indexes.count(shard_index) > 1:
+            problems.append(f"Shard {shard_index}/{num_shards} given more than once")
+
+    # Each shard must have been run on this question file's slice
+    for name, output in valid_outputs:
+        shard_index = output['shard']['index']
+        expected_slice = {q['qid'] for q in select_shard(questions, shard_index, num_shards)}
+        if 'qids' not in output:
+            problems.append(f"{name} (shard {shard_index}/{num_shards}) does not list the question IDs it covers")
+        elif set(output['qids']) != expected_slice:
+            extra = len(set(output['qids']) - expected_slice)
+            absent = len(expected_slice - set(output['qids']))
+            problems.append(f"{name} (shard {shard_index}/{num_shards}) was run on different questions: "
+                            f"{extra} question IDs not in this shard of the question file, {absent} missing")
+
+    answers = {}
+    for output in shard_outputs:
+        shard_index = output['shard']['index']
+        for answer in output['answers']:
+            qid = answer['qid']
+            if qid not in expected_qids:
+                problems.append(f"Shard {shard_index}/{num_shards} answered unknown question ID {qid}")
+            elif shard_of(qid, num_shards) != shard_index:
+                problems.append(f"Shard {shard_index}/{num_shards} answered question ID {qid} from another shard")
+            elif qid in answers:
+                problems.append(f"Question ID {qid} answered more than once")
+            else:
+                answers[qid] = answer
+
+    missing = sorted(expected_qids - set(answers))
+    return [answers[qid] for qid in sorted(answers)], problems, missing
+
+if __name__ == "__main__":
+    """
+    Main entry point for merging sharded retrieval runs.
+
+    Each shard is produced by running my_retrieve.py with --shard i/N. This script
+    checks that every shard is present, that every question was answered exactly
+    once by the shard it belongs to, and writes the final answers file.
+
+    Usage:
+        python sharding.py --question_path /path/to/questions.json
+                           --shard_paths shard0.json shard1.json ...
+                           --output_path /path/to/output.json
+                           [--allow_missing]
+    """
+    parser = argparse.ArgumentParser(description='Merge partial outputs of sharded retrieval runs.')
+    parser.add_argument('--question_path',
+                       type=str,
+                       required=True,
+                       help='Question file used for all shards')
+    parser.add_argument('--shard_paths',
+                       type=str,
+                       nargs='+',
+                       required=True,
+                       help='Partial output files written with --shard')
+    parser.add_argument('--output_path',
+                       type=str,
+                       required=True,
+                       help='Path where the merged answers will be saved')
+    parser.add_argument('--allow_missing',
+                       action='store_true',
+                       help='Write the merged file even if questions are unanswered')
+
+    args = parser.parse_args()
+
+    with open(args.question_path, 'r', encoding='utf-8') as f:
+        questions = json.load(f)['questions']
+
+    shard_outputs = []
+    for shard_path in args.shard_paths:
+        with open(shard_path, 'r', encoding='utf-8') as f:
+            shard_outputs.append(json.load(f))
+        print(f"Loaded shard file: {shard_path}")
+
+    answers, problems, missing = merge_shards(questions, shard_outputs, args.shard_paths)
+    for problem in problems:
+        print(f"Error: {problem}")
+    if missing:
+        print(f"{'Warning' if args.allow_missing else 'Error'}: {len(missing)} questions have no answer: {missing}")
+
+    if problems or (missing and not args.allow_missing):
+        print("\nMerge aborted, no output written")
+        raise SystemExit(1)
+
+    with open(args.output_path, 'w', encoding='utf8') as f:
+        json.dump({"answers": answers}, f, ensure_ascii=False, indent=4)
+    print(f"\nMerged {len(answers)}/{len(questions)} answers into: {args.output_path}")
@@ -1,150 +1,536 @@
 import os
+import re
+import sys
+import json
 import pdfplumber
 import fitz  # PyMuPDF for image extraction
-def extract_pdf_content(pdf_path, output_dir):
+from pathlib import Path
+from pdfminer.fontmetrics import FONT_METRICS
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+import tracing
+from tracing import span
+# Text extraction backends; 'pymupdf' reads characters natively and only uses pdfplumber for table pages
+TEXT_BACKENDS = ('pdfplumber', 'pymupdf')
+
+# pdfplumber's default word tolerances, reproduced by the PyMuPDF backend
+WORD_X_TOLERANCE = 3
+WORD_Y_TOLERANCE = 3
+
+# Keep real whitespace glyphs, do not invent spaces, expand ligatures and keep characters outside the page
+PYMUPDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_INHIBIT_SPACES
+def group_words_into_lines(words, page_y0, page_y1, page_content, seen_content):
     """
-    Extract both text and page images from a PDF file
+    Join words into text lines and add them to the page content
     
     Args:
-        pdf_path: Path to the PDF file
-        output_dir: Directory to save extracted images
-    
-    Returns:
-        dict: Dictionary containing extracted text and image paths
+        words: Words with 'text' and 'top', ordered as pdfplumber's extract_words returns them
+        page_y0: Top boundary of the page
+        page_y1: Bottom boundary of the page
+        page_content: List of (y, text) tuples to extend
+        seen_content: Set of texts already on the page, to skip duplicates
     """
-    # Create output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        
-    # Define pdf_name at the start of the function
-    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    
-    result = {
-        'text': '',
-        'images': []
-    }
+    current_line = []
+    current_y = None
+    line_spacing_threshold = 3
     
-    # Extract text using pdfplumber
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            page_content = []
-            seen_content = set()
-            
-            # Get page boundaries
-            page_x0, page_y0, page_x1, page_y1 = page.bbox
-            
-            # Extract tables and their positions
-            tables = page.extract_tables()
-            for table_num, table in enumerate(tables):
-                try:
-                    table_obj = page.find_tables()[table_num]
-                    x0, y0, x1, y1 = table_obj.bbox
-                    
-                    # Ensure coordinates are within page bounds
-                    x0 = max(x0, page_x0)
-                    y0 = max(y0, page_y0)
-                    x1 = min(x1, page_x1)
-                    y1 = min(y1, page_y1)
-                    
-                    # Skip tables with invalid dimensions
-                    if x1 - x0 <= 0 or y1 - y0 <= 0:
-                        continue
-                    
-                    # Process table rows
-                    table_text = ""
-                    for row in table:
-                        if not any(cell for cell in row):
-                            continue
-                        cleaned_cells = [str(cell or '').strip() for cell in row]
-                        if any(cleaned_cells):
-                            row_text = ' | '.join(cleaned_cells)
-                            if row_text not in seen_content:
-                                table_text += row_text + '\n'
-                                seen_content.add(row_text)
-                    
-                    if table_text:
-                        page_content.append((y0, table_text))
-                except Exception as e:
-                    print(f"Warning: Skipping problematic table on page {page_num + 1}: {str(e)}")
-                    continue
-            
-            # Extract regular text with boundary validation
-            words = page.extract_words(keep_blank_chars=True)
-            current_line = []
-            current_y = None
-            line_spacing_threshold = 3
-            
-            for word in words:
-                # Validate word position is within page bounds
-                if not (page_y0 <= word['top'] <= page_y1):
-                    continue
-                    
-                if current_y is None:
-                    current_y = word['top']
-                
-                if abs(word['top'] - current_y) > line_spacing_threshold:
-                    if current_line:
-                        text = ' '.join(current_line).strip()
-                        if text.endswith('-'):
-                            text = text[:-1]
-                        elif not text.endswith('.'):
-                            text += ' '
-                            
-                        if text and text not in seen_content:
-                            page_content.append((current_y, text))
-                            seen_content.add(text)
-                    
-                    current_line = [word['text']]
-                    current_y = word['top']
-                else:
-                    current_line.append(word['text'])
+    for word in words:
+        # Validate word position is within page bounds
+        if not (page_y0 <= word['top'] <= page_y1):
+            continue
             
-            # Process last line
+        if current_y is None:
+            current_y = word['top']
+        
+        if abs(word['top'] - current_y) > line_spacing_threshold:
             if current_line:
                 text = ' '.join(current_line).strip()
                 if text.endswith('-'):
                     text = text[:-1]
+                elif not text.endswith('.'):
+                    text += ' '
+                    
                 if text and text not in seen_content:
                     page_content.append((current_y, text))
                     seen_content.add(text)
             
-            # Sort all content by vertical position and combine
-            page_content.sort(key=lambda x: x[0])
-            page_text = '\n'.join(content for _, content in page_content)
-            if page_text:
-                result['text'] += page_text.strip() + '\n\n'
-
-    # Save extracted text to file
-    text_path = os.path.join(output_dir, f'{pdf_name}_text.txt')
-    with open(text_path, 'w', encoding='utf-8') as f:
-        f.write(result['text'])
+            current_line = [word['text']]
+            current_y = word['top']
+        else:
+            current_line.append(word['text'])
+    
+    # Process last line
+    if current_line:
+        text = ' '.join(current_line).strip()
+        if text.endswith('-'):
+            text = text[:-1]
+        if text and text not in seen_content:
+            page_content.append((current_y, text))
+            seen_content.add(text)
+def pdfplumber_page_text(page, page_num):
+    """
+    Extract the text of one page with pdfplumber, tables as "cell | cell" rows
+    
+    Args:
+        page: pdfplumber page
+        page_num: Page index, for warnings
+    
+    Returns:
+        str: Page text with tables and lines in vertical order
+    """
+    page_content = []
+    seen_content = set()
     
-    # Extract full page images using PyMuPDF
+    # Get page boundaries
+    page_x0, page_y0, page_x1, page_y1 = page.bbox
+    
+    # Extract tables and their positions
+    with span('pdfplumber.extract_tables', page=page_num + 1):
+        tables = page.extract_tables()
+    for table_num, table in enumerate(tables):
+        try:
+            with span('pdfplumber.find_tables', page=page_num + 1, table=table_num):
+                table_obj = page.find_tables()[table_num]
+            x0, y0, x1, y1 = table_obj.bbox
+            
+            # Ensure coordinates are within page bounds
+            x0 = max(x0, page_x0)
+            y0 = max(y0, page_y0)
+            x1 = min(x1, page_x1)
+            y1 = min(y1, page_y1)
+            
+            # Skip tables with invalid dimensions
+            if x1 - x0 <= 0 or y1 - y0 <= 0:
+                continue
+            
+            # Process table rows
+            table_text = ""
+            for row in table:
+                if not any(cell for cell in row):
+                    continue
+                cleaned_cells = [str(cell or '').strip() for cell in row]
+                if any(cleaned_cells):
+                    row_text = ' | '.join(cleaned_cells)
+                    if row_text not in seen_content:
+                        table_text += row_text + '\n'
+                        seen_content.add(row_text)
+            
+            if table_text:
+                page_content.append((y0, table_text))
+        except Exception as e:
+            print(f"Warning: Skipping problematic table on page {page_num + 1}: {str(e)}")
+            continue
+    
+    # Extract regular text with boundary validation
+    with span('pdfplumber.extract_words', page=page_num + 1):
+        words = page.extract_words(keep_blank_chars=True)
+    with span('group_words_into_lines', page=page_num + 1, words=len(words)):
+        group_words_into_lines(words, page_y0, page_y1, page_content, seen_content)
+    
+    # Sort all content by vertical position and combine
+    page_content.sort(key=lambda x: x[0])
+    return '\n'.join(content for _, content in page_content)
+def needs_pdfplumber(page, text_dict):
+    """
+    Check whether a page must go through pdfplumber to keep the output identical
+    
+    pdfplumber only finds tables from ruling lines, so a page without both a
+    horizontal and a vertical edge has no tables. Rotated pages, offset page
+    boxes and non-horizontal text are also left to pdfplumber.
+    
+    Args:
+        page: PyMuPDF page
+        text_dict: Result of page.get_text('rawdict')
+    
+    Returns:
+        bool: True if the page may contain tables or layouts the fast path does not reproduce
+    """
+    if page.rotation or page.cropbox != page.mediabox or page.mediabox.x0 or page.mediabox.y0:
+        return True
+    for block in text_dict['blocks']:
+        for line in block.get('lines', []):
+            if tuple(line['dir']) != (1.0, 0.0):
+                return True
+    has_horizontal = has_vertical = False
+    for drawing in page.get_drawings():
+        for item in drawing['items']:
+            if item[0] == 'l':
+                dx, dy = abs(item[2].x - item[1].x), abs(item[2].y - item[1].y)
+                has_horizontal = has_horizontal or dy <= 1
+                has_vertical = has_vertical or dx <= 1
+            else:
+                # Rectangles, quads and curves can all contribute table edges
+                has_horizontal = has_vertical = True
+            if has_horizontal and has_vertical:
+                return True
+    return False
+def font_descent(doc, xref):
+    """
+    Get the descent of a font the way pdfminer (used by pdfplumber) determines it
+    
+    Args:
+        doc: PyMuPDF document
+        xref: Cross-reference number of the font dictionary
+    
+    Returns:
+        float or None: Descent as a fraction of the font size (negative), or None
+                       for fonts whose metrics pdfminer derives differently
+    """
+    subtype = doc.xref_get_key(xref, 'Subtype')[1]
+    basefont = doc.xref_get_key(xref, 'BaseFont')[1].lstrip('/')
+    if subtype in ('/Type1', '/MMType1', '/TrueType') and basefont in FONT_METRICS:
+        # pdfminer prefers its built-in metrics of the standard 14 fonts
+        return -abs(FONT_METRICS[basefont][0].get('Descent', 0)) / 1000
+    if subtype == '/Type0':
+        kind, value = doc.xref_get_key(xref, 'DescendantFonts')
+        match = re.match(r'\[?\s*(\d+) 0 R', value) if kind == 'array' else None
+        if not match:
+            return None
+        xref = int(match.group(1))
+    elif subtype not in ('/Type1', '/MMType1', '/TrueType'):
+        return None
+    kind, value = doc.xref_get_key(xref, 'FontDescriptor')
+    if kind == 'null':
+        return 0.0
+    if kind != 'xref':
+        return None
+    kind, value = doc.xref_get_key(int(value.split()[0]), 'Descent')
+    if kind == 'null':
+        return 0.0
+    if kind not in ('int', 'float'):
+        return None
+    return -abs(float(value)) / 1000
+def font_key(name):
+    """
+    Normalize a font name for matching: no subset prefix, lower case, letters and digits only
+    """
+    return re.sub(r'[^0-9a-z]', '', name.split('+', 1)[-1].lower())
+def page_font_descents(page):
+    """
+    Map the font names used on a page to their pdfminer descents
+    
+    Args:
+        page: PyMuPDF page
+    
+    Returns:
+        dict: Normalized font name -> descent, or None if ambiguous or unknown
+    """
+    descents = {}
+    for xref, _, _, basefont, *_ in page.get_fonts(full=True):
+        descent = font_descent(page.parent, xref)
+        key = font_key(basefont)
+        if key in descents and descents[key] != descent:
+            descent = None
+        descents[key] = descent
+    return descents
+def span_descent(descents, font_name):
+    """
+    Find the descent of the font a span uses
+    
+    PyMuPDF names spans after the embedded font program, which may differ from
+    the BaseFont entry (e.g. "DejaVuSerif" for "DejaVu Serif Book"), so a unique
+    prefix match is accepted as well.
+    
+    Args:
+        descents: Result of page_font_descents
+        font_name: Font name of the span
+    
+    Returns:
+        float or None: Descent, or None if no single font matches
+    """
+    key = font_key(font_name)
+    if key in descents:
+        return descents[key]
+    matches = {descent for name, descent in descents.items() if key and (name.startswith(key) or key.startswith(name))}
+    return matches.pop() if len(matches) == 1 else None
+def cluster_values(values, tolerance):
+    """
+    Map each value to its cluster index, chaining sorted values closer than tolerance (as pdfplumber does)
+    """
+    clusters = {}
+    index = -1
+    last = None
+    for value in sorted(set(values)):
+        if last is None or value > last + tolerance:
+            index += 1
+        clusters[value] = index
+        last = value
+    return clusters
+def pymupdf_words(text_dict, descents):
+    """
+    Build words from PyMuPDF characters the way pdfplumber's extract_words(keep_blank_chars=True) does
+    
+    Character tops are computed from the baseline, font size and font descent as
+    pdfminer computes them. Characters are clustered into lines by top, sorted
+    by x0 within a line, and split into words at gaps wider than the tolerance.
+    
+    Args:
+        text_dict: Result of page.get_text('rawdict') for an upright page
+        descents: Normalized font name -> descent, from page_font_descents
+    
+    Returns:
+        list or None: Words with 'text' and 'top', or None if a font's descent is unknown
+    """
+    chars = []
+    for block in text_dict['blocks']:
+        for line in block.get('lines', []):
+            for span in line['spans']:
+                descent = span_descent(descents, span['font'])
+                if descent is None:
+                    return None
+                top_offset = span['size'] * (1 + descent)
+                for char in span['chars']:
+                    x0, _, x1, _ = char['bbox']
+                    chars.append((char['origin'][1] - top_offset, x0, x1, char['c']))
+    if not chars:
+        return []
+    
+    # Cluster characters into lines by top, keeping the original order within a cluster
+    line_index = cluster_values([char[0] for char in chars], WORD_Y_TOLERANCE)
+    lines = {}
+    for char in chars:
+        lines.setdefault(line_index[char[0]], []).append(char)
+    
+    words = []
+    for index in sorted(lines):
+        current = []
+        for char in sorted(lines[index], key=lambda c: c[1]):
+            if current:
+                prev = current[-1]
+                if char[1] < prev[1] or char[1] > prev[2] + WORD_X_TOLERANCE or abs(char[0] - prev[0]) > WORD_Y_TOLERANCE:
+                    words.append({'text': ''.join(c[3] for c in current), 'top': min(c[0] for c in current)})
+                    current = []
+            current.append(char)
+        if current:
+            words.append({'text': ''.join(c[3] for c in current), 'top': min(c[0] for c in current)})
+    return words
+def pymupdf_page_text(page):
+    """
+    Extract the text of one plain-text page with PyMuPDF
+    
+    Args:
+        page: PyMuPDF page
+    
+    Returns:
+        str or None: Page text as pdfplumber_page_text would return it, or None
+                     if the page needs pdfplumber (see needs_pdfplumber)
+    """
+    # pdfplumber keeps characters outside the page, so do not clip to it
+    with span('pymupdf.rawdict', page=page.number + 1):
+        text_dict = page.get_text('rawdict', flags=PYMUPDF_TEXT_FLAGS, clip=fitz.INFINITE_RECT())
+        if needs_pdfplumber(page, text_dict):
+            return None
+    with span('pymupdf.words', page=page.number + 1):
+        words = pymupdf_words(text_dict, page_font_descents(page))
+    if words is None:
+        return None
+    page_content = []
+    with span('group_words_into_lines', page=page.number + 1, words=len(words)):
+        group_words_into_lines(words, 0, page.rect.height, page_content, set())
+    page_content.sort(key=lambda x: x[0])
+    return '\n'.join(content for _, content in page_content)
+def iter_page_texts(pdf_path, backend='pdfplumber', pdf_name=None):
+    """
+    Extract the text of a PDF file one page at a time
+    
+    Each page's parsed objects and layout are released as soon as its text is
+    extracted. pdfplumber would otherwise keep them for every page until the PDF
+    is closed, so memory would grow with the page count.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        backend: 'pdfplumber' for every page, or 'pymupdf' for plain-text pages
+                 with pdfplumber only on pages that may contain tables
+        pdf_name: Name shown in trace spans (default: file name of pdf_path)
+    
+    Yields:
+        str: Text of each page, with tables as "cell | cell" rows in reading order
+    
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    if backend not in TEXT_BACKENDS:
+        raise ValueError(f"Unknown text backend '{backend}', expected one of {TEXT_BACKENDS}")
+    pdf_name = pdf_name or os.path.basename(pdf_path)
+    
+    if backend == 'pdfplumber':
+        # Extract text using pdfplumber
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_num, page in enumerate(pdf.pages):
+                with span('page_text', pdf=pdf_name, page=page_num + 1, backend='pdfplumber'):
+                    page_text = pdfplumber_page_text(page, page_num)
+                    page.close()
+                yield page_text
+        return
+    
+    # pdfplumber is only opened if a page needs it
     doc = fitz.open(pdf_path)
-    for page_num in range(doc.page_count):
-        page = doc[page_num]
-        
-        # Set high resolution parameters
-        zoom = 4.0  # Increase zoom factor for higher resolution
-        mat = fitz.Matrix(zoom, zoom)
+    pdf = None
+    try:
+        for page_num in range(doc.page_count):
+            with span('page_text', pdf=pdf_name, page=page_num + 1) as page_span:
+                page_text = pymupdf_page_text(doc[page_num])
+                page_span.set(backend='pymupdf' if page_text is not None else 'pdfplumber')
+                if page_text is None:
+                    if pdf is None:
+                        pdf = pdfplumber.open(pdf_path)
+                    page = pdf.pages[page_num]
+                    page_text = pdfplumber_page_text(page, page_num)
+                    page.close()
+            yield page_text
+    finally:
+        doc.close()
+        if pdf is not None:
+            pdf.close()
+def page_texts_line(page_text):
+    """
+    Line of a page texts file: the page's text as a JSON string, "" for a page without text
+    
+    Page texts files ({pdf}_pages.jsonl) hold one line per page in page order,
+    so the text of each page can be found again, which the document text with
+    its blank lines inside tables and without empty pages does not allow.
+    """
+    return json.dumps(page_text.strip() if page_text else '', ensure_ascii=False) + '\n'
+def extract_pdf_text(pdf_path, backend='pdfplumber', pages_path=None):
+    """
+    Extract the text of a PDF file, with tables as "cell | cell" rows in reading order
+    
+    Args:
+        pdf_path: Path to the PDF file
+        backend: 'pdfplumber' for every page, or 'pymupdf' for plain-text pages
+                 with pdfplumber only on pages that may contain tables
+        pages_path: Optional path of a page texts file to write, see page_texts_line
+    
+    Returns:
+        str: Extracted text, pages separated by blank lines
+    
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    pdf_name = os.path.basename(pdf_path)
+    with span('extract_pdf_text', pdf=pdf_name, backend=backend):
+        page_texts = list(iter_page_texts(pdf_path, backend, pdf_name))
+    if pages_path:
+        with open(pages_path, 'w', encoding='utf-8') as f:
+            f.writelines(page_texts_line(page_text) for page_text in page_texts)
+    return ''.join(page_text.strip() + '\n\n' for page_text in page_texts if page_text)
+def write_pdf_text(pdf_path, text_path, backend='pdfplumber', pages_path=None):
+    """
+    Extract the text of a PDF file straight into a file, page by page
+    
+    The file content is identical to extract_pdf_text, but only one page's text
+    is in memory at a time.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        text_path: Path of the text file to write
+        backend: Text extraction backend, see extract_pdf_text
+        pages_path: Optional path of a page texts file to write, see page_texts_line
+    
+    Returns:
+        int: Number of characters written to the text file
+    """
+    pdf_name = os.path.basename(pdf_path)
+    written = 0
+    pages_file = open(pages_path, 'w', encoding='utf-8') if pages_path else None
+    try:
+        with span('extract_pdf_text', pdf=pdf_name, backend=backend, stream=True):
+            with open(text_path, 'w', encoding='utf-8') as f:
+                for page_text in iter_page_texts(pdf_path, backend, pdf_name):
+                    if pages_file:
+                        pages_file.write(page_texts_line(page_text))
+                    if page_text:
+                        written += f.write(page_text.strip() + '\n\n')
+    finally:
+        if pages_file:
+            pages_file.close()
+    return written
+def render_page_images(pdf_path, output_dir, pdf_name, zoom=4.0):
+    """
+    Render each page of a PDF file to a PNG image, one page at a time
+    
+    Args:
+        pdf_path: Path to the PDF file
+        output_dir: Directory to save the page images
+        pdf_name: Prefix of the image file names
+        zoom: Resolution factor relative to 72 dpi
+    
+    Yields:
+        tuple: (page number starting at 1, image path) as soon as each page is saved
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in range(doc.page_count):
+            with span('render_page', pdf=pdf_name, page=page_num + 1, zoom=zoom):
+                page = doc[page_num]
+                
+                # Set high resolution parameters
+                mat = fitz.Matrix(zoom, zoom)
+                
+                # Convert page to high-res pixmap
+                with span('rasterize', pdf=pdf_name, page=page_num + 1):
+                    pix = page.get_pixmap(matrix=mat, alpha=False)
+                
+                # Save page image in high quality
+                image_path = os.path.join(output_dir, f'{pdf_name}_page_{page_num + 1}.png')
+                with span('png_save', pdf=pdf_name, page=page_num + 1, pixels=pix.width * pix.height):
+                    pix.save(image_path, output="png")
+            yield page_num + 1, image_path
+    finally:
+        doc.close()
+def extract_pdf_content(pdf_path, output_dir, text_backend='pdfplumber', stream=False):
+    """
+    Extract both text and page images from a PDF file
+    
+    Args:
+        pdf_path: Path to the PDF file
+        output_dir: Directory to save extracted images
+        text_backend: Text extraction backend, see extract_pdf_text
+        stream: Write the text file page by page instead of returning the text,
+                so that memory does not grow with the page count
+    
+    Returns:
+        dict: Extracted text ('text', None with stream), text file path ('text_path')
+              and image paths ('images')
+    """
+    # Create output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
         
-        # Convert page to high-res pixmap
-        pix = page.get_pixmap(matrix=mat, alpha=False)
+    # Define pdf_name at the start of the function
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    
+    with span('extract_pdf_content', pdf=pdf_name):
+        text_path = os.path.join(output_dir, f'{pdf_name}_text.txt')
+        pages_path = os.path.join(output_dir, f'{pdf_name}_pages.jsonl')
+        result = {
+            'text': None,
+            'text_path': text_path,
+            'images': []
+        }
+
+        # Save extracted text to file, and the text of each page for requests on several pages
+        if stream:
+            write_pdf_text(pdf_path, text_path, text_backend, pages_path)
+        else:
+            result['text'] = extract_pdf_text(pdf_path, text_backend, pages_path)
+            with open(text_path, 'w', encoding='utf-8') as f:
+                f.write(result['text'])
         
-        # Save page image in high quality
-        image_path = os.path.join(output_dir, f'{pdf_name}_page_{page_num + 1}.png')
-        pix.save(image_path, output="png")
-        result['images'].append(image_path)
+        # Extract full page images using PyMuPDF
+        for _, image_path in render_page_images(pdf_path, output_dir, pdf_name):
+            result['images'].append(image_path)
     
-    doc.close()
     return result
-def process_pdf_directory(input_dir, output_dir):
+def process_pdf_directory(input_dir, output_dir, text_backend='pdfplumber', stream=False):
     """
     Process all PDFs in a directory and extract their contents
     
     Args:
         input_dir: Directory containing PDF files
         output_dir: Directory to save extracted contents
+        text_backend: Text extraction backend, see extract_pdf_text
+        stream: Write each PDF's text page by page, see extract_pdf_content
     """
     # Create output directory if it doesn't exist
     if not os.path.exists(output_dir):
@@ -163,7 +549,7 @@ def process_pdf_directory(input_dir, output_dir):
         pdf_output_dir = os.path.join(output_dir, os.path.splitext(pdf_file)[0])
         
         try:
-            content = extract_pdf_content(pdf_path, pdf_output_dir)
+            content = extract_pdf_content(pdf_path, pdf_output_dir, text_backend, stream)
             # Updated print statement to only show pages (removed tables reference)
             print(f"Processed {pdf_file}: {len(content['images'])} pages extracted")
         except Exception as e:
@@ -177,7 +563,8 @@ if __name__ == "__main__":
     Main entry point for PDF processing script.
     
     Usage:
-        python ExtractPDF.py --input_dir /path/to/pdfs --output_dir /path/to/output
+        python ExtractPDF.py --input_dir /path/to/pdfs --output_dir /path/to/output [--text_backend pymupdf]
+                             [--stream] [--trace ./trace/extract.json]
     """
     import argparse
     
@@ -191,11 +578,25 @@ if __name__ == "__main__":
                        type=str,
                        default="./reference/test_extracted",
                        help='Directory where extracted content will be saved')
+    parser.add_argument('--text_backend',
+                       type=str,
+                       choices=TEXT_BACKENDS,
+                       default='pdfplumber',
+                       help='Text extraction backend; pymupdf uses pdfplumber only for pages that may contain tables (default: %(default)s)')
+    parser.add_argument('--stream',
+                       action='store_true',
+                       help='Write each text file page by page, keeping memory constant for very long PDFs')
+    parser.add_argument('--trace',
+                       type=str,
+                       default=None,
+                       help='Write per-PDF and per-page timings to this Chrome trace / Perfetto JSON file (default: disabled)')
     
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
     
     print(f"Processing PDFs from: {args.input_dir}")
     print(f"Saving output to: {args.output_dir}")
     
-    total_errors = process_pdf_directory(args.input_dir, args.output_dir)
+    total_errors = process_pdf_directory(args.input_dir, args.output_dir, args.text_backend, args.stream)
     print(f"Total errors across all PDFs: {total_errors}")
\ No newline at end of file
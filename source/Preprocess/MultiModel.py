@@ -1,13 +1,25 @@
 import os
+import re
+import sys
 import json
+import time
 import base64
 from openai import OpenAI
 from typing import List, Dict, Any, Optional
 import concurrent.futures
+import threading
 import logging
 from dotenv import load_dotenv
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+from adaptive_limit import AdaptiveLimiter, estimate_tokens
+from batch_api import BatchSession, BatchRequestError, completion_content
+from makeDict import has_text
+import tracing
+from tracing import span
+from PageFilter import BLANK_INK, PageFilter, filter_tasks, write_duplicate_results
+
 # Set the path to the .env file
 env_path = Path(__file__).resolve().parent.parent / '.env'
 
@@ -18,10 +30,76 @@ load_dotenv(dotenv_path=env_path)
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR, 
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Completion token budget of a page analysis request
+MAX_TOKENS = 4096
+
+# Completion token budget of a request for several pages, the model's output limit
+PACK_MAX_TOKENS = 16384
+
+# Default estimated prompt tokens of a request for several pages
+PACK_TOKENS = 20000
+
+# System prompt of the page analysis requests
+SYSTEM_PROMPT = """You're a helpful assistant that can extract detailed information from the input text and images.
+You will be provided with:
+1. The parsed text from the entire PDF document
+2. A specific image of one page from the PDF document
+
+Your task is to extract the information from the image and combine it with the corresponding part of the parsed text, especially if any information is missing from the text. Your output should be focused on capturing the complete information contained in the page image in detail, in raw text form.
+
+Make sure your response is comprehensive enough that a chinese reader would fully understand the content of the page even without seeing the original document.
+
+**Output Requirements:**
+- The output must be in JSON format, structured as follows:
+  
+  ```json
+  {
+    "page{n}_text": "Extracted information from the image combined with the parsed text for page n. The text should be complete enough for readers to understand the content."
+  }
+
+"""
+
+# System prompt of the requests for several pages, answered with one key per page
+PACKED_SYSTEM_PROMPT = """You're a helpful assistant that can extract detailed information from the input text and images.
+You will be provided with:
+1. The parsed text of several pages from a PDF document, each marked with its page number (or the parsed text of the entire document)
+2. The images of these pages, in the same order
+
+Your task is to extract the information from each page image and combine it with the parsed text of the same page, especially if any information is missing from the text. Your output should be focused on capturing the complete information contained in each page image in detail, in raw text form. Keep the pages apart: the text of a page must only describe that page.
+
+Make sure your response is comprehensive enough that a chinese reader would fully understand the content of each page even without seeing the original document.
+
+**Output Requirements:**
+- The output must be in JSON format, with one key for every given page number n, structured as follows:
+
+  ```json
+  {
+    "page{n}_text": "Extracted information from the image combined with the parsed text for page n. The text should be complete enough for readers to understand the content.",
+    ...
+  }
+
+"""
+
 class MultiModel:
-    def __init__(self):
-        """Initialize the MultiModel with OpenAI API key"""
-        self.client = OpenAI()
+    def __init__(self, limiter: Optional[AdaptiveLimiter] = None):
+        """
+        Initialize the MultiModel with OpenAI API key
+
+        Args:
+            limiter: Optional AdaptiveLimiter shared by all requests; when given,
+                the limiter retries rate-limited requests instead of the client
+        """
+        self.limiter = limiter
+        self.client = OpenAI(max_retries=0) if limiter else OpenAI()
+        self.usage_lock = threading.Lock()
+        self.usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def record_usage(self, usage: Dict[str, Any]):
+        """Add the token usage of a successful request to the totals of the run"""
+        with self.usage_lock:
+            self.usage['requests'] += 1
+            self.usage['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            self.usage['completion_tokens'] += usage.get('completion_tokens') or 0
 
     def encode_image(self, image_path: str) -> str:
         """
@@ -33,10 +111,55 @@ class MultiModel:
         Returns:
             Base64 encoded string
         """
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        with span('base64', image=os.path.basename(image_path)) as encode_span:
+            with open(image_path, "rb") as image_file:
+                data = image_file.read()
+            encode_span.set(bytes=len(data))
+            return base64.b64encode(data).decode('utf-8')
 
-    def analyze_content(self, text: str, image_paths: Optional[List[str]] = None, prompt: str = "") -> Dict[str, Any]:
+    def request_body(self, text: str, image_paths: Optional[List[str]] = None, prompt: str = "",
+                     max_tokens: int = MAX_TOKENS) -> Dict[str, Any]:
+        """
+        Build the chat completion request for text and optional multiple image inputs
+        
+        Args:
+            text: Text input to analyze
+            image_paths: Optional list of paths to image files
+            prompt: Prompt/instructions for the model
+            max_tokens: Completion token budget
+            
+        Returns:
+            Request body, usable with chat.completions.create or in a batch input file
+        """
+        # Construct base message content
+        content = [{"type": "text", "text": text}]
+        
+        # Add images if provided
+        if image_paths:
+            for image_path in image_paths:
+                base64_image = self.encode_image(image_path)
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}"
+                    }
+                })
+        
+        messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": content}
+        ]
+        
+        # Use vision model
+        return {
+            "model": "gpt-4o",
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}
+        }
+
+    def analyze_content(self, text: str, image_paths: Optional[List[str]] = None, prompt: str = "",
+                        max_tokens: int = MAX_TOKENS) -> Dict[str, Any]:
         """
         Analyze content using GPT-4 Vision model with text and optional multiple image inputs
         
@@ -44,43 +167,33 @@ class MultiModel:
             text: Text input to analyze
             image_paths: Optional list of paths to image files
             prompt: Prompt/instructions for the model
+            max_tokens: Completion token budget
             
         Returns:
             Dict containing model response and metadata
         """
         try:
-            # Construct base message content
-            content = [{"type": "text", "text": text}]
-            
-            # Add images if provided
-            if image_paths:
-                for image_path in image_paths:
-                    base64_image = self.encode_image(image_path)
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    })
-            
-            messages = [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": content}
-            ]
+            with span('request_body', images=len(image_paths or [])):
+                body = self.request_body(text, image_paths, prompt, max_tokens)
             
-            # Use vision model
-            model = "gpt-4o"
-            
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=4096,
-                response_format={"type": "json_object"}
-            )
+            def request():
+                with span('api_call', cat='api') as call_span:
+                    response = self.client.chat.completions.create(**body)
+                    call_span.set(total_tokens=response.usage.total_tokens)
+                    return response
+
+            if self.limiter:
+                estimated = estimate_tokens(prompt + text, len(image_paths or [])) + max_tokens
+                response = self.limiter.call(request, estimated)
+            else:
+                response = request()
+            self.record_usage({"prompt_tokens": response.usage.prompt_tokens,
+                               "completion_tokens": response.usage.completion_tokens})
             
             return {
                 "success": True,
                 "response": response.choices[0].message.content,
+                "finish_reason": response.choices[0].finish_reason,
                 "usage": {
                     "prompt_tokens": response.usage.prompt_tokens,
                     "completion_tokens": response.usage.completion_tokens,
@@ -94,18 +207,256 @@ class MultiModel:
                 "error": str(e)
             }
 
-# Define a function to process a task
-def process_task(task):
+def batch_task_id(task):
+    """
+    Stable custom ID of a task in a batch: its result file name without extension,
+    with the number of pages for packed tasks (e.g. 12_image3_result_pack4)
+    """
+    custom_id = os.path.splitext(os.path.basename(task['output_path']))[0]
+    return f"{custom_id}_pack{len(task['pages'])}" if 'pages' in task else custom_id
+
+def page_number(image_path):
+    """
+    Page number of a page image written by ExtractPDF.py ({pdf}_page_{n}.png), or None
+    """
+    match = re.search(r'_page_(\d+)\.png$', image_path)
+    return int(match.group(1)) if match else None
+
+def read_page_texts(dir_path):
+    """
+    Read the page texts file written by ExtractPDF.py ({pdf}_pages.jsonl) in a document directory
+
+    Returns:
+        list: Text of every page in page order, "" for pages without text,
+              or None if the directory has no readable page texts file
+    """
+    pages_file = next((f for f in os.listdir(dir_path) if f.endswith('_pages.jsonl')), None)
+    if not pages_file:
+        return None
     try:
-        # Use the pre-initialized model
-        result = model.analyze_content(
-            text=task['text'],
-            image_paths=task['image_paths'],
-            prompt=task['prompt']
-        )
+        with open(os.path.join(dir_path, pages_file), 'r', encoding='utf-8') as f:
+            page_texts = [json.loads(line) for line in f]
+    except (OSError, ValueError):
+        return None
+    return page_texts if all(isinstance(page_text, str) for page_text in page_texts) else None
+
+def make_pack(tasks, page_texts):
+    """
+    Combine single-page tasks of one document into one task for all their pages
+
+    The request contains the parsed text of each page if page_texts is given,
+    otherwise the document text once, and the page images in order. Its answer
+    has one page{n}_text key per page and is split by save_result.
+
+    Args:
+        tasks: Single-image tasks of one document, in page order
+        page_texts: Text of every page of the document, as read by read_page_texts, or None
+
+    Returns:
+        dict: Task with 'pages', a list of (page number, result file) pairs
+    """
+    if len(tasks) == 1:
+        return tasks[0]
+    numbers = [page_number(task['image_paths'][0]) for task in tasks]
+    listing = ', '.join(str(number) for number in numbers)
+    if page_texts:
+        text = (f"The images are pages {listing} of the PDF document, in this order. Parsed text of these pages:\n\n"
+                + '\n\n'.join(f"[Page {number}]\n{page_texts[number - 1] or '(no parsed text)'}"
+                                for number in numbers))
+    else:
+        text = f"{tasks[0]['text']}\n\nThe images are pages {listing} of the PDF document, in this order."
+    return {
+        'text': text,
+        'image_paths': [task['image_paths'][0] for task in tasks],
+        'prompt': PACKED_SYSTEM_PROMPT,
+        'max_tokens': min(MAX_TOKENS * len(tasks), PACK_MAX_TOKENS),
+        'output_path': tasks[0]['output_path'],
+        'pages': [(number, task['output_path']) for number, task in zip(numbers, tasks)]
+    }
+
+def pack_tasks(tasks, max_pages, max_prompt_tokens=PACK_TOKENS):
+    """
+    Group the page tasks of each document into requests for several pages
+
+    Pages of a document are packed in page order, up to max_pages images and
+    max_prompt_tokens estimated prompt tokens per request. Each request holds
+    the parsed text of its own pages from the document's page texts file, or
+    the document text if there is none. Text-only tasks and pages whose image
+    name has no page number are left as they are.
+
+    Args:
+        tasks: Task dicts as built by collect_tasks
+        max_pages: Maximum number of page images per request
+        max_prompt_tokens: Maximum estimated prompt tokens per request
+
+    Returns:
+        list: Tasks to run, packed ones with 'pages' (see make_pack)
+    """
+    packed = []
+    documents = {}  # image directory -> page tasks
+    for task in tasks:
+        if task['image_paths'] and len(task['image_paths']) == 1 and page_number(task['image_paths'][0]):
+            documents.setdefault(os.path.dirname(task['image_paths'][0]), []).append(task)
+        else:
+            packed.append(task)
+
+    for dir_path, page_tasks in documents.items():
+        page_tasks.sort(key=lambda task: page_number(task['image_paths'][0]))
+        page_texts = read_page_texts(dir_path)
+        if page_texts is not None and page_number(page_tasks[-1]['image_paths'][0]) > len(page_texts):
+            page_texts = None  # written for another version of the document
+        current = []
+        for task in page_tasks:
+            candidate = make_pack(current + [task], page_texts)
+            too_large = estimate_tokens(candidate['prompt'] + candidate['text'], len(candidate['image_paths'])) > max_prompt_tokens
+            if current and (len(current) >= max_pages or too_large):
+                packed.append(make_pack(current, page_texts))
+                current = [task]
+            else:
+                current.append(task)
+        if current:
+            packed.append(make_pack(current, page_texts))
+    return packed
+
+def packing_summary(tasks, packed):
+    """
+    Compare the requests and estimated prompt tokens of packed tasks with single-page tasks
+    """
+    def prompt_tokens(task_list):
+        return sum(estimate_tokens(task['prompt'] + task['text'], len(task['image_paths'] or [])) for task in task_list)
+    single, combined = prompt_tokens(tasks), prompt_tokens(packed)
+    return (f"Packing: {len(tasks)} tasks in {len(packed)} requests, estimated prompt tokens "
+            f"{combined:,} instead of {single:,} ({1 - combined / max(single, 1):.0%} less)")
+
+def save_result(task, result):
+    """
+    Save the result of a task as JSON
+
+    The result of a packed task is split into one result file per page, as if
+    each page had been analyzed alone, so that makeDict.py and RepairPages.py
+    work unchanged. A page whose page{n}_text is missing from the answer gets
+    a failed result, to be analyzed again by RepairPages.py. The token usage
+    is divided between the pages.
+    """
+    if 'pages' not in task:
         os.makedirs(os.path.dirname(task['output_path']), exist_ok=True)
         with open(task['output_path'], 'w', encoding='utf-8') as f:
             json.dump(result, f, indent=2, ensure_ascii=False)
+        return
+
+    data = {}
+    if result['success']:
+        try:
+            data = json.loads(result['response'] or '')
+        except json.JSONDecodeError:
+            pass
+        if not isinstance(data, dict):
+            data = {}
+    num_pages = len(task['pages'])
+    packed_with = [os.path.basename(output_path) for _, output_path in task['pages']]
+    for index, (number, output_path) in enumerate(task['pages']):
+        key = f"page{number}_text"
+        if has_text(data.get(key)):
+            # The first page also gets the remainder, so the pages add up to the request's usage
+            usage = {name: (value or 0) // num_pages + ((value or 0) % num_pages if index == 0 else 0)
+                     for name, value in (result.get('usage') or {}).items()}
+            page_result = {
+                "success": True,
+                "response": json.dumps({key: data[key]}, ensure_ascii=False),
+                "finish_reason": result.get('finish_reason'),
+                "packed_with": packed_with,
+                "usage": usage
+            }
+        else:
+            page_result = {
+                "success": False,
+                "error": result.get('error') or f"{key} missing from the answer for {', '.join(packed_with)}",
+                "packed_with": packed_with
+            }
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(page_result, f, indent=2, ensure_ascii=False)
+
+def run_batch(multi_model, tasks, session):
+    """
+    Analyze tasks through the Batch API and save the results as run_task does
+    
+    Tasks whose result is already in the session (e.g. from an interrupted run)
+    are not submitted again. Requests that still fail after all attempts are
+    saved as failed results, like failed requests of run_task.
+    
+    Args:
+        multi_model: MultiModel instance used to build the requests
+        tasks: List of task dicts as in run_task
+        session: BatchSession to submit the requests with
+        
+    Returns:
+        int: Number of failed tasks
+    """
+    for task in tasks:
+        custom_id = batch_task_id(task)
+        try:
+            if session.result(custom_id) is None:
+                session.add(custom_id, multi_model.request_body(task['text'], task['image_paths'], task['prompt'],
+                                                                   task.get('max_tokens', MAX_TOKENS)))
+        except BatchRequestError:
+            pass
+        except Exception as e:
+            error_message = f"Error preparing batch request for {task['output_path']}: {e}"
+            print(error_message)
+            logging.error(error_message)
+    print(f"Queued {session.pending} of {len(tasks)} tasks for the Batch API")
+    session.flush()
+
+    error_count = 0
+    for task in tasks:
+        try:
+            completion = session.result(batch_task_id(task))
+            if completion is None:
+                raise BatchRequestError("request was not submitted")
+            usage = completion.get('usage') or {}
+            multi_model.record_usage(usage)
+            result = {
+                "success": True,
+                "response": completion_content(completion),
+                "finish_reason": completion['choices'][0].get('finish_reason'),
+                "usage": {
+                    "prompt_tokens": usage.get('prompt_tokens'),
+                    "completion_tokens": usage.get('completion_tokens'),
+                    "total_tokens": usage.get('total_tokens')
+                }
+            }
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": str(e)
+            }
+            error_count += 1
+        save_result(task, result)
+    return error_count
+
+def run_task(multi_model, task):
+    """
+    Analyze one task and save the result as JSON
+    
+    Args:
+        multi_model: MultiModel instance used for the request
+        task: Dict with 'text', 'image_paths', 'prompt' and 'output_path', and
+              optionally 'max_tokens'
+        
+    Returns:
+        bool: True if the result was saved, False otherwise
+    """
+    try:
+        with span('vision_task', task=os.path.basename(task['output_path'])) as task_span:
+            result = multi_model.analyze_content(
+                text=task['text'],
+                image_paths=task['image_paths'],
+                prompt=task['prompt'],
+                max_tokens=task.get('max_tokens', MAX_TOKENS)
+            )
+            task_span.set(success=result['success'])
+            save_result(task, result)
         return True
     except Exception as e:
         # Log error details
@@ -113,6 +464,80 @@ def process_task(task):
         print(error_message)
         logging.error(error_message)
         return False
+
+def collect_tasks(input_dir, output_dir, numbering='index', verbose=True):
+    """
+    Build the vision tasks of an extraction directory
+    
+    PDFs marked hasPic get one task per page image, the others one text-only task.
+    
+    Args:
+        input_dir: Directory of extracted PDFs, one subdirectory per PDF
+        output_dir: Directory of the result files
+        numbering: How page results are numbered: 'index' counts the page images
+            of a PDF as this script does, 'page' uses the page number of the
+            image file name as StreamPipeline.py does
+        verbose: Print a line per prepared directory
+        
+    Returns:
+        list: Task dicts with 'text', 'image_paths', 'prompt' and 'output_path'
+    """
+    all_tasks = []
+
+    # Iterate through numbered directories
+    for dir_name in os.listdir(input_dir):
+        dir_path = os.path.join(input_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            continue
+            
+        # Find text file and check for images/tables
+        files = os.listdir(dir_path)
+        has_pic = any(f.startswith('hasPic') for f in files)
+
+        # Find the text file
+        text_file = next((f for f in files if f.endswith('.txt')), None)
+        if not text_file:
+            print(f"No text file found in {dir_path}")
+            continue
+
+        # Read text content
+        with open(os.path.join(dir_path, text_file), 'r', encoding='utf-8') as f:
+            text_content = f.read()
+
+        # Process each image individually if pictures are present
+        if has_pic:
+            image_files = [f for f in files if f.endswith('.png')]
+
+            for idx, image_file in enumerate(image_files, 1):
+                image_path = os.path.join(dir_path, image_file)
+                if numbering == 'page':
+                    idx = int(re.search(r'_page_(\d+)\.png$', image_file).group(1))
+
+                # Add task for each image
+                all_tasks.append({
+                    'text': text_content,
+                    'image_paths': [image_path],
+                    'prompt': SYSTEM_PROMPT,
+                    'output_path': os.path.join(output_dir, f"{dir_name}_image{idx}_result.json")
+                })
+
+        else:
+            # Add text-only task
+            all_tasks.append({
+                'text': text_content,
+                'image_paths': None,
+                'prompt': SYSTEM_PROMPT,
+                'output_path': os.path.join(output_dir, f"{dir_name}_result.json")
+            })
+
+        if verbose:
+            print(f"Prepared tasks for directory {dir_name}")
+    return all_tasks
+
+# Define a function to process a task
+def process_task(task):
+    # Use the pre-initialized model
+    return run_task(model, task)
     
 
 if __name__ == "__main__":
@@ -125,6 +550,10 @@ if __name__ == "__main__":
     
     Usage:
         python MultiModel.py --input_dir /path/to/input --output_dir /path/to/output --max_tasks 100
+                             [--adaptive [--tpm 30000]]
+                             [--batch_dir ./batch/vision [--poll_interval 30] [--batch_attempts 3]]
+                             [--trace ./trace/vision.json] [--page_filter [--blank_ink 0.001]]
+                             [--pack_pages 4 [--pack_tokens 20000]]
         
     The input directory should contain subdirectories with extracted PDF content
     (text files and images) generated by ExtractPDF.py and tagged by MultiTypeTag.py.
@@ -145,117 +574,128 @@ if __name__ == "__main__":
                        type=int,
                        default=100,
                        help='Maximum number of concurrent tasks')
+    parser.add_argument('--adaptive',
+                       action='store_true',
+                       help='Adapt the number of concurrent requests to rate limits, up to --max_tasks')
+    parser.add_argument('--tpm',
+                       type=int,
+                       default=None,
+                       help='Starting tokens-per-minute budget with --adaptive (default: no token limit)')
+    parser.add_argument('--batch_dir',
+                       type=str,
+                       default=None,
+                       help='Use the Batch API with this working directory (default: interactive requests)')
+    parser.add_argument('--poll_interval',
+                       type=float,
+                       default=30,
+                       help='Seconds between two batch status checks (default: %(default)s)')
+    parser.add_argument('--batch_attempts',
+                       type=int,
+                       default=3,
+                       help='Submissions of a failed batch request before giving up (default: %(default)s)')
+    parser.add_argument('--trace',
+                       type=str,
+                       default=None,
+                       help='Write per-page timings to this Chrome trace / Perfetto JSON file (default: disabled)')
+    parser.add_argument('--page_filter',
+                       action='store_true',
+                       help='Skip blank pages and reuse the result of identical pages instead of analyzing them')
+    parser.add_argument('--blank_ink',
+                       type=float,
+                       default=BLANK_INK,
+                       help='Ink coverage below which a page counts as blank (default: %(default)s)')
+    parser.add_argument('--pack_pages',
+                       type=int,
+                       default=1,
+                       help='Maximum page images of one document per request; 1 sends every page alone (default: %(default)s)')
+    parser.add_argument('--pack_tokens',
+                       type=int,
+                       default=PACK_TOKENS,
+                       help='Maximum estimated prompt tokens of a request for several pages (default: %(default)s)')
     
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
     
     print(f"Processing content from: {args.input_dir}")
     print(f"Saving results to: {args.output_dir}")
     print(f"Maximum concurrent tasks: {args.max_tasks}")
     
-    system_prompt = """You're a helpful assistant that can extract detailed information from the input text and images.
-You will be provided with:
-1. The parsed text from the entire PDF document
-2. A specific image of one page from the PDF document
-
-Your task is to extract the information from the image and combine it with the corresponding part of the parsed text, especially if any information is missing from the text. Your output should be focused on capturing the complete information contained in the page image in detail, in raw text form.
-
-Make sure your response is comprehensive enough that a chinese reader would fully understand the content of the page even without seeing the original document.
-
-**Output Requirements:**
-- The output must be in JSON format, structured as follows:
-  
-  ```json
-  {
-    "page{n}_text": "Extracted information from the image combined with the parsed text for page n. The text should be complete enough for readers to understand the content."
-  }
-
-"""
-    
     # Initialize MultiModel (you'll need to add your API key here)
-    model = MultiModel()
+    limiter = None
+    if args.adaptive and not args.batch_dir:
+        limiter = AdaptiveLimiter(initial_limit=min(10, args.max_tasks), max_limit=args.max_tasks,
+                                  tokens_per_minute=args.tpm)
+        print(f"Adaptive concurrency: {limiter.status()}")
+    model = MultiModel(limiter)
     
     # Create list to store all tasks
-    all_tasks = []
+    all_tasks = collect_tasks(args.input_dir, args.output_dir)
     error_count = 0
 
-    # Iterate through numbered directories
-    for dir_name in os.listdir(args.input_dir):
-        dir_path = os.path.join(args.input_dir, dir_name)
-        if not os.path.isdir(dir_path):
-            continue
-            
-        # Find text file and check for images/tables
-        files = os.listdir(dir_path)
-        has_pic = any(f.startswith('hasPic') for f in files)
-        has_table = any(f.startswith('hasTable') for f in files)
+    # Skip blank pages and reuse the result of identical pages
+    page_filter = None
+    duplicates = []
+    if args.page_filter:
+        page_filter = PageFilter(args.blank_ink)
+        all_tasks, duplicates = filter_tasks(all_tasks, page_filter)
+        print(page_filter.summary())
 
-        # Find the text file
-        text_file = next((f for f in files if f.endswith('.txt')), None)
-        if not text_file:
-            print(f"No text file found in {dir_path}")
-            continue
+    # Send several pages of a document per request
+    if args.pack_pages > 1:
+        page_tasks = all_tasks
+        all_tasks = pack_tasks(page_tasks, args.pack_pages, args.pack_tokens)
+        print(packing_summary(page_tasks, all_tasks))
 
-        # Read text content
-        with open(os.path.join(dir_path, text_file), 'r', encoding='utf-8') as f:
-            text_content = f.read()
+    processing_start = time.perf_counter()
+    if args.batch_dir:
+        session = BatchSession(model.client, args.batch_dir, args.poll_interval, args.batch_attempts)
+        error_count = run_batch(model, all_tasks, session)
+    else:
+        # Process tasks with the specified concurrent task limit
+        max_concurrent_tasks = args.max_tasks
+        error_count = 0
+        total_tasks = len(all_tasks)
+        task_index = 0
 
-        # Process each image individually if pictures are present
-        if has_pic:
-            image_files = [f for f in files if f.endswith('.png')]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_tasks) as executor:
+            futures = {}  # Dictionary to map futures to tasks
 
-            for idx, image_file in enumerate(image_files, 1):
-                image_path = os.path.join(dir_path, image_file)
+            while task_index < total_tasks or futures:
+                # Submit new tasks if we have less than 100 running and there are tasks left
+                while len(futures) < max_concurrent_tasks and task_index < total_tasks:
+                    task = all_tasks[task_index]
+                    future = executor.submit(process_task, task)
+                    futures[future] = task
+                    task_index += 1
+                    print(f"Submitted task {task_index}/{total_tasks}: {task['output_path']}")
 
-                # Add task for each image
-                all_tasks.append({
-                    'text': text_content,
-                    'image_paths': [image_path],
-                    'prompt': system_prompt,
-                    'output_path': os.path.join(args.output_dir, f"{dir_name}_image{idx}_result.json")
-                })
+                # Wait for any future to complete
+                done, _ = concurrent.futures.wait(futures.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
 
-        else:
-            # Add text-only task
-            all_tasks.append({
-                'text': text_content,
-                'image_paths': None,
-                'prompt': system_prompt,
-                'output_path': os.path.join(args.output_dir, f"{dir_name}_result.json")
-            })
+                # Remove completed futures and update error count
+                for future in done:
+                    task = futures.pop(future)
+                    result = future.result()
+                    if not result:
+                        error_count += 1
+                    print(f"Completed task: {task['output_path']}"
+                          + (f" [{limiter.status()}]" if limiter else ""))
 
-        print(f"Prepared tasks for directory {dir_name}")
+            # Ensure all futures are done
+            concurrent.futures.wait(futures.keys())
 
-    # Process tasks with the specified concurrent task limit
-    max_concurrent_tasks = args.max_tasks
-    error_count = 0
-    total_tasks = len(all_tasks)
-    task_index = 0
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_tasks) as executor:
-        futures = {}  # Dictionary to map futures to tasks
-
-        while task_index < total_tasks or futures:
-            # Submit new tasks if we have less than 100 running and there are tasks left
-            while len(futures) < max_concurrent_tasks and task_index < total_tasks:
-                task = all_tasks[task_index]
-                future = executor.submit(process_task, task)
-                futures[future] = task
-                task_index += 1
-                print(f"Submitted task {task_index}/{total_tasks}: {task['output_path']}")
-
-            # Wait for any future to complete
-            done, _ = concurrent.futures.wait(futures.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
-
-            # Remove completed futures and update error count
-            for future in done:
-                task = futures.pop(future)
-                result = future.result()
-                if not result:
-                    error_count += 1
-                print(f"Completed task: {task['output_path']}")
-
-        # Ensure all futures are done
-        concurrent.futures.wait(futures.keys())
+    # Duplicates copy their representative's result once it exists
+    if duplicates:
+        error_count += write_duplicate_results(duplicates)
+    if page_filter:
+        print(page_filter.summary())
 
     # Print total number of errors encountered
-    print(f"Total number of errors: {error_count}")
\ No newline at end of file
+    print(f"Total number of errors: {error_count}")
+    print(f"Vision requests: {model.usage['requests']}, prompt tokens: {model.usage['prompt_tokens']}, "
+          f"completion tokens: {model.usage['completion_tokens']}, "
+          f"processing time: {time.perf_counter() - processing_start:.1f}s")
+    if limiter:
+        print(f"API requests: {limiter.requests}, rate-limited: {limiter.rate_limited}, "
+              f"retries: {limiter.retries}, final {limiter.status()}")
\ No newline at end of file
@@ -1,6 +1,12 @@
 import fitz  # PyMuPDF
 import os
+import sys
 import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+import tracing
+from tracing import span
 
 def has_images(pdf_path):
     """
@@ -13,17 +19,19 @@ def has_images(pdf_path):
         bool: True if PDF contains images, False otherwise
     """
     try:
-        
-        doc = fitz.open(pdf_path)
-        
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            if page.get_images():
-                doc.close()
-                return True
-                
-        doc.close()
-        return False
+        with span('has_images', pdf=os.path.basename(pdf_path)) as pdf_span:
+            doc = fitz.open(pdf_path)
+            
+            for page_num in range(doc.page_count):
+                page = doc[page_num]
+                if page.get_images():
+                    doc.close()
+                    pdf_span.set(pages_checked=page_num + 1, result=True)
+                    return True
+                    
+            pdf_span.set(pages_checked=doc.page_count, result=False)
+            doc.close()
+            return False
         
     except Exception as e:
         print(f"Error checking for images: {str(e)}")
@@ -40,32 +48,37 @@ def has_tables(pdf_path):
         bool: True if PDF contains tables, False otherwise
     """
     try:
-        doc = fitz.open(pdf_path)
+        pdf_name = os.path.basename(pdf_path)
+        with span('has_tables', pdf=pdf_name) as pdf_span:
+            doc = fitz.open(pdf_path)
         
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            # Check for tables using text analysis
-            # Look for consistent vertical alignment and multiple columns
-            words = page.get_text("words")
-            if len(words) > 0:
-                # Group words by their vertical position
-                y_positions = {}
-                for word in words:
-                    y_pos = round(word[3])  # bottom y-coordinate
-                    if y_pos in y_positions:
-                        y_positions[y_pos] += 1
-                    else:
-                        y_positions[y_pos] = 1
+            for page_num in range(doc.page_count):
+                page = doc[page_num]
+                # Check for tables using text analysis
+                # Look for consistent vertical alignment and multiple columns
+                with span('has_tables.words', pdf=pdf_name, page=page_num + 1):
+                    words = page.get_text("words")
+                if len(words) > 0:
+                    # Group words by their vertical position
+                    y_positions = {}
+                    for word in words:
+                        y_pos = round(word[3])  # bottom y-coordinate
+                        if y_pos in y_positions:
+                            y_positions[y_pos] += 1
+                        else:
+                            y_positions[y_pos] = 1
                 
-                # If we have multiple words aligned on the same y-position
-                # it might indicate a table
-                for count in y_positions.values():
-                    if count >= 3:  # At least 3 words aligned horizontally
-                        doc.close()
-                        return True
+                    # If we have multiple words aligned on the same y-position
+                    # it might indicate a table
+                    for count in y_positions.values():
+                        if count >= 3:  # At least 3 words aligned horizontally
+                            doc.close()
+                            pdf_span.set(pages_checked=page_num + 1, result=True)
+                            return True
         
-        doc.close()
-        return False
+            pdf_span.set(pages_checked=doc.page_count, result=False)
+            doc.close()
+            return False
         
     except Exception as e:
         print(f"Error checking for tables: {str(e)}")
@@ -82,7 +95,7 @@ if __name__ == "__main__":
         - hasTable/noTable: Indicates presence of tables
     
     Usage:
-        python MultiTypeTag.py --input_dir /path/to/pdfs --output_dir /path/to/output
+        python MultiTypeTag.py --input_dir /path/to/pdfs --output_dir /path/to/output [--trace ./trace/tag.json]
     """
     
     # Set up argument parser
@@ -95,8 +108,14 @@ if __name__ == "__main__":
                        type=str,
                        default="./reference/test_extracted",
                        help='Directory where marker files will be saved')
+    parser.add_argument('--trace',
+                       type=str,
+                       default=None,
+                       help='Write per-PDF and per-page timings to this Chrome trace / Perfetto JSON file (default: disabled)')
     
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
     
     print(f"Analyzing PDFs from: {args.input_dir}")
     print(f"Saving markers to: {args.output_dir}")
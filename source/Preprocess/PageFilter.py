@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import fitz  # PyMuPDF
+import numpy as np
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+from tracing import span
+
+# Pages are compared at 1/4 of the rendered size (zoom 4 -> 72 dpi)
+SHRINK_FACTOR = 2
+
+# A pixel darker than INK_LEVEL is ink; a page with less than BLANK_INK ink is blank.
+# A page number or "此頁空白" covers about 0.01-0.05% of a page, one line of title text about 0.5%.
+INK_LEVEL = 200
+BLANK_INK = 0.001
+
+# Perceptual hash grid: HASH_SIZE x HASH_SIZE horizontal gradient bits
+HASH_SIZE = 16
+
+# Grey levels kept by the content digest that confirms a duplicate
+DIGEST_SHIFT = 4
+
+def page_thumbnail(image_path):
+    """
+    Load a rendered page as a grayscale array at 1/(2^SHRINK_FACTOR) of its size
+
+    Args:
+        image_path: Path to a page image written by ExtractPDF.render_page_images
+
+    Returns:
+        np.ndarray: uint8 array of shape (height, width), 255 is white
+    """
+    pix = fitz.Pixmap(image_path)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n != 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    pix.shrink(SHRINK_FACTOR)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def ink_coverage(thumbnail):
+    """
+    Fraction of the page covered by ink
+    """
+    return float(np.count_nonzero(thumbnail < INK_LEVEL)) / thumbnail.size
+
+def difference_hash(thumbnail):
+    """
+    Perceptual difference hash (dHash) of a page
+
+    The page is averaged into HASH_SIZE rows of HASH_SIZE + 1 cells, and each bit
+    tells whether a cell is brighter than its left neighbour. Renderings of the same
+    page get the same hash, while pages with another layout differ in many bits.
+
+    Args:
+        thumbnail: Grayscale page from page_thumbnail
+
+    Returns:
+        bytes: HASH_SIZE * HASH_SIZE bits
+    """
+    height, width = thumbnail.shape
+    rows = np.linspace(0, height, HASH_SIZE + 1).astype(int)[:-1]
+    cols = np.linspace(0, width, HASH_SIZE + 2).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(thumbnail.astype(np.float64), rows, axis=0), cols, axis=1)
+    sizes = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+    cells = sums / sizes
+    return np.packbits(cells[:, 1:] > cells[:, :-1]).tobytes()
+
+def content_digest(thumbnail):
+    """
+    Digest of the page content at 16 grey levels, confirming that two pages with the same hash are identical
+    """
+    digest = hashlib.sha1(str(thumbnail.shape).encode())
+    digest.update(np.ascontiguousarray(thumbnail >> DIGEST_SHIFT).tobytes())
+    return digest.hexdigest()
+
+class PageFilter:
+    def __init__(self, blank_ink=BLANK_INK, skip_blank=True, skip_duplicates=True):
+        """
+        Decide which rendered pages need a vision call
+
+        Pages are checked in the order they are given. A page is blank if its ink
+        coverage is below blank_ink. A page is a duplicate if an earlier page, in the
+        same PDF or another one, has the same perceptual hash and the same content
+        digest; only pages that render identically at 1/4 size are merged, so pages
+        differing in a single figure are both analyzed.
+
+        Args:
+            blank_ink: Ink coverage below which a page counts as blank
+            skip_blank: Skip blank pages
+            skip_duplicates: Reuse the result of identical pages
+        """
+        self.blank_ink = blank_ink
+        self.skip_blank = skip_blank
+        self.skip_duplicates = skip_duplicates
+        self.representatives = {}   # (hash, digest) -> key of the first page with that content
+        self.hashes = set()         # Hashes seen, to count similar pages that were still analyzed
+        self.pages = 0
+        self.blank = 0
+        self.duplicate = 0
+        self.similar = 0
+
+    def classify(self, image_path, key=None):
+        """
+        Classify one page and remember it as the representative of its content if it is new
+
+        Args:
+            image_path: Path to the page image
+            key: Value returned for later duplicates of this page (default: image_path),
+                 e.g. the path of the page's result file
+
+        Returns:
+            tuple: ('blank', None), ('duplicate', key of the earlier page) or ('unique', None)
+        """
+        self.pages += 1
+        with span('page_filter', image=os.path.basename(image_path)) as filter_span:
+            thumbnail = page_thumbnail(image_path)
+            if self.skip_blank and ink_coverage(thumbnail) < self.blank_ink:
+                self.blank += 1
+                filter_span.set(result='blank')
+                return 'blank', None
+            if not self.skip_duplicates:
+                return 'unique', None
+            page_hash = difference_hash(thumbnail)
+            content = (page_hash, content_digest(thumbnail))
+            if content in self.representatives:
+                self.duplicate += 1
+                filter_span.set(result='duplicate')
+                return 'duplicate', self.representatives[content]
+            if page_hash in self.hashes:
+                self.similar += 1
+            self.hashes.add(page_hash)
+            self.representatives[content] = image_path if key is None else key
+            return 'unique', None
+
+    def summary(self):
+        """
+        Describe the vision calls saved, e.g. for the end of a run
+        """
+        saved = self.blank + self.duplicate
+        return (f"Vision calls saved: {saved} of {self.pages} pages "
+                f"({self.blank} blank, {self.duplicate} duplicate; "
+                f"{self.similar} similar but different pages still analyzed)")
+
+def write_blank_result(output_path):
+    """
+    Save the result of a skipped blank page
+
+    The result has no 'response', so makeDict.py leaves the page out of the combined responses.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"success": True, "skipped": "blank"}, f, indent=2, ensure_ascii=False)
+
+def write_duplicate_result(output_path, representative_path):
+    """
+    Save the result of a duplicate page as a copy of its representative's result
+
+    Args:
+        output_path: Result file of the duplicate page
+        representative_path: Result file of the earlier, analyzed page
+
+    Returns:
+        bool: True if the representative's result was copied, False if it is missing
+    """
+    try:
+        with open(representative_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Cannot reuse {representative_path} for {output_path}: {e}")
+        return False
+    result.pop('usage', None)
+    result['duplicate_of'] = os.path.basename(representative_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    return True
+
+def filter_tasks(tasks, page_filter):
+    """
+    Split vision tasks into the ones to run and the ones to skip
+
+    Blank pages get their result right away. Duplicates are returned with the
+    task whose result they reuse, to be written by write_duplicate_results once
+    those tasks have run. Text-only and multi-image tasks are always run.
+
+    Args:
+        tasks: Task dicts with 'image_paths' and 'output_path', as built by MultiModel.py
+        page_filter: PageFilter instance
+
+    Returns:
+        tuple: (tasks to run, list of (duplicate task, representative result path))
+    """
+    run_tasks = []
+    duplicates = []
+    for task in tasks:
+        if not task['image_paths'] or len(task['image_paths']) != 1:
+            run_tasks.append(task)
+            continue
+        try:
+            kind, representative = page_filter.classify(task['image_paths'][0], task['output_path'])
+        except Exception as e:
+            print(f"Cannot check page {task['image_paths'][0]}, analyzing it: {e}")
+            run_tasks.append(task)
+            continue
+        if kind == 'blank':
+            write_blank_result(task['output_path'])
+        elif kind == 'duplicate':
+            duplicates.append((task, representative))
+        else:
+            run_tasks.append(task)
+    return run_tasks, duplicates
+
+def write_duplicate_results(duplicates):
+    """
+    Write the results of duplicate pages after their representatives have been analyzed
+
+    Returns:
+        int: Number of duplicates whose representative result was missing
+    """
+    missing = 0
+    for task, representative in duplicates:
+        if not write_duplicate_result(task['output_path'], representative):
+            missing += 1
+    return missing
+
+if __name__ == "__main__":
+    """
+    Main entry point for checking blank and duplicate pages without calling the API.
+
+    Scans the page images of an extraction directory (written by ExtractPDF.py)
+    and reports which pages MultiModel.py --page_filter would skip.
+
+    Usage:
+        python PageFilter.py --input_dir ./reference/finance_extracted [--blank_ink 0.001] [--list]
+    """
+    parser = argparse.ArgumentParser(description='Report blank and duplicate page images.')
+    parser.add_argument('--input_dir',
+                       type=str,
+                       default="./reference/test_extracted/",
+                       help='Directory containing extracted PDF content (default: %(default)s)')
+    parser.add_argument('--blank_ink',
+                       type=float,
+                       default=BLANK_INK,
+                       help='Ink coverage below which a page counts as blank (default: %(default)s)')
+    parser.add_argument('--list',
+                       action='store_true',
+                       help='Print every skipped page')
+
+    args = parser.parse_args()
+
+    page_filter = PageFilter(args.blank_ink)
+    for dir_name in sorted(os.listdir(args.input_dir)):
+        dir_path = os.path.join(args.input_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            continue
+        for image_file in sorted(f for f in os.listdir(dir_path) if f.endswith('.png')):
+            image_path = os.path.join(dir_path, image_file)
+            kind, representative = page_filter.classify(image_path)
+            if args.list and kind != 'unique':
+                print(f"{image_path}: {kind}" + (f" of {representative}" if representative else ""))
+
+    print(page_filter.summary())
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import logging
+import argparse
+import concurrent.futures
+from MultiModel import MultiModel, MAX_TOKENS, collect_tasks, AdaptiveLimiter
+from makeDict import RESULT_PROBLEMS, check_result, check_result_file
+from PageFilter import write_duplicate_result
+
+# Problems whose result holds no response worth keeping if the repair fails too
+NO_RESPONSE = ('missing', 'unreadable', 'failed', 'empty')
+
+def find_repairs(tasks):
+    """
+    Find the tasks whose result file is missing or unusable
+
+    Args:
+        tasks: Task dicts as built by MultiModel.collect_tasks
+
+    Returns:
+        list: (task, problem) pairs, where problem is 'missing' or one of makeDict.RESULT_PROBLEMS
+    """
+    repairs = []
+    for task in tasks:
+        if not os.path.exists(task['output_path']):
+            repairs.append((task, 'missing'))
+        else:
+            problem = check_result_file(task['output_path'])
+            if problem:
+                repairs.append((task, problem))
+    return repairs
+
+def representative_of(output_path):
+    """
+    Returns:
+        str: Result file whose copy the result is (see PageFilter.py), or None
+    """
+    try:
+        with open(output_path, 'r', encoding='utf-8') as f:
+            duplicate_of = json.load(f).get('duplicate_of')
+    except (OSError, ValueError, AttributeError):
+        return None
+    return os.path.join(os.path.dirname(output_path), duplicate_of) if duplicate_of else None
+
+def repair_task(multi_model, task, problem, truncated_max_tokens=2 * MAX_TOKENS):
+    """
+    Analyze a page again and save the result if it is usable
+
+    A copy of a duplicate page's result is copied again once its representative
+    is usable. Truncated pages get `truncated_max_tokens` completion tokens.
+    If the new result is unusable as well, it only replaces results without a
+    response, so a truncated or malformed response is never lost.
+
+    Args:
+        multi_model: MultiModel instance used for the request
+        task: Task dict as in MultiModel.run_task
+        problem: Problem of the current result, as returned by find_repairs
+        truncated_max_tokens: Completion token budget for truncated pages
+
+    Returns:
+        str: None if the page is repaired, otherwise the problem of the new result
+    """
+    output_path = task['output_path']
+    try:
+        representative = representative_of(output_path)
+        if representative and check_result_file(representative) is None:
+            write_duplicate_result(output_path, representative)
+            return check_result_file(output_path)
+
+        result = multi_model.analyze_content(
+            text=task['text'],
+            image_paths=task['image_paths'],
+            prompt=task['prompt'],
+            max_tokens=truncated_max_tokens if problem == 'truncated' else MAX_TOKENS
+        )
+        new_problem = check_result(result)
+        if new_problem is None or problem in NO_RESPONSE:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+        return new_problem
+    except Exception as e:
+        error_message = f"Error repairing {output_path}: {e}"
+        print(error_message)
+        logging.error(error_message)
+        return problem
+
+def count_problems(repairs):
+    """Summarize (task, problem) pairs as e.g. '3 failed, 1 truncated'"""
+    problems = [problem for _, problem in repairs]
+    return ", ".join(f"{problems.count(problem)} {problem}"
+                     for problem in ('missing',) + RESULT_PROBLEMS if problem in problems)
+
+def repair_pages(multi_model, tasks, max_tasks=20, attempts=3, retry_delay=5.0,
+                 truncated_max_tokens=2 * MAX_TOKENS):
+    """
+    Analyze the pages with missing or unusable results again, in rounds
+
+    Each round repairs the remaining pages concurrently. Copies of duplicate
+    pages wait until the pages they copy have been repaired in the same round.
+    Pages still unusable after a round are retried after `retry_delay` seconds,
+    doubling with every round, up to `attempts` rounds.
+
+    Args:
+        multi_model: MultiModel instance used for the requests
+        tasks: All task dicts of the result directory
+        max_tasks: Maximum number of concurrent requests
+        attempts: Rounds before giving up on a page
+        retry_delay: Seconds before the second round
+        truncated_max_tokens: Completion token budget for truncated pages
+
+    Returns:
+        tuple: (pages found unusable, (task, problem) pairs still unusable)
+    """
+    repairs = find_repairs(tasks)
+    found = len(repairs)
+    for attempt in range(1, attempts + 1):
+        if not repairs:
+            break
+        if attempt > 1:
+            delay = retry_delay * 2 ** (attempt - 2)
+            print(f"Retrying {len(repairs)} pages in {delay:.0f}s")
+            time.sleep(delay)
+
+        repaired_paths = {task['output_path'] for task, _ in repairs}
+        copies, primaries = [], []
+        for task, problem in repairs:
+            is_copy = representative_of(task['output_path']) in repaired_paths
+            (copies if is_copy else primaries).append((task, problem))
+
+        remaining = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_tasks) as executor:
+            for group in (primaries, copies):
+                futures = {executor.submit(repair_task, multi_model, task, problem, truncated_max_tokens): (task, problem)
+                           for task, problem in group}
+                for future in concurrent.futures.as_completed(futures):
+                    task, problem = futures[future]
+                    new_problem = future.result()
+                    if new_problem:
+                        # Retry from the state of the saved result, which a failed repair may have kept
+                        saved_problem = check_result_file(task['output_path']) \
+                            if os.path.exists(task['output_path']) else 'missing'
+                        remaining.append((task, saved_problem or new_problem))
+                        print(f"Still unusable ({new_problem}): {task['output_path']}")
+                    else:
+                        print(f"Repaired ({problem}): {task['output_path']}")
+        print(f"Round {attempt}: repaired {len(repairs) - len(remaining)} of {len(repairs)} pages")
+        repairs = remaining
+    return found, repairs
+
+def document_of(output_path):
+    """Document number of a result file, e.g. '12' for 12_image3_result.json"""
+    return os.path.basename(output_path).split('_')[0]
+
+if __name__ == "__main__":
+    """
+    Main entry point for repairing vision results.
+
+    Rebuilds the task list of an extraction directory like MultiModel.py, finds
+    the pages whose result file is missing, failed, empty, truncated or not a
+    JSON object with text, and analyzes only those again. All other results are
+    left untouched, so an interrupted or partly failed run is completed without
+    redoing the whole corpus.
+
+    Usage:
+        python RepairPages.py --input_dir ./reference/finance_extracted --output_dir ./reference/finance_output
+                              [--numbering index|page] [--check] [--max_tasks 20] [--attempts 3]
+                              [--retry_delay 5] [--truncated_max_tokens 8192] [--adaptive [--tpm 30000]]
+    """
+    parser = argparse.ArgumentParser(description='Analyze missing, failed or malformed page results again.')
+    parser.add_argument('--input_dir',
+                       type=str,
+                       default="./reference/test_extracted/",
+                       help='Directory containing extracted PDF content (default: %(default)s)')
+    parser.add_argument('--output_dir',
+                       type=str,
+                       default="./reference/test_output/",
+                       help='Directory containing the result files to check (default: %(default)s)')
+    parser.add_argument('--numbering',
+                       type=str,
+                       choices=['index', 'page'],
+                       default='index',
+                       help='Page numbering of the result files: index for MultiModel.py, page for '
+                            'StreamPipeline.py (default: %(default)s)')
+    parser.add_argument('--check',
+                       action='store_true',
+                       help='Only report the unusable results, without calling the API')
+    parser.add_argument('--max_tasks',
+                       type=int,
+                       default=20,
+                       help='Maximum number of concurrent requests (default: %(default)s)')
+    parser.add_argument('--attempts',
+                       type=int,
+                       default=3,
+                       help='Rounds of repairs before giving up on a page (default: %(default)s)')
+    parser.add_argument('--retry_delay',
+                       type=float,
+                       default=5,
+                       help='Seconds before the second round, doubling with every round (default: %(default)s)')
+    parser.add_argument('--truncated_max_tokens',
+                       type=int,
+                       default=2 * MAX_TOKENS,
+                       help='Completion token budget for pages whose response was truncated (default: %(default)s)')
+    parser.add_argument('--adaptive',
+                       action='store_true',
+                       help='Adapt the number of concurrent requests to rate limits, up to --max_tasks')
+    parser.add_argument('--tpm',
+                       type=int,
+                       default=None,
+                       help='Starting tokens-per-minute budget with --adaptive (default: no token limit)')
+
+    args = parser.parse_args()
+
+    tasks = collect_tasks(args.input_dir, args.output_dir, args.numbering, verbose=False)
+    documents = {document_of(task['output_path']) for task in tasks}
+    print(f"Checking {len(tasks)} page results of {len(documents)} documents in {args.output_dir}")
+
+    if args.check:
+        repairs = find_repairs(tasks)
+        for task, problem in repairs:
+            print(f"Unusable ({problem}): {task['output_path']}")
+        print(f"Unusable page results: {len(repairs)} of {len(tasks)}"
+              + (f" ({count_problems(repairs)})" if repairs else ""))
+        raise SystemExit(1 if repairs else 0)
+
+    limiter = None
+    if args.adaptive:
+        limiter = AdaptiveLimiter(initial_limit=min(10, args.max_tasks), max_limit=args.max_tasks,
+                                  tokens_per_minute=args.tpm)
+    model = MultiModel(limiter)
+
+    start = time.perf_counter()
+    found, remaining = repair_pages(model, tasks, args.max_tasks, args.attempts, args.retry_delay,
+                                    args.truncated_max_tokens)
+    incomplete = {document_of(task['output_path']) for task, _ in remaining}
+    print(f"\nUnusable page results: {found} of {len(tasks)}, repaired: {found - len(remaining)}, "
+          f"still unusable: {len(remaining)}" + (f" ({count_problems(remaining)})" if remaining else "")
+          + f", time: {time.perf_counter() - start:.1f}s")
+    print(f"Complete documents: {len(documents) - len(incomplete)} of {len(documents)}")
+    for task, problem in remaining:
+        print(f"Still unusable ({problem}): {task['output_path']}")
+    if limiter:
+        print(f"API requests: {limiter.requests}, rate-limited: {limiter.rate_limited}, "
+              f"retries: {limiter.retries}, final {limiter.status()}")
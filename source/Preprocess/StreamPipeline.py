@@ -0,0 +1,306 @@
+import os
+import time
+import queue
+import logging
+import argparse
+import threading
+from ExtractPDF import TEXT_BACKENDS, extract_pdf_text, render_page_images
+from MultiTypeTag import has_images, has_tables
+from MultiModel import MultiModel, SYSTEM_PROMPT, run_task, AdaptiveLimiter, tracing, span
+from PageFilter import BLANK_INK, PageFilter, write_blank_result, write_duplicate_results
+
+def write_markers(pdf_output_dir, has_img, has_tbl):
+    """
+    Create the hasPic/noPic and hasTable/noTable marker files written by MultiTypeTag.py
+
+    Args:
+        pdf_output_dir: Extraction directory of one PDF
+        has_img: Whether the PDF contains images
+        has_tbl: Whether the PDF contains tables
+    """
+    for marker in ("hasPic" if has_img else "noPic", "hasTable" if has_tbl else "noTable"):
+        with open(os.path.join(pdf_output_dir, marker), "w") as f:
+            pass
+
+class PipelineStats:
+    def __init__(self):
+        """Counters shared by the producer and the vision workers"""
+        self.lock = threading.Lock()
+        self.pdfs = 0
+        self.extract_errors = 0
+        self.tasks_done = 0
+        self.task_errors = 0
+        self.extract_seconds = 0.0   # Producer time spent extracting, tagging and rendering
+        self.blocked_seconds = 0.0   # Producer time spent waiting for room in the queue
+        self.api_seconds = 0.0       # Sum of the vision call durations over all workers
+
+    def add(self, **values):
+        """Add to one or more counters atomically"""
+        with self.lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+def put_task(task_queue, task, stats):
+    """
+    Put a task on the queue, blocking while it is full so that rendering never runs ahead of the workers
+    """
+    start = time.perf_counter()
+    with span('queue_wait'):
+        task_queue.put(task)
+    stats.add(blocked_seconds=time.perf_counter() - start)
+
+def produce_tasks(input_dir, extract_dir, output_dir, task_queue, stats, text_backend='pdfplumber',
+                  page_filter=None, duplicates=None, discard_images=False):
+    """
+    Extract, tag and render each PDF and queue its vision tasks as soon as they exist
+
+    Text and marker files are written exactly as ExtractPDF.py and MultiTypeTag.py
+    write them. The whole-document text is needed by every page task, so a PDF's
+    pages are queued once its text has been extracted. Pages are rendered one at
+    a time, and only for PDFs that contain pictures, since only those get image tasks.
+
+    Args:
+        input_dir: Directory containing PDF files
+        extract_dir: Directory for the extracted text, markers and page images
+        output_dir: Directory for the vision results
+        task_queue: Bounded queue shared with the vision workers
+        stats: PipelineStats to update
+        text_backend: Text extraction backend, see ExtractPDF.extract_pdf_text
+        page_filter: Optional PageFilter; blank pages get their result right away and
+                     duplicates are appended to duplicates instead of being queued
+        duplicates: List collecting (duplicate task, representative result path)
+        discard_images: Delete the images of skipped pages
+    """
+    pdf_files = sorted(f for f in os.listdir(input_dir) if f.endswith('.pdf'))
+    for pdf_file in pdf_files:
+        pdf_path = os.path.join(input_dir, pdf_file)
+        pdf_name = os.path.splitext(pdf_file)[0]
+        pdf_output_dir = os.path.join(extract_dir, pdf_name)
+        os.makedirs(pdf_output_dir, exist_ok=True)
+
+        start = time.perf_counter()
+        with span('produce_pdf', pdf=pdf_file):
+            try:
+                has_img = has_images(pdf_path)
+                has_tbl = has_tables(pdf_path)
+                write_markers(pdf_output_dir, has_img, has_tbl)
+
+                text_content = extract_pdf_text(pdf_path, text_backend,
+                                                os.path.join(pdf_output_dir, f'{pdf_name}_pages.jsonl'))
+                with open(os.path.join(pdf_output_dir, f'{pdf_name}_text.txt'), 'w', encoding='utf-8') as f:
+                    f.write(text_content)
+                stats.add(extract_seconds=time.perf_counter() - start)
+
+                if not has_img:
+                    put_task(task_queue, {
+                        'text': text_content,
+                        'image_paths': None,
+                        'prompt': SYSTEM_PROMPT,
+                        'output_path': os.path.join(output_dir, f"{pdf_name}_result.json")
+                    }, stats)
+                else:
+                    pages = render_page_images(pdf_path, pdf_output_dir, pdf_name)
+                    while True:
+                        start = time.perf_counter()
+                        page = next(pages, None)
+                        stats.add(extract_seconds=time.perf_counter() - start)
+                        if page is None:
+                            break
+                        page_num, image_path = page
+                        task = {
+                            'text': text_content,
+                            'image_paths': [image_path],
+                            'prompt': SYSTEM_PROMPT,
+                            'output_path': os.path.join(output_dir, f"{pdf_name}_image{page_num}_result.json")
+                        }
+                        if page_filter:
+                            start = time.perf_counter()
+                            kind, representative = page_filter.classify(image_path, task['output_path'])
+                            stats.add(extract_seconds=time.perf_counter() - start)
+                            if kind != 'unique':
+                                if kind == 'blank':
+                                    write_blank_result(task['output_path'])
+                                else:
+                                    duplicates.append((task, representative))
+                                if discard_images:
+                                    os.remove(image_path)
+                                continue
+                        put_task(task_queue, task, stats)
+                stats.add(pdfs=1)
+                print(f"Queued {pdf_file}: Images: {'Yes' if has_img else 'No'}, Tables: {'Yes' if has_tbl else 'No'}")
+            except Exception as e:
+                stats.add(extract_errors=1, extract_seconds=time.perf_counter() - start)
+                error_message = f"Error extracting {pdf_file}: {e}"
+                print(error_message)
+                logging.error(error_message)
+
+def consume_tasks(multi_model, task_queue, stats, discard_images):
+    """
+    Vision worker: analyze queued tasks until a None sentinel arrives
+
+    Args:
+        multi_model: MultiModel instance used for the requests
+        task_queue: Queue filled by produce_tasks
+        stats: PipelineStats to update
+        discard_images: Delete each page image once its result is saved
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        start = time.perf_counter()
+        success = run_task(multi_model, task)
+        stats.add(api_seconds=time.perf_counter() - start, tasks_done=1, task_errors=0 if success else 1)
+        if success and discard_images and task['image_paths']:
+            for image_path in task['image_paths']:
+                os.remove(image_path)
+        limiter = multi_model.limiter
+        print(f"Completed task: {task['output_path']}" + (f" [{limiter.status()}]" if limiter else ""))
+
+def run_pipeline(input_dir, extract_dir, output_dir, max_tasks=100, queue_size=None,
+                 discard_images=False, multi_model=None, text_backend='pdfplumber', page_filter=None):
+    """
+    Run extraction and vision analysis concurrently
+
+    The producer (extraction, tagging, rendering) runs in the calling thread and
+    max_tasks workers make the vision calls. The queue holds at most queue_size
+    tasks, so at most queue_size + max_tasks rendered pages exist at any time.
+
+    Args:
+        input_dir: Directory containing PDF files
+        extract_dir: Directory for the extracted text, markers and page images
+        output_dir: Directory for the vision results
+        max_tasks: Number of concurrent vision workers
+        queue_size: Maximum number of queued tasks (default: max_tasks)
+        discard_images: Delete page images once analyzed to bound disk usage
+        multi_model: MultiModel instance (default: a new one)
+        text_backend: Text extraction backend, see ExtractPDF.extract_pdf_text
+        page_filter: Optional PageFilter to skip blank pages and reuse the results of identical pages
+
+    Returns:
+        PipelineStats: Counters and timings of the run
+    """
+    multi_model = multi_model or MultiModel()
+    task_queue = queue.Queue(maxsize=queue_size or max_tasks)
+    stats = PipelineStats()
+    duplicates = []
+
+    workers = [
+        threading.Thread(target=consume_tasks, args=(multi_model, task_queue, stats, discard_images),
+                         name=f"vision-worker-{i}", daemon=True)
+        for i in range(max_tasks)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        produce_tasks(input_dir, extract_dir, output_dir, task_queue, stats, text_backend,
+                      page_filter, duplicates, discard_images)
+    finally:
+        # One sentinel per worker; each worker stops after draining the tasks queued before it
+        for _ in workers:
+            task_queue.put(None)
+        for worker in workers:
+            worker.join()
+    # Duplicates copy their representative's result once all workers are done
+    stats.add(task_errors=write_duplicate_results(duplicates))
+    return stats
+
+if __name__ == "__main__":
+    """
+    Main entry point for the streaming preprocessing pipeline.
+
+    Runs ExtractPDF.py, MultiTypeTag.py and MultiModel.py as one streaming
+    pipeline: each page is sent to the vision model as soon as it is rendered,
+    while later PDFs are still being extracted. The outputs are the same files
+    the three scripts write, so makeDict.py and textandExtract.py follow as usual.
+
+    Usage:
+        python StreamPipeline.py --input_dir /path/to/pdfs --extract_dir /path/to/extracted
+                                 --output_dir /path/to/output [--max_tasks 100]
+                                 [--queue_size 100] [--discard_images] [--text_backend pymupdf]
+                                 [--adaptive [--tpm 30000]] [--trace ./trace/pipeline.json]
+                                 [--page_filter [--blank_ink 0.001]]
+    """
+    parser = argparse.ArgumentParser(description='Extract PDFs and analyze their pages with GPT-4o in one streaming pipeline.')
+    parser.add_argument('--input_dir',
+                       type=str,
+                       default="./reference/test",
+                       help='Directory containing PDF files to process (default: %(default)s)')
+    parser.add_argument('--extract_dir',
+                       type=str,
+                       default="./reference/test_extracted",
+                       help='Directory where extracted text, markers and page images will be saved (default: %(default)s)')
+    parser.add_argument('--output_dir',
+                       type=str,
+                       default="./reference/test_output/",
+                       help='Directory where analysis results will be saved (default: %(default)s)')
+    parser.add_argument('--max_tasks',
+                       type=int,
+                       default=100,
+                       help='Number of concurrent vision requests (default: %(default)s)')
+    parser.add_argument('--queue_size',
+                       type=int,
+                       default=None,
+                       help='Maximum number of rendered pages waiting for a worker (default: max_tasks)')
+    parser.add_argument('--discard_images',
+                       action='store_true',
+                       help='Delete each page image after its analysis is saved')
+    parser.add_argument('--text_backend',
+                       type=str,
+                       choices=TEXT_BACKENDS,
+                       default='pdfplumber',
+                       help='Text extraction backend (default: %(default)s)')
+    parser.add_argument('--adaptive',
+                       action='store_true',
+                       help='Adapt the number of concurrent vision requests to rate limits, up to --max_tasks')
+    parser.add_argument('--tpm',
+                       type=int,
+                       default=None,
+                       help='Starting tokens-per-minute budget with --adaptive (default: no token limit)')
+    parser.add_argument('--page_filter',
+                       action='store_true',
+                       help='Skip blank pages and reuse the result of identical pages instead of analyzing them')
+    parser.add_argument('--blank_ink',
+                       type=float,
+                       default=BLANK_INK,
+                       help='Ink coverage below which a page counts as blank (default: %(default)s)')
+    parser.add_argument('--trace',
+                       type=str,
+                       default=None,
+                       help='Write per-PDF, per-page and per-worker timings to this Chrome trace / Perfetto JSON file (default: disabled)')
+
+    args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+
+    print(f"Processing PDFs from: {args.input_dir}")
+    print(f"Saving extracted content to: {args.extract_dir}")
+    print(f"Saving results to: {args.output_dir}")
+    print(f"Vision workers: {args.max_tasks}, queue size: {args.queue_size or args.max_tasks}")
+
+    limiter = None
+    if args.adaptive:
+        limiter = AdaptiveLimiter(initial_limit=min(10, args.max_tasks), max_limit=args.max_tasks,
+                                  tokens_per_minute=args.tpm)
+        print(f"Adaptive concurrency: {limiter.status()}")
+
+    page_filter = PageFilter(args.blank_ink) if args.page_filter else None
+
+    start = time.perf_counter()
+    stats = run_pipeline(args.input_dir, args.extract_dir, args.output_dir, args.max_tasks,
+                         args.queue_size, args.discard_images, MultiModel(limiter), args.text_backend,
+                         page_filter)
+    wall_seconds = time.perf_counter() - start
+
+    print(f"\nProcessed {stats.pdfs} PDFs, {stats.tasks_done} vision tasks")
+    print(f"Extraction time: {stats.extract_seconds:.1f}s (waited {stats.blocked_seconds:.1f}s for the workers)")
+    print(f"Vision call time: {stats.api_seconds:.1f}s total, {stats.api_seconds / max(args.max_tasks, 1):.1f}s per worker")
+    print(f"Wall time: {wall_seconds:.1f}s")
+    print(f"Total errors: {stats.extract_errors + stats.task_errors} "
+          f"({stats.extract_errors} extraction, {stats.task_errors} vision)")
+    if page_filter:
+        print(page_filter.summary())
+    if limiter:
+        print(f"API requests: {limiter.requests}, rate-limited: {limiter.rate_limited}, "
+              f"retries: {limiter.retries}, final {limiter.status()}")
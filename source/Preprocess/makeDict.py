@@ -3,6 +3,91 @@ import json
 import re
 import argparse
 
+# Reasons why a page result cannot be used, as returned by check_result
+RESULT_PROBLEMS = ('unreadable', 'failed', 'empty', 'truncated', 'not_json', 'no_text')
+
+def has_text(value) -> bool:
+    """Whether a parsed response contains any non-empty string"""
+    if isinstance(value, str):
+        return bool(value.strip())
+    if isinstance(value, dict):
+        return any(has_text(item) for item in value.values())
+    if isinstance(value, list):
+        return any(has_text(item) for item in value)
+    return False
+
+def check_result(result) -> str:
+    """
+    Check a page result written by MultiModel.py or StreamPipeline.py.
+
+    Args:
+        result: Parsed content of the result file
+
+    Returns:
+        str: None if the result is usable, otherwise the problem:
+            'unreadable' if it is not a JSON object, 'failed' if the request failed,
+            'empty' if the response is missing or blank, 'truncated' if the model
+            stopped at the token limit or the response JSON ends early, 'not_json'
+            if the response is not a JSON object and 'no_text' if the object
+            contains no text. Skipped blank pages are usable.
+
+    Example:
+        check_result({"success": True, "response": '{"page1_text": "..."}'}) -> None
+        check_result({"success": False, "error": "Request timed out."}) -> 'failed'
+    """
+    if not isinstance(result, dict):
+        return 'unreadable'
+    if not result.get('success'):
+        return 'failed'
+    if 'skipped' in result:
+        return None
+    response = result.get('response')
+    if not isinstance(response, str) or not response.strip():
+        return 'empty'
+    if result.get('finish_reason') == 'length':
+        return 'truncated'
+    text = response.strip()
+    if text.startswith('```'):
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        # Running out of input inside the object means the model stopped early
+        ended_early = e.pos >= len(text) or e.msg.startswith('Unterminated string')
+        return 'truncated' if text.startswith('{') and ended_early else 'not_json'
+    if not isinstance(data, dict):
+        return 'not_json'
+    return None if has_text(data) else 'no_text'
+
+def check_result_file(path: str) -> str:
+    """
+    Returns:
+        str: check_result of the file, or 'unreadable' if it cannot be parsed
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return check_result(json.load(f))
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+        return 'unreadable'
+
+def check_results(directory: str) -> dict:
+    """
+    Check every page result of a result directory.
+
+    Args:
+        directory (str): Directory of result files written by MultiModel.py
+
+    Returns:
+        dict: File name -> problem (see check_result) for the unusable results
+    """
+    problems = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.json') and re.match(r'(\d+)_', filename):
+            problem = check_result_file(os.path.join(directory, filename))
+            if problem:
+                problems[filename] = problem
+    return problems
+
 def combine_json_files(directory: str, output_dir: str) -> dict:
     """
     Combines multiple JSON files with matching number prefixes into single files.
@@ -76,9 +161,11 @@ if __name__ == "__main__":
     For example, files like '1_xxx.json', '1_yyy.json' will be combined into '1.json'.
     
     Usage:
-        python makeDict.py --input_dir /path/to/input --output_dir /path/to/output
+        python makeDict.py --input_dir /path/to/input --output_dir /path/to/output [--strict]
     
     The output JSON files will contain all responses in a 'combined_responses' array.
+    Failed, empty, truncated and non-JSON page results are reported first; fix
+    them with RepairPages.py, or pass --strict to stop instead of combining.
     """
     
     # Set up argument parser
@@ -91,11 +178,26 @@ if __name__ == "__main__":
                        type=str,
                        default="./reference/test_combined_output",
                        help='Directory where combined JSON files will be saved')
+    parser.add_argument('--strict',
+                       action='store_true',
+                       help='Stop without combining if any page result is failed, empty, truncated or not JSON')
     
     args = parser.parse_args()
     
     print(f"Reading JSON files from: {args.input_dir}")
     print(f"Saving combined files to: {args.output_dir}")
+
+    # Report unusable page results before combining
+    problems = check_results(args.input_dir)
+    if problems:
+        for filename, problem in problems.items():
+            print(f"Unusable page result ({problem}): {filename}")
+        counts = {problem: list(problems.values()).count(problem) for problem in RESULT_PROBLEMS if problem in problems.values()}
+        print(f"{len(problems)} unusable page results: "
+              + ", ".join(f"{count} {problem}" for problem, count in counts.items())
+              + f". Repair them with: python ./source/Preprocess/RepairPages.py --output_dir {args.input_dir} --input_dir <extracted dir>")
+        if args.strict:
+            raise SystemExit(1)
     
     # Run the combine function
     results = combine_json_files(args.input_dir, args.output_dir)